@@ -0,0 +1,119 @@
+"""
+Rebuilds the history of protocol streams from eth_getLogs, for the pairs their registries
+follow, through the same decoding and pair info as the live collectors.
+
+Run from src/ with, for example:
+    python backfill.py --from-block 10000835 --protocols uniswap_v2 dodo --sink archive
+
+Progress is checkpointed per set of protocols every checkpoint_interval seconds and at
+the end of the run, each time once the sinks have written out everything before it, so
+running the same command again, after an interruption or a crash, picks up after the
+last range checkpointed.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import aiohttp
+import dotenv
+from helpers.backfill import LogBackfill, RateLimiter
+from helpers.checkpoints import CheckpointStore
+from helpers.protocols import ProtocolRuntime, decode_log, load_protocols
+from helpers.read_config import get_backfill_config, get_checkpoints_config, get_enabled_protocols
+from helpers.reconnect import rpc_request
+from sink_connector.archive_producer import ArchiveProducer
+from sink_connector.redis_producer import RedisProducer
+
+logging.basicConfig(level=logging.INFO)
+
+SINKS = {
+    "archive": ArchiveProducer,
+    "redis": RedisProducer,
+}
+
+async def backfill(names, from_block, to_block, sink):
+    env = dotenv.dotenv_values("./keys/.env")
+    conf = get_backfill_config()
+    endpoint = env[conf["rest_endpoint"]]
+    protocols = load_protocols(names)
+    unstreamed = [protocol.name for protocol in protocols if protocol.stream is None]
+    if unstreamed:
+        raise ValueError(f"protocols {unstreamed} have no stream to backfill")
+    runtime = ProtocolRuntime(protocols, {})
+    checkpoints = CheckpointStore(get_checkpoints_config()["directory"])
+    job = "backfill-" + "-".join(sorted(names))
+    checkpoint = checkpoints.load(job)
+    if checkpoint is not None and checkpoint >= from_block:
+        logging.info("Resuming %s after block %d", job, checkpoint)
+        from_block = checkpoint + 1
+
+    producers = {}
+    checkpoint_interval = float(conf["checkpoint_interval"])
+    last_checkpointed = time.monotonic()
+
+    async def write_checkpoint(restart=True):
+        # The sinks are written out first, so the checkpoint never gets ahead of what they have
+        for producer in producers.values():
+            await producer.close()
+            if restart:
+                producer.start_writer()
+        checkpoints.flush()
+
+    async def emit(start, end, logs):
+        nonlocal last_checkpointed
+        for log in logs:
+            try:
+                processed_log = decode_log(runtime.decoder, log)
+            except (KeyError, ValueError) as e:
+                logging.warning("Skipping log %s:%s that failed to decode: %r", log.get("transactionHash"), log.get("logIndex"), e)
+                continue
+            protocol = runtime.route(processed_log)
+            if protocol is not None:
+                await producers[protocol.stream].produce(processed_log['processedTimestamp'], json.dumps(processed_log))
+        checkpoints.update(job, end)
+        if time.monotonic() - last_checkpointed >= checkpoint_interval:
+            await write_checkpoint()
+            last_checkpointed = time.monotonic()
+
+    async with aiohttp.ClientSession() as session:
+        for protocol in runtime.protocols:
+            registry = runtime.registries[protocol.name]
+            await registry.load(session)
+            runtime.add_routes(protocol, registry.pairs.keys())
+        if to_block is None:
+            to_block = int(await rpc_request(session, endpoint, "eth_blockNumber", []), 16)
+        if from_block > to_block:
+            logging.info("Nothing to backfill, %s is already at block %d", job, from_block - 1)
+            return
+        logging.info("Backfilling %d pairs from block %d to %d", len(runtime.routes), from_block, to_block)
+        for protocol in runtime.protocols:
+            producers[protocol.stream] = SINKS[sink](protocol.stream)
+            producers[protocol.stream].start_writer()
+
+        scan = LogBackfill(session, endpoint, list(runtime.routes), runtime.decoder.topics, emit,
+                           RateLimiter(float(conf["requests_per_second"])), int(conf["num_workers"]),
+                           int(conf["initial_range"]), int(conf["min_range"]), int(conf["max_range"]),
+                           int(conf["window"]), int(conf["max_retries"]))
+        progress = asyncio.create_task(scan.log_progress(float(conf["progress_log_interval"])))
+        try:
+            await scan.run(from_block, to_block)
+        finally:
+            progress.cancel()
+            await write_checkpoint(restart=False)
+    logging.info("Backfilled %s to block %d, %d logs in %d requests", job, to_block, scan.num_logs, scan.num_requests)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfills protocol streams from eth_getLogs")
+    parser.add_argument("--from-block", type=int, required=True)
+    parser.add_argument("--to-block", type=int, help="defaults to the current head")
+    parser.add_argument("--protocols", nargs="+", help="defaults to the protocols enabled in config.ini")
+    parser.add_argument("--sink", choices=sorted(SINKS), default="archive")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        asyncio.run(backfill(args.protocols or get_enabled_protocols(), args.from_block, args.to_block, args.sink))
+    except KeyboardInterrupt:
+        print("\nExiting by user request.\n")
@@ -0,0 +1,63 @@
+"""
+Compares the per transaction and per block output modes of ethereum.py in Redis
+commands and bytes sent per block.
+
+Run from src/ with: python -m benchmarks.block_record_benchmark [transactions_per_block]
+"""
+import json
+import sys
+import time
+from helpers.normalise_block import normalise_block
+from helpers.normalise_transaction import normalise_transaction, normalise_block_transactions
+from benchmarks.synthetic import generate_chain
+
+STREAM = "ethereum-raw"
+MAXLEN = 100
+
+def resp_size(*args):
+    """
+    Size of a command as the Redis protocol puts it on the wire
+    """
+    size = len(f"*{len(args)}\r\n")
+    for arg in args:
+        arg = str(arg).encode("utf-8")
+        size += len(f"${len(arg)}\r\n") + len(arg) + 2
+    return size
+
+def xadd_size(key, value):
+    return resp_size("XADD", STREAM, "MAXLEN", "~", MAXLEN, "*", key, value)
+
+def transactions_mode(block):
+    block_msg = normalise_block(block)
+    commands = []
+    for transaction in block["transactions"]:
+        new_tx = normalise_transaction(transaction, block_msg)
+        commands.append((new_tx["tx_hash"], json.dumps(new_tx)))
+    return commands
+
+def blocks_mode(block):
+    block_msg = normalise_block(block)
+    record = normalise_block_transactions(block["transactions"], block_msg)
+    return [(block_msg["block_hash"], json.dumps(record))]
+
+def measure(mode, blocks):
+    start = time.perf_counter()
+    commands = [mode(block) for block in blocks]
+    elapsed = time.perf_counter() - start
+    num_commands = sum(len(block_commands) for block_commands in commands)
+    num_bytes = sum(xadd_size(key, value) for block_commands in commands for key, value in block_commands)
+    return num_commands / len(blocks), num_bytes / len(blocks), elapsed / len(blocks)
+
+def main():
+    transactions_per_block = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    blocks = generate_chain(15000000, 50, transactions_per_block)
+    print(f"{transactions_per_block} transactions per block")
+    results = {}
+    for name, mode in [("transactions", transactions_mode), ("blocks", blocks_mode)]:
+        results[name] = measure(mode, blocks)
+        commands, num_bytes, seconds = results[name]
+        print(f"  {name:12} {commands:6.0f} XADDs/block {num_bytes:10.0f} bytes/block {seconds * 10**3:7.2f}ms/block")
+    print(f"  blocks mode sends {results['blocks'][1] / results['transactions'][1]:.0%} of the bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+In-memory stand-ins for the external services the collectors talk to.
+"""
+import asyncio
+import threading
+from bisect import bisect_left, bisect_right
+import time
+import zlib
+from collections import deque
+from aiohttp import web
+
+class FakeKafkaMessage:
+    def __init__(self, topic, partition, offset, key, value):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+
+class FakeKafkaBroker:
+    """
+    Holds what has been delivered, per topic and partition, for fake producers to write to.
+    While down is set, every delivery fails.
+    """
+    def __init__(self, num_partitions=6, delivery_delay=0.0):
+        self.num_partitions = num_partitions
+        self.delivery_delay = delivery_delay
+        self.down = False
+        self.topics = {}
+        self.lock = threading.Lock()
+
+    def producer(self, conf):
+        return FakeKafkaProducer(self, conf)
+
+    def append(self, topic, key, value):
+        # A stable hash of the key stands in for librdkafka's partitioner
+        key_bytes = key if isinstance(key, bytes) else str(key).encode('utf-8')
+        partition = zlib.crc32(key_bytes) % self.num_partitions
+        with self.lock:
+            partitions = self.topics.setdefault(topic, [[] for _ in range(self.num_partitions)])
+            message = FakeKafkaMessage(topic, partition, len(partitions[partition]), key, value)
+            partitions[partition].append(message)
+        return message
+
+
+class FakeKafkaProducer:
+    """
+    Mimics the parts of confluent_kafka.Producer that KafkaProducer uses, including
+    BufferError once queue.buffering.max.messages are awaiting delivery
+    """
+    def __init__(self, broker, conf):
+        self.broker = broker
+        self.max_queued = int(conf.get('queue.buffering.max.messages', 100000))
+        self.queue = deque()
+        self.lock = threading.Lock()
+
+    def produce(self, topic, key=None, value=None, on_delivery=None, partition=-1):
+        with self.lock:
+            if len(self.queue) >= self.max_queued:
+                raise BufferError("Local: Queue full")
+            self.queue.append((topic, key, value, on_delivery))
+
+    def poll(self, timeout=0):
+        if self.broker.delivery_delay:
+            time.sleep(self.broker.delivery_delay)
+        with self.lock:
+            pending = list(self.queue)
+            self.queue.clear()
+        if not pending and timeout:
+            time.sleep(min(timeout, 0.001))
+        for topic, key, value, on_delivery in pending:
+            if self.broker.down:
+                if on_delivery is not None:
+                    on_delivery("Local: Broker transport failure", FakeKafkaMessage(topic, -1, -1, key, value))
+                continue
+            message = self.broker.append(topic, key, value)
+            if on_delivery is not None:
+                on_delivery(None, message)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        while self.queue:
+            time.sleep(0.001)
+        return 0
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class FakeRedis:
+    """
+    Takes pipelined XADDs the way the aioredis client RedisProducer writes with does,
+    keeping every entry, untrimmed, with when its pipeline was acknowledged. Each
+    pipeline takes latency seconds to execute, as a round trip to Redis would.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.streams = {}
+        self.num_pipelines = 0
+
+    def pipeline(self, transaction=True):
+        return FakeRedisPipeline(self)
+
+    async def delete(self, *names):
+        for name in names:
+            self.streams.pop(name, None)
+
+    def entries(self):
+        """
+        Every (stream, key, value, acknowledged) written, in the order they were
+        """
+        return [(stream, key, value, acked) for stream, stream_entries in self.streams.items()
+                for fields, acked in stream_entries for key, value in fields.items()]
+
+
+class FakeRedisPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.commands = []
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        self.commands.append((name, fields))
+        return self
+
+    async def execute(self):
+        if self.redis.latency:
+            await asyncio.sleep(self.redis.latency)
+        acked = time.time()
+        for name, fields in self.commands:
+            self.redis.streams.setdefault(name, []).append((fields, acked))
+        self.redis.num_pipelines += 1
+        return [None] * len(self.commands)
+
+
+class MemoryProducer:
+    """
+    A sink keeping what is produced to it in memory, with produce, produce_to,
+    produce_batch, start_writer and close like RedisProducer
+    """
+    def __init__(self, topic):
+        self.topic = topic
+        self.messages = []
+
+    def start_writer(self):
+        pass
+
+    async def produce(self, key, msg, created=None):
+        return await self.produce_to(self.topic, key, msg, created)
+
+    async def produce_to(self, stream, key, msg, created=None):
+        self.messages.append((stream, key, msg))
+        return 1
+
+    async def produce_batch(self, stream, entries):
+        self.messages.extend((stream, key, msg) for key, msg, _ in entries)
+        return len(entries)
+
+    async def pipeline_produce(self, key_field, events, created=None):
+        for event in events:
+            self.messages.append((self.topic, event[key_field], event))
+
+    async def close(self):
+        pass
+
+
+class FakeWebsocket:
+    """
+    Yields frames like a websockets connection being read with async for, keeping
+    whatever is sent back
+    """
+    def __init__(self, frames):
+        self.frames = frames
+        self.sent = []
+
+    def __aiter__(self):
+        return self.receive()
+
+    async def receive(self):
+        for frame in self.frames:
+            yield frame
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class FakeSubgraph:
+    """
+    Serves the V3 factory and pools queries over local HTTP from an in-memory pool list.
+
+    Only the query variables are interpreted, which is all the paginated collector
+    sends. Setting fail_requests makes that many of the following requests fail.
+    """
+    def __init__(self, pools, meta=None):
+        self.pools = pools
+        self.meta = meta or {"poolCount": str(len(pools)), "txCount": "0"}
+        self.fail_requests = 0
+        self.num_requests = 0
+        self.runner = None
+
+    async def handle(self, request):
+        self.num_requests += 1
+        if self.fail_requests:
+            self.fail_requests -= 1
+            return web.json_response({"errors": [{"message": "indexing error"}]})
+        body = await request.json()
+        if "factory(" in body["query"]:
+            return web.json_response({"data": {"factory": self.meta}})
+        variables = body["variables"]
+        min_tvl = float(variables["minTvl"])
+        matching = sorted((pool for pool in self.pools
+                           if variables["cursor"] < pool["id"] <= variables["last"]
+                           and float(pool["totalValueLockedUSD"]) > min_tvl), key=lambda pool: pool["id"])
+        return web.json_response({"data": {"pools": matching[:variables["first"]]}})
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_post("/", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+        return f"http://127.0.0.1:{port}/"
+
+    async def close(self):
+        await self.runner.cleanup()
+
+
+class FakeNode:
+    """
+    Serves eth_blockNumber and eth_getLogs over local HTTP from an in-memory log list.
+
+    Like hosted nodes, eth_getLogs refuses any request matching more than max_results
+    logs. Setting fail_requests makes that many of the following requests fail with
+    an HTTP 429.
+    """
+    def __init__(self, logs, max_results=10000):
+        self.logs = sorted(logs, key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)))
+        self.block_numbers = [int(log["blockNumber"], 16) for log in self.logs]
+        self.head = self.block_numbers[-1]
+        self.max_results = max_results
+        self.fail_requests = 0
+        self.num_requests = 0
+        self.num_refused = 0
+        self.runner = None
+
+    async def handle(self, request):
+        self.num_requests += 1
+        if self.fail_requests:
+            self.fail_requests -= 1
+            return web.Response(status=429, text="rate limited")
+        body = await request.json()
+        if body["method"] == "eth_blockNumber":
+            return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": hex(self.head)})
+        log_filter = body["params"][0]
+        from_block, to_block = int(log_filter["fromBlock"], 16), int(log_filter["toBlock"], 16)
+        addresses = set(log_filter["address"])
+        topics = set(log_filter["topics"][0])
+        in_range = self.logs[bisect_left(self.block_numbers, from_block):bisect_right(self.block_numbers, to_block)]
+        matching = [log for log in in_range if log["address"] in addresses and log["topics"][0] in topics]
+        if len(matching) > self.max_results:
+            self.num_refused += 1
+            return web.json_response({"jsonrpc": "2.0", "id": body["id"],
+                                      "error": {"code": -32005, "message": f"query returned more than {self.max_results} results"}})
+        return web.json_response({"jsonrpc": "2.0", "id": body["id"], "result": matching})
+
+    async def start(self, port):
+        app = web.Application(client_max_size=2 ** 24)
+        app.router.add_post("/", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+        return f"http://127.0.0.1:{port}/"
+
+    async def close(self):
+        await self.runner.cleanup()
@@ -0,0 +1,106 @@
+"""
+Feeds synthetic Coinbase frames through the fan out with the normalised sink's Redis
+slowed down, once per overflow policy, against a run where every sink keeps up.
+Reports how fast the websocket was read, how soon the raw and trades sinks had
+everything, and what the slow sink got, dropped and spilled.
+
+Run from src/ with: python -m benchmarks.fanout_harness [num_frames] [slow_latency] [queue_size]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+from benchmarks.fakes import FakeRedis, FakeWebsocket
+from benchmarks.suite import create_redis_producer, normalise_coinbase
+from benchmarks.synthetic import generate_coinbase_frames
+from sink_connector.fanout import FanOut, SinkQueue, fan_out_messages
+from sink_connector.spool import Spool
+
+BURST_SIZE = 50
+
+class TimedWebsocket(FakeWebsocket):
+    """
+    Notes when the last frame has been read, then stays open until closed, so that the
+    fan out keeps replaying what it spilled
+    """
+    def __init__(self, frames):
+        super().__init__(frames)
+        self.closed = asyncio.Event()
+
+    async def receive(self):
+        for i, frame in enumerate(self.frames):
+            yield frame
+            # Frames come off the socket in bursts, letting the sinks' tasks run in between
+            if i % BURST_SIZE == BURST_SIZE - 1:
+                await asyncio.sleep(0)
+        self.finished = time.perf_counter()
+        await self.closed.wait()
+
+async def wait_for(condition, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("sinks didn't catch up in time")
+        await asyncio.sleep(0.001)
+
+async def run(frames, overflow, slow_latency, queue_size):
+    redis = {kind: FakeRedis(slow_latency if kind == "normalised" and overflow else 0.0) for kind in ("raw", "normalised", "trades")}
+    queues = {}
+    for kind, fake in redis.items():
+        producer = create_redis_producer(f"fanout-harness-{kind}", fake)
+        queues[kind] = SinkQueue(f"harness-{kind}", producer, producer.topic, queue_size,
+                                 overflow=overflow if kind == "normalised" and overflow else "block")
+        if queues[kind].spool is not None:
+            queues[kind].spool = Spool(tempfile.mkdtemp(), replay_rate=50000)
+    fanout = FanOut({kind: [queue] for kind, queue in queues.items()})
+    slow = queues["normalised"]
+    # The counters are kept across runs by the metrics registry
+    dropped, spilled = slow.num_dropped.value, slow.num_spilled.value
+
+    def delivered(kind):
+        return len(redis[kind].entries())
+
+    ws = TimedWebsocket(frames)
+    started = time.perf_counter()
+    task = asyncio.create_task(fan_out_messages(ws, fanout, normalise_coinbase, "fanout-harness"))
+    await wait_for(lambda: delivered("raw") >= len(frames) and delivered("trades") >= fanout.counts["trades"]
+                   and hasattr(ws, "finished"))
+    others_done = time.perf_counter() - started
+    read = ws.finished - started
+    at_read = delivered("normalised")
+    if slow.spool is not None:
+        await wait_for(lambda: not slow.spool.segments and not slow.entries)
+    ws.closed.set()
+    await task
+    for queue in queues.values():
+        await queue.producer.close()
+    return {
+        "read_rate": len(frames) / read,
+        "others_done": others_done,
+        "normalised": fanout.counts["normalised"],
+        "at_read": at_read,
+        "final": delivered("normalised"),
+        "dropped": slow.num_dropped.value - dropped,
+        "spilled": slow.num_spilled.value - spilled,
+        "total": time.perf_counter() - started,
+    }
+
+async def main():
+    num_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    slow_latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    queue_size = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    frames = generate_coinbase_frames(num_frames)
+    print(f"{num_frames} frames, normalised sink taking {slow_latency * 1000:g}ms a batch, queues of {queue_size}")
+    print(f"{'overflow':<12} {'read/s':>8} {'raw+trades done':>16} {'normalised':>10} {'at read end':>11} {'final':>7} {'dropped':>8} {'spilled':>8} {'total':>7}")
+    ok = True
+    for overflow in (None, "block", "drop-oldest", "spill"):
+        result = await run(frames, overflow, slow_latency, queue_size)
+        # Only dropping loses anything
+        ok = ok and result["final"] + result["dropped"] == result["normalised"]
+        print(f"{overflow or 'all fast':<12} {result['read_rate']:8.0f} {result['others_done']:15.2f}s {result['normalised']:10d} "
+              f"{result['at_read']:11d} {result['final']:7d} {result['dropped']:8d} {result['spilled']:8d} {result['total']:6.2f}s")
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
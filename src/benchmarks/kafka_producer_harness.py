@@ -0,0 +1,87 @@
+"""
+Exercises KafkaProducer against an in-memory broker stand-in: delivery futures,
+key partitioning, ordering, and that a full local queue never stalls the loop.
+
+Run from src/ with: python -m benchmarks.kafka_producer_harness [num_messages]
+"""
+import asyncio
+import sys
+import time
+from functools import partial
+from sink_connector.kafka_producer import KafkaProducer, PROFILES
+from benchmarks.fakes import FakeKafkaBroker
+
+TOPIC = "harness"
+
+async def measure_loop_lag(stop, interval=0.001):
+    """
+    Returns the longest the loop was held up past a short sleep
+    """
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+def bounded_producer(broker, max_queued, conf):
+    return broker.producer(dict(conf, **{'queue.buffering.max.messages': max_queued}))
+
+async def run(producer_class, profile, num_messages, num_keys=64):
+    producer = KafkaProducer(TOPIC, profile=profile, producer_class=producer_class)
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    start = time.perf_counter()
+    futures = []
+    for i in range(num_messages):
+        futures.append(producer.produce(f"key-{i % num_keys}", f"{i}".encode('utf-8')))
+        # Hand the loop back now and then, as a websocket reader would between frames
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    # Only the producing side is measured, resolving every future at the end is our own doing
+    stop.set()
+    lag = await lag_task
+    delivered = await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    await producer.close()
+    return delivered, elapsed, lag
+
+def check_partitioning(broker, delivered):
+    errors = []
+    key_partitions = {}
+    last_value = {}
+    for message in delivered:
+        if key_partitions.setdefault(message.key(), message.partition()) != message.partition():
+            errors.append(f"key {message.key()} written to more than one partition")
+        value = int(message.value())
+        if value < last_value.get(message.key(), -1):
+            errors.append(f"key {message.key()} delivered out of order")
+        last_value[message.key()] = value
+    used = sum(1 for partition in broker.topics[TOPIC] if partition)
+    return errors, used
+
+async def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    failed = False
+    cases = [
+        # Roomy local queue, and one small enough to keep raising BufferError
+        ("roomy queue", 1000000, 0.0),
+        ("full queue", 500, 0.002),
+    ]
+    for profile in PROFILES:
+        for name, max_queued, delivery_delay in cases:
+            broker = FakeKafkaBroker(delivery_delay=delivery_delay)
+            delivered, elapsed, lag = await run(partial(bounded_producer, broker, max_queued), profile, num_messages)
+            errors, used = check_partitioning(broker, delivered)
+            if len(delivered) != num_messages:
+                errors.append(f"{len(delivered)} of {num_messages} delivered")
+            print(f"{profile:10} {name:11} {num_messages / elapsed:10.0f} msgs/s, {used} partitions used, "
+                  f"worst loop lag {lag * 10**3:.1f}ms")
+            for error in errors[:5]:
+                print("  FAIL:", error)
+            failed = failed or bool(errors)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+Compares the precompiled LogDecoder against the web3 processLog path it replaced.
+
+Run from src/ with: python -m benchmarks.log_decoder_benchmark [num_logs]
+"""
+import copy
+import json
+import sys
+import time
+from web3 import Web3
+from hexbytes import HexBytes
+from helpers.log_decoder import LogDecoder
+from helpers.protocols import load_protocols, process_log
+from benchmarks.synthetic import generate_logs, random_hex
+
+class Web3JsonEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, HexBytes):
+            return obj.hex()
+        if obj.__class__.__name__ == "AttributeDict":
+            return obj.__dict__
+        return super().default(obj)
+
+def convert_list_to_hexbytes(list_):
+    for i in range(len(list_)):
+        if isinstance(list_[i], str):
+            list_[i] = HexBytes(list_[i])
+        elif isinstance(list_[i], list):
+            convert_list_to_hexbytes(list_[i])
+        elif isinstance(list_[i], dict):
+            convert_dict_to_hexbytes(list_[i])
+    return list_
+
+def convert_dict_to_hexbytes(dict_):
+    for key in dict_:
+        if isinstance(dict_[key], str):
+            dict_[key] = HexBytes(dict_[key])
+        elif isinstance(dict_[key], dict):
+            convert_dict_to_hexbytes(dict_[key])
+        elif isinstance(dict_[key], list):
+            convert_list_to_hexbytes(dict_[key])
+    return dict_
+
+def web3_process_pair_log(contract, log, topics, pairs, exchange, fields):
+    """
+    The processing path the subscribers used before LogDecoder
+    """
+    event_name = topics[log['topics'][0]]
+    hex_log = convert_dict_to_hexbytes(log.copy())
+    processed_log = getattr(contract.events, event_name)().processLog(hex_log).__dict__
+    event_pair_info = pairs[processed_log['address'].hex()]
+    processed_log['blockNumber'] = int(processed_log['blockNumber'].hex(), 16)
+    processed_log['logIndex'] = int(processed_log['logIndex'].hex(), 16)
+    processed_log['transactionIndex'] = int(processed_log['transactionIndex'].hex(), 16)
+    processed_log['type'] = processed_log.pop('event')
+    processed_log['exchange'] = exchange
+    processed_log['data'] = processed_log.pop('args').__dict__
+    for field in fields:
+        processed_log['data'][field] = event_pair_info[field]
+    processed_log['processedTimestamp'] = int(time.time() * (10 ** 3))
+    return processed_log
+
+def time_path(process, logs):
+    start = time.perf_counter()
+    outputs = [process(log) for log in logs]
+    return time.perf_counter() - start, outputs
+
+def encode_outputs(outputs):
+    # The processing timestamp differs between runs, so it is excluded from the comparison
+    return [json.dumps({**output, 'processedTimestamp': 0}, cls=Web3JsonEncoder) for output in outputs]
+
+def main():
+    num_logs = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    web3 = Web3()
+    for protocol in load_protocols(["uniswap_v2", "dodo"]):
+        exchange, event_names, fields = protocol.exchange, protocol.event_names, list(protocol.pair_fields)
+        with open(protocol.abi_path) as f:
+            abi = json.load(f)
+        pairs = {"0x" + random_hex(20): {field: field + str(i) for field in fields} for i in range(100)}
+        logs = generate_logs(abi, event_names, list(pairs.keys()), num_logs)
+
+        contract = web3.eth.contract(abi=abi)
+        decoder = LogDecoder(abi, event_names)
+        topics = {topic: layout[0] for topic, layout in decoder.layouts.items()}
+
+        # The web3 path converts the topics of its input in place, so it gets its own copy
+        web3_time, web3_outputs = time_path(
+            lambda log: web3_process_pair_log(contract, log, topics, pairs, exchange, fields), copy.deepcopy(logs))
+        decoder_time, decoder_outputs = time_path(
+            lambda log: process_log(protocol, decoder, log, pairs), logs)
+
+        identical = encode_outputs(web3_outputs) == encode_outputs(decoder_outputs)
+        print(f"{exchange}: {num_logs} logs")
+        print(f"  web3 processLog: {num_logs / web3_time:12.0f} logs/s")
+        print(f"  LogDecoder:      {num_logs / decoder_time:12.0f} logs/s ({web3_time / decoder_time:.1f}x)")
+        print(f"  identical output: {identical}")
+        if not identical:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares LOB events and trades kept as the dicts create_lob_event and
+create_market_order used to return against their slotted records: the memory each
+holds, and the bytes and time it takes to encode each as verbose and positional JSON,
+with every JSON backend installed.
+
+Run from src/ with: python -m benchmarks.record_benchmark [num_events]
+"""
+import sys
+import time
+import tracemalloc
+from helpers.json_backend import get_json_backend, orjson
+from helpers.records import LobEvent, MarketOrder, create_encoder, decode_message
+from benchmarks.synthetic import random_book_change
+
+def lob_event_values(i):
+    side, price, size = random_book_change(20000.0)
+    return dict(quote_no=i, side=1 if side == "buy" else 2, price=float(price), size=float(size), lob_action=2,
+                event_timestamp=1660000000000 + i, receive_timestamp=1660000000005 + i)
+
+def market_order_values(i):
+    side, price, size = random_book_change(20000.0)
+    return dict(order_id=i, price=float(price), trade_id=str(i), timestamp=1660000000000 + i,
+                side=1 if side == "buy" else 2, size=float(size), msg_original_type="match")
+
+def measure_memory(build, values):
+    tracemalloc.start()
+    items = [build(item) for item in values]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return current / len(values)
+
+def measure_encoding(encode, items):
+    started = time.perf_counter()
+    encoded = [encode(item) for item in items]
+    elapsed = time.perf_counter() - started
+    return sum(len(data) for data in encoded) / len(items), elapsed / len(items), encoded
+
+def compare(record_type, values):
+    print(f"{record_type.__name__}, {len(record_type.FIELDS)} fields")
+    as_dict = measure_memory(lambda item: record_type(**item).to_dict(), values)
+    as_record = measure_memory(lambda item: record_type(**item), values)
+    print(f"  memory     dict {as_dict:7.0f} bytes, record {as_record:6.0f} bytes, {as_record / as_dict:.0%} of the dict")
+    records = [record_type(**item) for item in values]
+    backends = ["json"] + (["orjson"] if orjson is not None else [])
+    ok = True
+    for backend in backends:
+        dumps = get_json_backend(backend)[1]
+        loads = get_json_backend(backend)[0]
+        verbose_bytes, verbose_time, _ = measure_encoding(create_encoder(False, dumps), records)
+        positional_bytes, positional_time, encoded = measure_encoding(create_encoder(True, dumps), records)
+        ok = ok and [decode_message(loads(data)) for data in encoded] == records
+        print(f"  {backend:<7}    verbose {verbose_bytes:5.0f} bytes/event {verbose_time * 10**6:5.2f}us, "
+              f"positional {positional_bytes:5.0f} bytes/event {positional_time * 10**6:5.2f}us, "
+              f"{positional_bytes / verbose_bytes:.0%} of the bytes")
+    return ok
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    ok = compare(LobEvent, [lob_event_values(i) for i in range(num_events)])
+    ok = compare(MarketOrder, [market_order_values(i) for i in range(num_events)]) and ok
+    print(f"  positional round trips back to the same records: {ok}")
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Reads three streams of synthetic LOB events and trades with RedisConsumer, with one
+and with several readers and handlers that take a while, checking each message is
+handled exactly once and acknowledged. Then crashes a consumer part way through and
+checks another consumer of the group claims and handles what it left pending.
+
+Needs the Redis configured in keys/.env, e.g. a local redis-server.
+Run from src/ with: python -m benchmarks.redis_consumer_harness [messages_per_stream]
+"""
+import asyncio
+import logging
+import sys
+import time
+from helpers.records import MarketOrder, LobEvent, create_encoder
+from sink_connector.redis_consumer import RedisConsumer
+
+STREAMS = ["harness-consumer-raw", "harness-consumer-normalised", "harness-consumer-trades"]
+GROUP = "harness"
+
+async def fill_streams(pool, num_messages):
+    await pool.delete(*STREAMS)
+    positional = create_encoder(True)
+    for stream in STREAMS:
+        async with pool.pipeline(transaction=False) as pipe:
+            for i in range(num_messages):
+                if stream.endswith("normalised"):
+                    msg = positional(LobEvent(quote_no=i, price=20000.5, size=0.25, side=1))
+                elif stream.endswith("trades"):
+                    msg = positional(MarketOrder(order_id=i, price=20000.5, size=0.25, side=2))
+                else:
+                    msg = positional({"type": "l2update", "sequence": i})
+                pipe.xadd(stream, fields={str(i): msg})
+            await pipe.execute()
+
+async def num_pending(pool):
+    return sum([(await pool.xpending(stream, GROUP))["pending"] for stream in STREAMS])
+
+async def wait_for(condition, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not await condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("messages weren't all handled in time")
+        await asyncio.sleep(0.01)
+
+async def consume(num_messages, num_consumers, handler_latency):
+    handled = []
+
+    async def handler(stream, message_id, key, message):
+        if handler_latency:
+            await asyncio.sleep(handler_latency)
+        # Positionally encoded records come back as records
+        assert stream.endswith("raw") or isinstance(message, (LobEvent, MarketOrder))
+        handled.append((stream, message_id))
+
+    consumer = RedisConsumer(STREAMS, GROUP, handler, "harness", num_consumers=num_consumers)
+    consumer.start_id = "0"
+    await consumer.pool.delete(*STREAMS)
+    await fill_streams(consumer.pool, num_messages)
+    total = num_messages * len(STREAMS)
+    started = time.perf_counter()
+    task = asyncio.create_task(consumer.run())
+
+    async def done():
+        return len(handled) >= total and not await num_pending(consumer.pool)
+
+    await wait_for(done)
+    elapsed = time.perf_counter() - started
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    exactly_once = len(handled) == len(set(handled)) == total
+    await consumer.pool.delete(*STREAMS)
+    return total / elapsed, exactly_once
+
+async def crash_and_claim(num_messages):
+    """
+    The first consumer hangs on every tenth message and is stopped without handling them,
+    the second claims them once they have been idle for min_idle_ms
+    """
+    handled = set()
+
+    async def hanging_handler(stream, message_id, key, message):
+        if int(key) % 10 == 0:
+            await asyncio.Future()
+        handled.add((stream, message_id))
+
+    async def handler(stream, message_id, key, message):
+        handled.add((stream, message_id))
+
+    crashing = RedisConsumer(STREAMS, GROUP, hanging_handler, "crashing", num_consumers=2)
+    crashing.start_id = "0"
+    crashing.shutdown_timeout = 0.1
+    await crashing.pool.delete(*STREAMS)
+    await fill_streams(crashing.pool, num_messages)
+    total = num_messages * len(STREAMS)
+    task = asyncio.create_task(crashing.run())
+
+    async def all_read():
+        return len(handled) >= total - total // 10
+
+    await wait_for(all_read)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    left_pending = await num_pending(crashing.pool)
+
+    claiming = RedisConsumer(STREAMS, GROUP, handler, "claiming", num_consumers=2)
+    claiming.min_idle_ms = 200
+    claiming.claim_interval = 0.1
+    started = time.perf_counter()
+    task = asyncio.create_task(claiming.run())
+
+    async def done():
+        return len(handled) >= total and not await num_pending(claiming.pool)
+
+    await wait_for(done)
+    elapsed = time.perf_counter() - started
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await claiming.pool.delete(*STREAMS)
+    return left_pending, claiming.num_claimed.value, elapsed, len(handled) == total
+
+async def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"{num_messages} messages in each of {len(STREAMS)} streams")
+    ok = True
+    for num_consumers, handler_latency in [(1, 0), (4, 0), (1, 0.001), (4, 0.001)]:
+        rate, exactly_once = await consume(num_messages, num_consumers, handler_latency)
+        ok = ok and exactly_once
+        print(f"  {num_consumers} readers, handlers taking {handler_latency * 1000:g}ms: {rate:8.0f} msgs/s, "
+              f"each handled once and acknowledged: {exactly_once}")
+    left_pending, claimed, elapsed, all_handled = await crash_and_claim(num_messages // 10)
+    ok = ok and all_handled and claimed >= left_pending > 0
+    print(f"  crashed consumer left {left_pending} pending, {claimed} claimed and handled by another in {elapsed:.2f}s, "
+          f"all handled: {all_handled}")
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+"""
+Compares awaiting one XADD per message against the coalescing background writer.
+
+Needs the Redis configured in keys/.env, e.g. a local redis-server.
+Run from src/ with: python -m benchmarks.redis_writer_benchmark [num_messages]
+"""
+import asyncio
+import json
+import sys
+import time
+from sink_connector.redis_producer import RedisProducer
+
+STREAM = "benchmark-redis-writer"
+
+def make_message(i):
+    return json.dumps({"quote_no": i, "price": 20000.5 + i % 100, "size": 0.25, "side": i % 2, "event_timestamp": 1660000000000 + i})
+
+async def produce_all(producer, messages):
+    start = time.perf_counter()
+    for i, msg in enumerate(messages):
+        await producer.produce(i, msg)
+    enqueued = time.perf_counter() - start
+    await producer.close()
+    return enqueued, time.perf_counter() - start
+
+async def main():
+    num_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    messages = [make_message(i) for i in range(num_messages)]
+
+    producer = RedisProducer(STREAM)
+    await producer.pool.delete(STREAM)
+    _, direct = await produce_all(producer, messages)
+
+    producer.start_writer()
+    enqueued, coalesced = await produce_all(producer, messages)
+    await producer.pool.delete(STREAM)
+
+    print(f"{num_messages} messages to {producer.redis_host}")
+    print(f"  one XADD per message: {num_messages / direct:10.0f} msgs/s")
+    print(f"  coalescing writer:    {num_messages / coalesced:10.0f} msgs/s ({direct / coalesced:.1f}x), "
+          f"callers held for {enqueued / num_messages * 10**6:.1f}us per message")
+
+if __name__ == "__main__":
+    asyncio.run(main())
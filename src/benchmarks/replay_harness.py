@@ -0,0 +1,135 @@
+"""
+Captures a bursty synthetic exchange session off a local websocket, then replays it
+through ws_to_redis.produce_messages at 1x, 10x and maximum speed: checks every frame
+comes through unchanged and in order, and reports how closely each replay keeps time.
+Also replays a captured logs subscription to a LogSubscription that numbers its
+requests differently, checking the subscription is still set up and fed.
+
+Run from src/ with: python -m benchmarks.replay_harness [num_frames] [burst_size]
+"""
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import sys
+import tempfile
+import time
+import websockets
+from benchmarks.fakes import FakeRedis
+from benchmarks.suite import cancel_leftover_tasks, create_redis_producer, normalise_coinbase
+from benchmarks.synthetic import generate_coinbase_frames, log_notification, random_hex
+from helpers.capture import CaptureWriter, CapturingWebsocket, ReplayServer, find_connections, read_capture
+from helpers.log_subscription import LogSubscription, parse_notification
+from sink_connector.ws_to_redis import produce_messages
+
+EXCHANGE_PORT = 8571
+REPLAY_PORT = 8572
+BURST_INTERVAL = 0.05
+
+async def capture_exchange(directory, frames, burst_size):
+    """
+    Serves frames in bursts of burst_size every BURST_INTERVAL, capturing them on the client side
+    """
+    async def handle(ws, path):
+        for i in range(0, len(frames), burst_size):
+            for frame in frames[i:i + burst_size]:
+                await ws.send(frame)
+            await asyncio.sleep(BURST_INTERVAL)
+        await ws.close()
+
+    server = await websockets.serve(handle, "127.0.0.1", EXCHANGE_PORT)
+    writer = CaptureWriter(directory, "coinbase-raw")
+    async with websockets.connect(f"ws://127.0.0.1:{EXCHANGE_PORT}") as ws:
+        with CapturingWebsocket(ws, writer) as capturing:
+            captured = [frame async for frame in capturing]
+    server.close()
+    await server.wait_closed()
+    return captured
+
+async def wait_for(condition, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("replay didn't finish in time")
+        await asyncio.sleep(0.001)
+
+async def replay_exchange(directory, frames, speed):
+    server = ReplayServer(find_connections([directory]), speed)
+    endpoint = await server.start("127.0.0.1", REPLAY_PORT)
+    redis = FakeRedis()
+    producers = [create_redis_producer(f"replay-coinbase-{kind}", redis) for kind in ("raw", "normalised", "trades")]
+    # produce_messages prints its running totals
+    with contextlib.redirect_stdout(io.StringIO()):
+        async with websockets.connect(endpoint, max_size=None) as ws:
+            started = time.perf_counter()
+            task = asyncio.create_task(produce_messages(ws, *producers, normalise_coinbase))
+            await wait_for(lambda: len(redis.streams.get("replay-coinbase-raw", [])) >= len(frames))
+            elapsed = time.perf_counter() - started
+            for producer in producers:
+                await producer.close()
+            await cancel_leftover_tasks()
+    await server.close()
+    # The raw messages are enriched with when they were received before they are written
+    raw = [json.loads(value) for stream, _, value, _ in redis.entries() if stream == "replay-coinbase-raw"]
+    for message in raw:
+        message.pop("receive_timestamp", None)
+    return elapsed, raw == [json.loads(frame) for frame in frames]
+
+async def replay_logs(directory, num_logs=500):
+    """
+    Captures a logs subscription made with request id 1 and replays it to one asking with id 7
+    """
+    subscription_id = "0x" + random_hex(16)
+    writer = CaptureWriter(directory, "logs-node")
+    now = time.time()
+    writer.write(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["logs", {}]}), sent=True, timestamp=now)
+    writer.write(json.dumps({"jsonrpc": "2.0", "id": 1, "result": subscription_id}), timestamp=now + 0.01)
+    for i in range(num_logs):
+        log = {"address": "0x" + random_hex(20), "blockNumber": hex(15000000 + i // 10), "logIndex": hex(i % 10)}
+        writer.write(log_notification(log, subscription_id), timestamp=now + 0.02 + i * 0.0001)
+    writer.close()
+
+    server = ReplayServer(find_connections([directory]), None)
+    endpoint = await server.start("127.0.0.1", REPLAY_PORT)
+    received = []
+
+    async def on_notification(frame, expected_subscription_id):
+        log = parse_notification(frame, expected_subscription_id)
+        if log is not None:
+            received.append(log)
+
+    subscription = LogSubscription(endpoint, ["0x" + random_hex(20)], ["0x" + random_hex(32)], on_notification)
+    subscription.request_ids = itertools.count(7)
+    task = asyncio.create_task(subscription.run())
+    await wait_for(lambda: len(received) >= num_logs, timeout=30)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await server.close()
+    return len(received)
+
+async def main():
+    num_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    burst_size = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    frames = generate_coinbase_frames(num_frames)
+    directory = tempfile.mkdtemp()
+    captured = await capture_exchange(directory, frames, burst_size)
+    timestamps = [timestamp for parts in find_connections([directory]) for timestamp, _, _ in read_capture(parts)]
+    duration = timestamps[-1] - timestamps[0]
+    ok = captured == frames
+    print(f"Captured {len(captured)} frames in bursts of {burst_size}, {duration:.2f}s from first to last")
+    for speed in (1.0, 10.0, None):
+        elapsed, matches = await replay_exchange(directory, frames, speed)
+        ok = ok and matches
+        label = f"{speed:g}x" if speed else "max"
+        target = f" (paced for {duration / speed:.2f}s)" if speed else ""
+        print(f"  {label:>4}: {elapsed:6.2f}s{target}, {num_frames / elapsed:8.0f} frames/s, frames match: {matches}")
+
+    num_logs = await replay_logs(tempfile.mkdtemp())
+    print(f"  logs subscription replayed with new request ids: {num_logs} of 500 notifications")
+    ok = ok and num_logs == 500
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
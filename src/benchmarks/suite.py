@@ -0,0 +1,352 @@
+"""
+Runs each stage of the collectors, and the whole block, log and exchange pipelines, over
+synthetic traffic into in-memory sinks, and reports msgs/s, p50/p99 latency and the
+memory each item costs. Needs no node, Redis, Kafka or exchange.
+
+Run from src/ with, for example:
+    python -m benchmarks.suite
+    python -m benchmarks.suite --stages process_log pipeline_logs --scale 2
+    python -m benchmarks.suite --check --baseline before.json
+
+--check fails the run when a stage misses a limit in benchmarks/thresholds.json, and
+--baseline when it has fallen more than --tolerance behind a run saved with --save.
+Latency is per call for single stages, and from receive to the sink acknowledging the
+message for producers and pipelines; as those are fed as fast as they take input, it
+includes the time messages spend queued behind each other. Bytes per item is what the items' output holds on
+to, measured in a second, traced run so tracing doesn't skew the timings.
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+
+# Before anything imports ethereum.py, which would log every block produced otherwise
+logging.basicConfig(level=logging.WARNING)
+
+from benchmarks.fakes import FakeKafkaBroker, FakeRedis, FakeWebsocket
+from benchmarks.synthetic import (generate_chain, generate_coinbase_frames, generate_huobi_frames, generate_log_bursts,
+                                  log_notification, random_hex)
+from helpers.decode_pool import DecodePool
+from helpers.normalise_block import normalise_block
+from helpers.normalise_transaction import normalise_transaction
+from helpers.protocols import ProtocolRuntime, decode_log, load_protocols, process_log
+from helpers.frames import create_frame_decoder
+from helpers.util import create_lob_event, create_market_order
+from sink_connector.kafka_producer import KafkaProducer
+from sink_connector.redis_producer import RedisProducer
+
+THRESHOLDS_PATH = "benchmarks/thresholds.json"
+SUBSCRIPTION_ID = "0x" + "ab" * 16
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class StageResult:
+    def __init__(self, name, num_items, elapsed, latencies):
+        self.name = name
+        self.num_items = num_items
+        self.msgs_per_s = num_items / elapsed if elapsed else 0.0
+        latencies = sorted(latencies)
+        self.p50_us = percentile(latencies, 0.5) * 10 ** 6
+        self.p99_us = percentile(latencies, 0.99) * 10 ** 6
+        self.bytes_per_item = None
+        self.peak_kib = None
+
+    def as_dict(self):
+        return {
+            "items": self.num_items,
+            "msgs_per_s": round(self.msgs_per_s, 1),
+            "p50_us": round(self.p50_us, 1),
+            "p99_us": round(self.p99_us, 1),
+            "bytes_per_item": self.bytes_per_item,
+            "peak_kib": self.peak_kib,
+        }
+
+
+class Data:
+    """
+    Every stage's input, generated once and up front so it is neither timed nor traced
+    """
+    def __init__(self, scale):
+        random.seed(1660000000)
+        self.blocks = generate_chain(15000000, max(1, int(20 * scale)), 200)
+        self.transactions = [(transaction, normalise_block(block)) for block in self.blocks for transaction in block["transactions"]]
+
+        self.protocol = load_protocols(["uniswap_v2"])[0]
+        self.pairs = {"0x" + random_hex(20): {field: f"{field}-{i}" for field in self.protocol.pair_fields} for i in range(200)}
+        with open(self.protocol.abi_path) as f:
+            abi = json.load(f)
+        self.logs = generate_log_bursts(abi, self.protocol.event_names, list(self.pairs), max(1, int(300 * scale)))
+        self.decoder = self.protocol.create_decoder()
+        self.notifications = [log_notification(log, SUBSCRIPTION_ID) for log in self.logs]
+
+        self.coinbase_frames = generate_coinbase_frames(max(1, int(20000 * scale)))
+        self.huobi_frames = generate_huobi_frames(max(1, int(5000 * scale)))
+
+
+def time_each(process, items):
+    outputs = [None] * len(items)
+    latencies = [0.0] * len(items)
+    perf_counter = time.perf_counter
+    started = perf_counter()
+    for i, item in enumerate(items):
+        item_started = perf_counter()
+        outputs[i] = process(item)
+        latencies[i] = perf_counter() - item_started
+    return perf_counter() - started, latencies, outputs
+
+async def time_each_async(process, items):
+    outputs = [None] * len(items)
+    latencies = [0.0] * len(items)
+    perf_counter = time.perf_counter
+    started = perf_counter()
+    for i, item in enumerate(items):
+        item_started = perf_counter()
+        outputs[i] = await process(item)
+        latencies[i] = perf_counter() - item_started
+    return perf_counter() - started, latencies, outputs
+
+def create_redis_producer(topic, redis):
+    producer = RedisProducer(topic)
+    producer.pool = redis
+    producer.start_writer()
+    return producer
+
+
+# Each stage returns how many items it ran, how long it took, the latency of each, and
+# whatever holds its output
+
+async def stage_normalise_block(data):
+    return (len(data.blocks),) + time_each(normalise_block, data.blocks)
+
+async def stage_normalise_transaction(data):
+    return (len(data.transactions),) + time_each(lambda item: normalise_transaction(*item), data.transactions)
+
+async def stage_process_log(data):
+    return (len(data.logs),) + time_each(lambda log: process_log(data.protocol, data.decoder, log, data.pairs), data.logs)
+
+async def stage_preprocess_json(data):
+    ws = FakeWebsocket([])
+    decoder = create_frame_decoder("coinbase")
+    return (len(data.coinbase_frames),) + await time_each_async(lambda frame: decoder.decode(frame, ws), data.coinbase_frames)
+
+async def stage_preprocess_gzip(data):
+    ws = FakeWebsocket([])
+    decoder = create_frame_decoder("huobi")
+    return (len(data.huobi_frames),) + await time_each_async(lambda frame: decoder.decode(frame, ws), data.huobi_frames)
+
+async def stage_redis_producer(data):
+    redis = FakeRedis()
+    producer = create_redis_producer("benchmark-redis", redis)
+    produced = {}
+    started = time.perf_counter()
+    for i, frame in enumerate(data.coinbase_frames):
+        key = str(i)
+        produced[key] = time.time()
+        await producer.produce(key, frame, produced[key])
+    await producer.close()
+    elapsed = time.perf_counter() - started
+    latencies = [acked - produced[key] for _, key, _, acked in redis.entries()]
+    return len(data.coinbase_frames), elapsed, latencies, redis
+
+async def stage_kafka_producer(data):
+    broker = FakeKafkaBroker()
+    producer = KafkaProducer("benchmark-kafka", producer_class=broker.producer)
+    latencies = []
+
+    def acked(produced, future):
+        latencies.append(time.time() - produced)
+
+    started = time.perf_counter()
+    futures = []
+    for i, frame in enumerate(data.coinbase_frames):
+        produced = time.time()
+        future = producer.produce(str(i), frame, produced)
+        future.add_done_callback(lambda future, produced=produced: acked(produced, future))
+        futures.append(future)
+    await asyncio.gather(*futures)
+    await producer.close()
+    return len(data.coinbase_frames), time.perf_counter() - started, latencies, broker
+
+async def stage_pipeline_blocks(data):
+    from ethereum import produce_transactions
+    redis = FakeRedis()
+    producer = create_redis_producer("benchmark-blocks", redis)
+    received = {}
+    started = time.perf_counter()
+    for block in data.blocks:
+        block_received = time.time()
+        block_msg = normalise_block(block)
+        for transaction in block["transactions"]:
+            received[transaction["hash"]] = block_received
+        await produce_transactions(block, block_msg, producer, "benchmark-blocks", block_received)
+    await producer.close()
+    elapsed = time.perf_counter() - started
+    latencies = [acked - received[key] for _, key, _, acked in redis.entries()]
+    return len(data.transactions), elapsed, latencies, redis
+
+async def stage_pipeline_logs(data):
+    redis = FakeRedis()
+    runtime = ProtocolRuntime([data.protocol], {})
+    runtime.registries[data.protocol.name].pairs.update(data.pairs)
+    runtime.add_routes(data.protocol, data.pairs)
+    runtime.producers[data.protocol.stream] = create_redis_producer(data.protocol.stream, redis)
+    pool = DecodePool(lambda log: decode_log(data.decoder, log), runtime.emit, 2, hold_time=0.01, name="benchmark")
+    runner = asyncio.create_task(pool.run())
+    received = {}
+    started = time.perf_counter()
+    for log, notification in zip(data.logs, data.notifications):
+        received[(log["transactionHash"], int(log["logIndex"], 16))] = time.time()
+        await pool.submit(notification, SUBSCRIPTION_ID)
+    # Everything is out once the pool has released the last block's logs
+    while pool.num_decoded < len(data.logs) or pool.held:
+        await asyncio.sleep(0.001)
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    await runtime.producers[data.protocol.stream].close()
+    elapsed = time.perf_counter() - started
+    latencies = []
+    for _, _, value, acked in redis.entries():
+        processed_log = json.loads(value)
+        latencies.append(acked - received[(processed_log["transactionHash"], processed_log["logIndex"])])
+    return len(data.logs), elapsed, latencies, redis
+
+def normalise_coinbase(message, quote_numbers=itertools.count()):
+    """
+    Stands in for an exchange normaliser, turning level2 updates into LOB events and matches into market orders
+    """
+    lob_events = []
+    market_orders = []
+    if message["type"] == "l2update":
+        for side, price, size in message["changes"]:
+            size = float(size)
+            lob_events.append(create_lob_event(quote_no=next(quote_numbers), side=1 if side == "buy" else 2, price=float(price),
+                                               size=size if size else -1, lob_action=2 if size else 3,
+                                               receive_timestamp=message["receive_timestamp"]))
+    elif message["type"] == "match":
+        market_orders.append(create_market_order(order_id=message["trade_id"], price=float(message["price"]),
+                                                 trade_id=str(message["trade_id"]), timestamp=message["receive_timestamp"],
+                                                 side=1 if message["side"] == "buy" else 2, size=float(message["size"]),
+                                                 msg_original_type="match"))
+    return {"lob_events": lob_events, "market_orders": market_orders}
+
+async def stage_pipeline_exchange(data):
+    from sink_connector.ws_to_redis import produce_messages
+    redis = FakeRedis()
+    producers = [create_redis_producer(f"benchmark-coinbase-{kind}", redis) for kind in ("raw", "normalised", "trades")]
+    ws = FakeWebsocket(data.coinbase_frames)
+    started = time.perf_counter()
+    # produce_messages prints its running totals
+    with contextlib.redirect_stdout(io.StringIO()):
+        await produce_messages(ws, *producers, normalise_coinbase)
+        for producer in producers:
+            await producer.close()
+    elapsed = time.perf_counter() - started
+    latencies = [acked - float(key) for stream, key, _, acked in redis.entries() if stream == "benchmark-coinbase-raw"]
+    return len(data.coinbase_frames), elapsed, latencies, redis
+
+STAGES = {
+    "normalise_block": stage_normalise_block,
+    "normalise_transaction": stage_normalise_transaction,
+    "process_log": stage_process_log,
+    "preprocess_json": stage_preprocess_json,
+    "preprocess_gzip": stage_preprocess_gzip,
+    "redis_producer": stage_redis_producer,
+    "kafka_producer": stage_kafka_producer,
+    "pipeline_blocks": stage_pipeline_blocks,
+    "pipeline_logs": stage_pipeline_logs,
+    "pipeline_exchange": stage_pipeline_exchange,
+}
+
+async def cancel_leftover_tasks():
+    # Such as the monitoring tasks the exchange pipeline starts and never stops
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def run_stage(name, data):
+    stage = STAGES[name]
+    gc.collect()
+    num_items, elapsed, latencies, _ = await stage(data)
+    await cancel_leftover_tasks()
+    result = StageResult(name, num_items, elapsed, latencies)
+
+    gc.collect()
+    tracemalloc.start()
+    _, _, _, held = await stage(data)
+    await cancel_leftover_tasks()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    result.bytes_per_item = round(current / num_items, 1)
+    result.peak_kib = round(peak / 1024, 1)
+    return result
+
+def compare(results, limits, tolerance=0.0):
+    """
+    Returns how each result misses its limits: a minimum msgs/s, and maximum p99 and
+    bytes per item, each with tolerance of slack
+    """
+    failures = []
+    for result in results:
+        stage_limits = limits.get(result.name)
+        if not stage_limits:
+            continue
+        if "msgs_per_s" in stage_limits and result.msgs_per_s < stage_limits["msgs_per_s"] * (1 - tolerance):
+            failures.append(f"{result.name}: {result.msgs_per_s:.0f} msgs/s, below {stage_limits['msgs_per_s'] * (1 - tolerance):.0f}")
+        if "p99_us" in stage_limits and result.p99_us > stage_limits["p99_us"] * (1 + tolerance):
+            failures.append(f"{result.name}: p99 {result.p99_us:.0f}us, above {stage_limits['p99_us'] * (1 + tolerance):.0f}us")
+        if "bytes_per_item" in stage_limits and result.bytes_per_item > stage_limits["bytes_per_item"] * (1 + tolerance):
+            failures.append(f"{result.name}: {result.bytes_per_item:.0f} bytes/item, above {stage_limits['bytes_per_item'] * (1 + tolerance):.0f}")
+    return failures
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmarks collector stages and pipelines on synthetic traffic")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the amount of synthetic traffic")
+    parser.add_argument("--check", action="store_true", help=f"fail on missing a limit in {THRESHOLDS_PATH}")
+    parser.add_argument("--baseline", help="fail on falling more than --tolerance behind the results saved in this file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save", help="save the results to this file, to be a later run's --baseline")
+    return parser.parse_args()
+
+async def main(args):
+    data = Data(args.scale)
+    results = []
+    print(f"{'stage':22} {'items':>8} {'msgs/s':>10} {'p50 us':>9} {'p99 us':>9} {'bytes/item':>11} {'peak KiB':>9}")
+    for name in args.stages:
+        result = await run_stage(name, data)
+        results.append(result)
+        print(f"{name:22} {result.num_items:8d} {result.msgs_per_s:10.0f} {result.p50_us:9.1f} {result.p99_us:9.1f} "
+              f"{result.bytes_per_item:11.1f} {result.peak_kib:9.1f}", flush=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({result.name: result.as_dict() for result in results}, f, indent=4)
+    failures = []
+    if args.check:
+        with open(THRESHOLDS_PATH) as f:
+            failures.extend(compare(results, json.load(f)))
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures.extend(compare(results, json.load(f), args.tolerance))
+    for failure in failures:
+        print("FAIL " + failure)
+    return not failures
+
+if __name__ == "__main__":
+    if not asyncio.run(main(parse_args())):
+        sys.exit(1)
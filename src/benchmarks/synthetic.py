@@ -0,0 +1,191 @@
+"""
+Generators for realistic looking chain and exchange data, so benchmarks need no node,
+subgraph or exchange.
+"""
+import gzip
+import json
+import random
+from helpers.log_decoder import event_topic
+
+def random_hex(num_bytes):
+    if num_bytes == 0:
+        return ""
+    return "%0*x" % (num_bytes * 2, random.getrandbits(num_bytes * 8))
+
+def random_word(abi_type):
+    if abi_type == "address":
+        return "0" * 24 + random_hex(20)
+    if abi_type == "bool":
+        return "%064x" % random.randint(0, 1)
+    if abi_type.startswith("int"):
+        bits = int(abi_type[3:] or 256)
+        return "%064x" % (random.randint(-2 ** (bits - 1), 2 ** (bits - 1) - 1) % 2 ** 256)
+    return "%064x" % random.getrandbits(int(abi_type[4:] or 256) // 2)
+
+def generate_logs(abi, event_names, pair_addresses, num_logs, start_block=15000000, logs_per_block=50):
+    events = [entry for entry in abi if entry.get("type") == "event" and entry["name"] in event_names]
+    logs = []
+    for i in range(num_logs):
+        event_abi = random.choice(events)
+        topics = [event_topic(event_abi)]
+        data = "0x"
+        for event_input in event_abi["inputs"]:
+            word = random_word(event_input["type"])
+            if event_input["indexed"]:
+                topics.append("0x" + word)
+            else:
+                data += word
+        logs.append({
+            "address": random.choice(pair_addresses),
+            "topics": topics,
+            "data": data,
+            "blockNumber": hex(start_block + i // logs_per_block),
+            "transactionHash": "0x" + random_hex(32),
+            "transactionIndex": hex(random.randint(0, 300)),
+            "blockHash": "0x" + random_hex(32),
+            "logIndex": hex(i % logs_per_block),
+            "removed": False
+        })
+    return logs
+
+def generate_log_bursts(abi, event_names, pair_addresses, num_blocks, start_block=15000000,
+                        quiet_logs=3, burst_logs=300, burst_every=10):
+    """
+    Logs of num_blocks blocks, a few a block with a burst every burst_every blocks, as
+    when a large trade is arbitraged through every pool it touches
+    """
+    logs = []
+    for i in range(num_blocks):
+        num_logs = burst_logs if i % burst_every == burst_every - 1 else random.randint(0, quiet_logs)
+        logs.extend(generate_logs(abi, event_names, pair_addresses, num_logs, start_block=start_block + i,
+                                  logs_per_block=max(num_logs, 1)))
+    return logs
+
+def log_notification(log, subscription_id):
+    """
+    A log as an eth_subscription notification frame carries it
+    """
+    return json.dumps({"jsonrpc": "2.0", "method": "eth_subscription", "params": {"subscription": subscription_id, "result": log}})
+
+def random_book_change(mid):
+    return [random.choice(["buy", "sell"]), "%.2f" % (mid + random.uniform(-50, 50)), "%.8f" % random.choice([0, random.uniform(0, 3)])]
+
+def generate_coinbase_frames(num_frames, changes_per_frame=3, trade_ratio=0.1, product="BTC-USD"):
+    """
+    Text frames like the Coinbase level2 and matches channels send: mostly book updates, some trades
+    """
+    frames = []
+    mid = 20000.0
+    for i in range(num_frames):
+        mid += random.uniform(-1, 1)
+        timestamp = "2022-08-01T12:00:%02d.%06dZ" % (i // 10 ** 6 % 60, i % 10 ** 6)
+        if random.random() < trade_ratio:
+            frames.append(json.dumps({
+                "type": "match", "trade_id": 10 ** 8 + i, "sequence": 10 ** 10 + i,
+                "maker_order_id": "%s-%s-%s-%s-%s" % (random_hex(4), random_hex(2), random_hex(2), random_hex(2), random_hex(6)),
+                "taker_order_id": "%s-%s-%s-%s-%s" % (random_hex(4), random_hex(2), random_hex(2), random_hex(2), random_hex(6)),
+                "side": random.choice(["buy", "sell"]), "size": "%.8f" % random.uniform(0, 2),
+                "price": "%.2f" % mid, "product_id": product, "time": timestamp,
+            }))
+        else:
+            frames.append(json.dumps({
+                "type": "l2update", "product_id": product, "time": timestamp,
+                "changes": [random_book_change(mid) for _ in range(random.randint(1, 2 * changes_per_frame - 1))],
+            }))
+    return frames
+
+def generate_huobi_frames(num_frames, levels=20, ping_every=100, symbol="btcusdt"):
+    """
+    Gzip compressed binary frames like Huobi's depth channel sends, with a ping every
+    ping_every frames that has to be answered
+    """
+    frames = []
+    mid = 20000.0
+    for i in range(num_frames):
+        timestamp = 1660000000000 + i * 100
+        if ping_every and i % ping_every == ping_every - 1:
+            message = {"ping": timestamp}
+        else:
+            mid += random.uniform(-1, 1)
+            message = {
+                "ch": f"market.{symbol}.depth.step0", "ts": timestamp,
+                "tick": {
+                    "bids": [[round(mid - 0.01 * (level + 1), 2), round(random.uniform(0, 3), 6)] for level in range(levels)],
+                    "asks": [[round(mid + 0.01 * (level + 1), 2), round(random.uniform(0, 3), 6)] for level in range(levels)],
+                    "version": 10 ** 9 + i, "ts": timestamp - 3,
+                },
+            }
+        frames.append(gzip.compress(json.dumps(message).encode(), compresslevel=6))
+    return frames
+
+def generate_transaction(block_hash, block_num, index):
+    return {
+        "blockHash": block_hash,
+        "blockNumber": hex(block_num),
+        "from": "0x" + random_hex(20),
+        "gas": hex(random.randint(21000, 500000)),
+        "gasPrice": hex(random.randint(10 ** 9, 200 * 10 ** 9)),
+        "maxFeePerGas": hex(random.randint(10 ** 9, 200 * 10 ** 9)),
+        "maxPriorityFeePerGas": hex(random.randint(10 ** 8, 3 * 10 ** 9)),
+        "hash": "0x" + random_hex(32),
+        "input": "0x" + random_hex(random.choice([0, 68, 132, 260])),
+        "nonce": hex(random.randint(0, 10 ** 5)),
+        "to": "0x" + random_hex(20),
+        "transactionIndex": hex(index),
+        "value": hex(random.choice([0, random.getrandbits(48), random.getrandbits(64)])),
+        "type": "0x2",
+        "accessList": [],
+        "chainId": "0x1",
+        "v": "0x1",
+        "r": "0x" + random_hex(32),
+        "s": "0x" + random_hex(32),
+    }
+
+def generate_block(block_num, num_transactions, parent_hash=None):
+    """
+    Generates a full eth_getBlockByNumber result, including transaction objects
+    """
+    block_hash = "0x" + random_hex(32)
+    return {
+        "number": hex(block_num),
+        "hash": block_hash,
+        "parentHash": parent_hash or "0x" + random_hex(32),
+        "timestamp": hex(1660000000 + block_num * 12),
+        "miner": "0x" + random_hex(20),
+        "gasLimit": hex(30000000),
+        "gasUsed": hex(random.randint(10 ** 6, 3 * 10 ** 7)),
+        "baseFeePerGas": hex(random.randint(10 ** 9, 10 ** 11)),
+        "transactions": [generate_transaction(block_hash, block_num, i) for i in range(num_transactions)],
+    }
+
+def generate_chain(start_block, num_blocks, num_transactions):
+    blocks = []
+    parent_hash = None
+    for block_num in range(start_block, start_block + num_blocks):
+        block = generate_block(block_num, num_transactions, parent_hash)
+        parent_hash = block["hash"]
+        blocks.append(block)
+    return blocks
+
+def generate_pool():
+    """
+    Generates a pool as the V3 subgraph returns it, numbers being decimal strings
+    """
+    tvl0 = random.uniform(1, 10 ** 6)
+    tvl1 = random.uniform(1, 10 ** 6)
+    return {
+        "token0": {"symbol": "T" + random_hex(2), "name": "Token " + random_hex(4)},
+        "token1": {"symbol": "T" + random_hex(2), "name": "Token " + random_hex(4)},
+        "id": "0x" + random_hex(20),
+        "liquidity": str(random.getrandbits(80)),
+        "totalValueLockedToken0": repr(tvl0),
+        "totalValueLockedToken1": repr(tvl1),
+        "volumeToken0": repr(random.uniform(0, 10 ** 8)),
+        "volumeToken1": repr(random.uniform(0, 10 ** 8)),
+        "feesUSD": repr(random.uniform(0, 10 ** 6)),
+        "volumeUSD": repr(random.uniform(0, 10 ** 9)),
+        "totalValueLockedUSD": repr(10 ** random.uniform(0, 8)),
+        "token0Price": repr(tvl1 / tvl0),
+        "token1Price": repr(tvl0 / tvl1),
+        "txCount": str(random.randint(0, 10 ** 6)),
+    }
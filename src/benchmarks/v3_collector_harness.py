@@ -0,0 +1,89 @@
+"""
+Runs the delta V3 indicators collector against a local subgraph stand-in: checks that
+a keyframe plus the following deltas rebuild the subgraph's pools exactly, and compares
+the bytes published with re-publishing the full snapshot every poll.
+
+Run from src/ with: python -m benchmarks.v3_collector_harness [num_pools] [num_polls]
+"""
+import asyncio
+import json
+import random
+import sys
+import aiohttp
+from benchmarks.fakes import FakeSubgraph
+from benchmarks.synthetic import generate_pool
+from uniswap_helpers.v3_indicators_collector import DeltaCollector, reshape_pool
+
+PORT = 8561
+MIN_TVL = 10000
+
+class RecordingProducer:
+    def __init__(self):
+        self.records = []
+        self.num_bytes = 0
+
+    async def produce(self, key, data):
+        self.num_bytes += len(data)
+        self.records.append(json.loads(data))
+
+def churn(pools, changed_fraction=0.02, num_replaced=5):
+    """
+    Trades on a few pools, and swaps a few pools for new ones
+    """
+    for pool in random.sample(pools, int(len(pools) * changed_fraction)):
+        pool["txCount"] = str(int(pool["txCount"]) + random.randint(1, 20))
+        pool["volumeUSD"] = repr(float(pool["volumeUSD"]) + random.uniform(1, 10 ** 5))
+    for _ in range(num_replaced):
+        pools[random.randrange(len(pools))] = generate_pool()
+
+def expected_pools(pools):
+    return {pool["id"]: reshape_pool(pool) for pool in pools if float(pool["totalValueLockedUSD"]) > MIN_TVL}
+
+def apply_record(state, record):
+    if record["type"] == "keyframe":
+        state.clear()
+    for pool_id in record.get("removed", []):
+        del state[pool_id]
+    for pool in record["pools"]:
+        state[pool["contractHash"]] = pool
+
+async def main():
+    num_pools = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    num_polls = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    pools = [generate_pool() for _ in range(num_pools)]
+    subgraph = FakeSubgraph(pools)
+    endpoint = await subgraph.start(PORT)
+    producer = RecordingProducer()
+    collector = DeltaCollector(producer, endpoint, MIN_TVL, 100, 8, keyframe_interval=num_polls)
+    state = {}
+    full_bytes = 0
+    ok = True
+    async with aiohttp.ClientSession() as session:
+        for i in range(num_polls):
+            record = await collector.poll(session)
+            apply_record(state, record)
+            full_bytes += len(json.dumps(list(collector.snapshot.values())))
+            if state != expected_pools(pools):
+                print(f"poll {i}: rebuilt state differs from the subgraph")
+                ok = False
+            churn(pools)
+
+        # A failed poll must publish nothing and leave the snapshot alone
+        snapshot = collector.snapshot
+        subgraph.fail_requests = 1
+        if await collector.poll(session) is not None or collector.snapshot is not snapshot:
+            print("failed poll was published")
+            ok = False
+    await subgraph.close()
+
+    tracked = len(expected_pools(pools))
+    print(f"{tracked} of {num_pools} pools above {MIN_TVL} USD TVL, {num_polls} polls, "
+          f"{subgraph.num_requests} subgraph requests")
+    print(f"  full snapshots: {full_bytes:10d} bytes")
+    print(f"  keyframe+delta: {producer.num_bytes:10d} bytes ({full_bytes / producer.num_bytes:.1f}x less)")
+    print(f"  rebuilt state matches: {ok}")
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
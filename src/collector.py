@@ -0,0 +1,19 @@
+import asyncio
+from helpers.metrics import serve_metrics
+from helpers.protocols import run_protocols
+from helpers.read_config import get_enabled_protocols
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+# Runs every protocol enabled in config.ini in this one process, sharing connections and sink writers
+async def main():
+    logging.info("Starting collectors")
+    await asyncio.gather(run_protocols(get_enabled_protocols()), serve_metrics())
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nExiting by user request.\n")
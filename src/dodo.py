@@ -1,16 +1,16 @@
 import asyncio
-from dodo_helpers.event_subscriber import handle_events
+from helpers.metrics import serve_metrics
+from helpers.protocols import run_protocols
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
 # Main function creates event listeners for all the different smart contracts and desired event, and sets up the async loop
 async def main():
-    tasks = []
+    tasks = [serve_metrics()]
     logging.info("Starting collectors")
     logging.info("Starting event listeners")
-    tasks.append(handle_events())
-    logging.info("Starting indicators collector")
+    tasks.append(run_protocols(['dodo']))
     await asyncio.gather(*tasks)
 
 
@@ -1,15 +1,18 @@
 import json
-import time
-import aiohttp
-import websockets
 import asyncio
 import dotenv
-from hexbytes import HexBytes
 from sink_connector.redis_producer import RedisProducer
-from helpers.normalise_transaction import normalise_transaction
-from helpers.normalise_block import normalise_block
+from helpers.normalise_transaction import normalise_transaction, normalise_block_transactions
+from helpers.read_config import get_chain_config, get_enabled_chains, get_race_config, get_reconnect_config, get_checkpoints_config, get_archived_streams
+from helpers.checkpoints import CheckpointStore
+from helpers.metrics import serve_metrics
+from sink_connector.archive_producer import ArchiveProducer, TeeProducer
+from helpers.provider_race import RacingHeads, get_providers
+from ethereum_helpers.block_fetcher import create_session
+from ethereum_helpers.pipeline import BlockPipeline
 import logging
 import sys
+import time
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -19,60 +22,77 @@ logging.basicConfig(
 
 logging.info("Starting collector")
 
-async def produce_transactions(block_object, block_msg, redis_producer):
-    pipe = redis_producer.pool.pipeline()
+async def produce_transactions(block_object, block_msg, redis_producer, stream, created=None):
     for transaction in block_object['transactions']:
         new_tx = normalise_transaction(transaction, block_msg)
-        pipe.xadd('ethereum-raw', fields={new_tx['tx_hash']: json.dumps(new_tx)}, maxlen=redis_producer.stream_max_len, approximate=True)
-    await pipe.execute()
+        await redis_producer.produce_to(stream, new_tx['tx_hash'], json.dumps(new_tx), created)
 
-def serialize_transaction(transaction):
-    """
-    Helper for serializing a transaction to a dictionary
-    """
-    return json.loads(json.dumps(transaction, default=vars))
+async def produce_block_record(block_object, block_msg, redis_producer, stream, created=None):
+    record = normalise_block_transactions(block_object['transactions'], block_msg)
+    await redis_producer.produce_to(stream, block_msg['block_hash'], json.dumps(record), created)
+
+# Selected by output_mode: one stream entry per transaction, or one per block
+OUTPUT_MODES = {
+    "transactions": produce_transactions,
+    "blocks": produce_block_record,
+}
+
+async def produce_retractions(retractions, redis_producer, stream):
+    for retraction in retractions:
+        await redis_producer.produce_to(stream, retraction['block_hash'], json.dumps(retraction))
+
+def session_pool_size(chain_confs):
+    # Live fetches and gap fill batches of every chain share the pool
+    return sum(int(chain_conf["fetch_concurrency"]) + int(chain_conf["gap_fill_max_batches"]) for chain_conf in chain_confs.values())
 
-class Web3JsonEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, HexBytes):
-            return obj.hex()
-        if obj.__class__.__name__ == "AttributeDict":
-            return obj.__dict__
-        return super().default(obj)
+async def follow_chain(name, chain_conf, env, session, producer, checkpoints):
+    produce = OUTPUT_MODES[chain_conf["output_mode"]]
+    stream = chain_conf["stream"]
+    archive = None
+    if stream in get_archived_streams():
+        # Kept on disk as well, as the Redis stream only holds the latest entries
+        archive = ArchiveProducer(stream, name)
+        archive.start_writer()
+        producer = TeeProducer([producer, archive])
 
-async def get_all_transactions(conf, producer):
-    session = aiohttp.ClientSession()
+    async def produce_block(block, block_msg):
+        await produce(block, block_msg, producer, stream, time.time())
+        checkpoints.update(stream, block_msg["block_num"])
+
+    # Picks up after the last block produced to the stream, filling in whatever was missed
+    resume_block = checkpoints.load(stream)
+    pipeline = BlockPipeline(session, env[chain_conf["rest_endpoint"]], produce_block,
+                             lambda retractions: produce_retractions(retractions, producer, stream), chain_conf, resume_block)
+    # Headers come from whichever provider announces them first
+    race_conf = get_race_config()
+    heads = RacingHeads(get_providers(chain_conf["ws_endpoints"], env), int(race_conf["max_header_keys"]))
+    logging.info("Following %s, producing to %s", name, stream)
+    try:
+        await asyncio.gather(heads.run(float(race_conf["stats_log_interval"])), pipeline.run(heads))
+    finally:
+        if archive is not None:
+            await archive.close()
+
+async def collect_chains(chains, env, producer):
+    """
+    Follows every chain in one process, sharing the HTTP session and the Redis writer
+    """
+    max_catch_up_blocks = get_reconnect_config()["max_catch_up_blocks"]
+    chain_confs = {name: {"max_catch_up_blocks": max_catch_up_blocks, **get_chain_config(name)} for name in chains}
+    checkpoints_conf = get_checkpoints_config()
+    checkpoints = CheckpointStore(checkpoints_conf["directory"], float(checkpoints_conf["flush_interval"]))
+    session = create_session(session_pool_size(chain_confs))
+    producer.start_writer()
     try:
-        async with websockets.connect(conf["INFURA_WS_ENDPOINT"]) as ws:
-            await ws.send(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["newHeads"]}))
-            await ws.recv()
-            logging.info("Connected to websocket")
-            old_num_int = -1
-            request = {"jsonrpc": "2.0", "id": 1, "method": "eth_getBlockByNumber", "params": ["", True]}
-            while True:
-                new_block = await ws.recv()
-                new_num = json.loads(new_block)["params"]["result"]["number"]
-                new_num_int = int(new_num, 16)
-                if new_num_int == old_num_int:
-                    logging.warning("Getting same block twice")
-                    continue
-                if old_num_int != -1 and new_num_int > old_num_int + 1:
-                    logging.warning("One or more blocks have been skipped")
-                request['params'][0] = new_num
-                block_res = await session.post(conf["INFURA_REST_ENDPOINT"], json=request)
-                block = json.loads(json.dumps(await block_res.json(), cls=Web3JsonEncoder))
-                block_res.close()
-                block = block['result']
-                block_msg = normalise_block(block)
-                await produce_transactions(block, block_msg, producer)
-                logging.info("Produced block number: %s", str(new_num_int))
-                old_num_int = new_num_int
+        await asyncio.gather(checkpoints.run(), serve_metrics(),
+                             *[follow_chain(name, chain_conf, env, session, producer, checkpoints) for name, chain_conf in chain_confs.items()])
     except KeyboardInterrupt:
         logging.info("Exiting by user request")
     finally:
         await session.close()
+        await producer.close()
 
 if __name__ == "__main__":
     producer = RedisProducer("ethereum-raw")
     conf = dotenv.dotenv_values('./keys/.env')
-    asyncio.run(get_all_transactions(conf, producer))
+    asyncio.run(collect_chains(get_enabled_chains(), conf, producer))
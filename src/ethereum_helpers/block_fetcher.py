@@ -0,0 +1,54 @@
+import asyncio
+import aiohttp
+import logging
+
+class BlockFetchError(Exception):
+    pass
+
+def create_session(pool_size, timeout=30):
+    """
+    Creates a session whose connection pool is sized for the number of concurrent fetches
+    """
+    connector = aiohttp.TCPConnector(limit=pool_size, ttl_dns_cache=300, keepalive_timeout=60)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+def block_request(block_num, request_id=1):
+    return {"jsonrpc": "2.0", "id": request_id, "method": "eth_getBlockByNumber", "params": [hex(block_num), True]}
+
+async def fetch_blocks(session, endpoint, block_nums):
+    """
+    Fetches full blocks for all of block_nums in a single batched JSON-RPC request
+    """
+    request = [block_request(block_num, i) for i, block_num in enumerate(block_nums)]
+    async with session.post(endpoint, json=request) as res:
+        responses = await res.json()
+    if not isinstance(responses, list):
+        raise BlockFetchError(f"batch request failed: {responses}")
+    # Batch responses are allowed to come back in any order
+    blocks = [None] * len(block_nums)
+    # Errors of requests the node could not tie to an id, such as a parse error, come back with a null id
+    errors = []
+    for response in responses:
+        request_id = response.get("id")
+        if not isinstance(request_id, int) or not 0 <= request_id < len(block_nums):
+            errors.append(response.get("error", response))
+        elif response.get("error") is not None:
+            errors.append(response["error"])
+        else:
+            blocks[request_id] = response.get("result")
+    missing = [block_nums[i] for i, block in enumerate(blocks) if block is None]
+    if missing:
+        raise BlockFetchError(f"blocks {missing} not returned by node{f': {errors}' if errors else ''}")
+    return blocks
+
+async def fetch_blocks_with_retries(session, endpoint, block_nums, max_retries=5):
+    """
+    Fetches blocks with exponential backoff between attempts, returning None once out of retries
+    """
+    for attempt in range(max_retries):
+        try:
+            return await fetch_blocks(session, endpoint, block_nums)
+        except (BlockFetchError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning("Failed to fetch blocks %s to %s: %s", block_nums[0], block_nums[-1], e)
+            await asyncio.sleep(2 ** attempt)
+    return None
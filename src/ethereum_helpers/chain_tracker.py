@@ -0,0 +1,78 @@
+import logging
+
+def create_retraction(block_num, block_hash, replaced_by):
+    return {
+        "type": "retraction",
+        "block_num": block_num,
+        "block_hash": block_hash,
+        "replaced_by": replaced_by,
+    }
+
+class ChainTracker:
+    """
+    Remembers the hashes of the last depth blocks produced, in a fixed size ring buffer.
+
+    A block is slotted by its number modulo depth, so checking a new block against its
+    parent is a single list lookup and memory stays the same however long we run.
+    """
+    def __init__(self, depth):
+        self.depth = depth
+        self.numbers = [-1] * depth
+        self.hashes = [None] * depth
+
+    def get(self, block_num):
+        slot = block_num % self.depth
+        if self.numbers[slot] != block_num:
+            return None
+        return self.hashes[slot]
+
+    def record(self, block_num, block_hash):
+        slot = block_num % self.depth
+        self.numbers[slot] = block_num
+        self.hashes[slot] = block_hash
+
+    def is_reorg(self, block_num, parent_hash):
+        known_parent = self.get(block_num - 1)
+        return known_parent is not None and known_parent != parent_hash
+
+    async def walk_back(self, block, fetch_blocks):
+        """
+        Walks back from a block whose parent we never produced to the last block both
+        chains share. Returns retractions for the orphaned blocks and the canonical
+        blocks replacing them, oldest first.
+
+        Canonical blocks are fetched in batches that double in size, so the usual one
+        or two block reorg costs a single request.
+        """
+        expected_parent = block["parentHash"]
+        block_num = int(block["number"], 16) - 1
+        fetched = {}
+        batch_size = 1
+        replacements = []
+        while True:
+            known_hash = self.get(block_num)
+            if known_hash is None:
+                logging.error("Reorg is deeper than the %d blocks tracked, stopping at block %d", self.depth, block_num)
+                break
+            if known_hash == expected_parent:
+                break
+            if block_num not in fetched:
+                block_nums = list(range(max(block_num - batch_size + 1, 0), block_num + 1))
+                blocks = await fetch_blocks(block_nums)
+                if blocks is None:
+                    logging.error("Could not fetch canonical blocks %d to %d", block_nums[0], block_nums[-1])
+                    break
+                fetched.update(zip(block_nums, blocks))
+                batch_size *= 2
+            canonical = fetched[block_num]
+            if canonical["hash"] != expected_parent:
+                logging.warning("Chain moved again while resolving reorg at block %d", block_num)
+            replacements.append(canonical)
+            expected_parent = canonical["parentHash"]
+            block_num -= 1
+        replacements.reverse()
+        retractions = []
+        for canonical in replacements:
+            canonical_num = int(canonical["number"], 16)
+            retractions.append(create_retraction(canonical_num, self.get(canonical_num), canonical["hash"]))
+        return retractions, replacements
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from collections import deque
+from ethereum_helpers.block_fetcher import fetch_blocks_with_retries
+
+class BlockSequencer:
+    """
+    Releases blocks onto a queue strictly in block number order.
+
+    Blocks can be put in any order, from any task. A block is held back until every
+    block before it has either arrived or been given up on.
+    """
+    def __init__(self, queue):
+        self.queue = queue
+        self.next_num = None
+        self.pending = {}
+        self.lock = asyncio.Lock()
+
+    def start_at(self, block_num):
+        """
+        Sets the first block to release, which has to happen before any block is put
+        """
+        self.next_num = block_num
+
+    async def put(self, block_num, block):
+        async with self.lock:
+            if block_num < self.next_num:
+                return
+            self.pending[block_num] = block
+            while self.next_num in self.pending:
+                block = self.pending.pop(self.next_num)
+                if block is None:
+                    logging.error("Block %s could not be fetched and has been skipped", self.next_num)
+                else:
+                    await self.queue.put(block)
+                self.next_num += 1
+
+    async def give_up(self, block_num):
+        await self.put(block_num, None)
+
+
+class GapFiller:
+    """
+    Fetches ranges of skipped blocks in the background and hands them to a sequencer.
+
+    Ranges are queued and split into batched eth_getBlockByNumber requests as they are
+    fetched, by at most max_batches workers, oldest range first. Workers are started when
+    a range is queued and stop once there is nothing left to fetch.
+    """
+    def __init__(self, session, endpoint, sequencer, batch_size=10, max_batches=4, max_retries=5):
+        self.session = session
+        self.endpoint = endpoint
+        self.sequencer = sequencer
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.max_retries = max_retries
+        # Start and end block, inclusive, of every range not yet handed to a worker
+        self.ranges = deque()
+        self.workers = set()
+
+    def fill(self, start, end):
+        """
+        Queues fetching of blocks start to end inclusive, without waiting on any of them
+        """
+        logging.warning("Blocks %s to %s have been skipped, filling gap", start, end)
+        self.ranges.append((start, end))
+        while len(self.workers) < self.max_batches:
+            self.workers.add(asyncio.create_task(self.fetch_batches()))
+
+    def next_batch(self):
+        start, end = self.ranges.popleft()
+        batch_end = min(start + self.batch_size - 1, end)
+        if batch_end < end:
+            self.ranges.appendleft((batch_end + 1, end))
+        return list(range(start, batch_end + 1))
+
+    async def fetch_batches(self):
+        try:
+            while self.ranges:
+                await self.fetch_batch(self.next_batch())
+        finally:
+            # Dropped before returning, so a range queued from here on starts a new worker
+            self.workers.discard(asyncio.current_task())
+
+    async def fetch_batch(self, block_nums):
+        blocks = await fetch_blocks_with_retries(self.session, self.endpoint, block_nums, self.max_retries)
+        if blocks is None:
+            blocks = [None] * len(block_nums)
+        for block_num, block in zip(block_nums, blocks):
+            await self.sequencer.put(block_num, block)
+
+    def cancel(self):
+        self.ranges.clear()
+        for worker in list(self.workers):
+            worker.cancel()
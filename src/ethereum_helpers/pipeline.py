@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from helpers.normalise_block import normalise_block
+from ethereum_helpers.block_fetcher import fetch_blocks_with_retries
+from ethereum_helpers.gap_filler import BlockSequencer, GapFiller
+from ethereum_helpers.chain_tracker import ChainTracker
+from helpers.metrics import block_latency_histogram, decode_latency_histogram, queue_depth_gauge
+
+class StageTimer:
+    """
+    Accumulates how long a pipeline stage spends per item between two reports
+    """
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, started):
+        elapsed = time.perf_counter() - started
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    def summary(self):
+        avg_ms = self.total / self.count * 10**3 if self.count else 0.0
+        return f"{self.name}: {self.count} items, avg {avg_ms:.1f}ms, max {self.max * 10**3:.1f}ms"
+
+
+class BlockPipeline:
+    """
+    Runs newHeads notifications through three stages joined by bounded queues.
+
+    Header intake only parses block numbers and schedules gap fills, a pool of fetch
+    workers pulls the full blocks concurrently, and a single produce stage normalises
+    and produces them in block order. A slow RPC response therefore only occupies one
+    fetch worker instead of the websocket reader.
+
+    The produce stage also checks every block against its parent, and on a reorg
+    retracts the orphaned blocks and produces their replacements before moving on.
+    With a confirmation depth, blocks are only produced once that many blocks have
+    been built on them, and orphaned blocks still waiting are dropped unproduced.
+
+    Given the last block a previous run produced, the blocks after it are filled in
+    before the first header, up to max_catch_up_blocks of them.
+    """
+    def __init__(self, session, endpoint, produce, retract, eth_conf, resume_block=None):
+        self.session = session
+        self.endpoint = endpoint
+        self.produce = produce
+        self.retract = retract
+        self.fetch_concurrency = int(eth_conf["fetch_concurrency"])
+        self.timing_log_interval = float(eth_conf["timing_log_interval"])
+        self.header_queue = asyncio.Queue(int(eth_conf["header_queue_size"]))
+        self.block_queue = asyncio.Queue(int(eth_conf["block_queue_size"]))
+        self.sequencer = BlockSequencer(self.block_queue)
+        self.gap_filler = GapFiller(session, endpoint, self.sequencer,
+                                    batch_size=int(eth_conf["gap_fill_batch_size"]),
+                                    max_batches=int(eth_conf["gap_fill_max_batches"]))
+        self.chain_tracker = ChainTracker(int(eth_conf["reorg_tracking_depth"]))
+        self.confirmations = int(eth_conf.get("confirmations", 0))
+        self.resume_block = resume_block
+        self.max_catch_up_blocks = int(eth_conf.get("max_catch_up_blocks", 10000))
+        # Blocks seen but not yet confirmations deep, oldest first
+        self.unconfirmed = deque()
+        self.timers = {name: StageTimer(name) for name in ("intake", "fetch", "produce")}
+        # Block number to when its header was received, until the block is normalised
+        self.received = {}
+        stream = eth_conf["stream"]
+        self.block_latency = block_latency_histogram(stream)
+        self.decode_latency = decode_latency_histogram(stream)
+        queue_depth_gauge("headers", stream, self.header_queue.qsize)
+        queue_depth_gauge("blocks", stream, self.block_queue.qsize)
+        queue_depth_gauge("blocks-out-of-order", stream, lambda: len(self.sequencer.pending))
+
+    async def run(self, ws):
+        """
+        Runs every stage until one of them fails, then cancels the others and raises its error
+        """
+        tasks = [asyncio.create_task(self.read_headers(ws))]
+        tasks.extend(asyncio.create_task(self.fetch_blocks()) for _ in range(self.fetch_concurrency))
+        tasks.append(asyncio.create_task(self.produce_blocks()))
+        tasks.append(asyncio.create_task(self.monitor_timings()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.gap_filler.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def read_headers(self, ws):
+        old_num_int = -1
+        while True:
+            new_head = await ws.recv()
+            received = time.time()
+            started = time.perf_counter()
+            header = json.loads(new_head)["params"]["result"]
+            new_num_int = int(header["number"], 16)
+            if new_num_int == old_num_int:
+                logging.warning("Getting same block twice")
+                continue
+            if old_num_int == -1:
+                # Headers a previous run already got to are skipped until the chain moves past them
+                if self.resume_block is not None and new_num_int <= self.resume_block:
+                    continue
+                first_num = new_num_int
+                if self.resume_block is not None:
+                    first_num = max(self.resume_block + 1, new_num_int - self.max_catch_up_blocks)
+                    logging.info("Resuming from block %d, head is %d", first_num, new_num_int)
+                self.sequencer.start_at(first_num)
+                if first_num < new_num_int:
+                    self.gap_filler.fill(first_num, new_num_int - 1)
+            elif new_num_int > old_num_int + 1:
+                self.gap_filler.fill(old_num_int + 1, new_num_int - 1)
+            self.block_latency.observe(received - int(header["timestamp"], 16))
+            self.received[new_num_int] = received
+            await self.header_queue.put(new_num_int)
+            self.timers["intake"].record(started)
+            old_num_int = new_num_int
+
+    async def fetch_blocks(self):
+        while True:
+            block_num = await self.header_queue.get()
+            started = time.perf_counter()
+            blocks = await fetch_blocks_with_retries(self.session, self.endpoint, [block_num])
+            self.timers["fetch"].record(started)
+            await self.sequencer.put(block_num, blocks[0] if blocks else None)
+
+    async def produce_blocks(self):
+        while True:
+            block = await self.block_queue.get()
+            started = time.perf_counter()
+            if self.chain_tracker.is_reorg(int(block["number"], 16), block["parentHash"]):
+                await self.handle_reorg(block)
+            await self.produce_block(block)
+            self.timers["produce"].record(started)
+
+    async def produce_block(self, block):
+        block_msg = normalise_block(block)
+        received = self.received.pop(block_msg["block_num"], None)
+        if received is not None:
+            self.decode_latency.observe(time.time() - received)
+        # Headers of blocks that never made it this far, failed fetches and the like
+        for block_num in [block_num for block_num in self.received if block_num < block_msg["block_num"]]:
+            del self.received[block_num]
+        self.chain_tracker.record(block_msg["block_num"], block_msg["block_hash"])
+        self.unconfirmed.append((block, block_msg))
+        while len(self.unconfirmed) > self.confirmations:
+            block, block_msg = self.unconfirmed.popleft()
+            await self.produce(block, block_msg)
+            logging.info("Produced block number: %s", str(block_msg["block_num"]))
+
+    async def handle_reorg(self, block):
+        retractions, replacements = await self.chain_tracker.walk_back(
+            block, lambda block_nums: fetch_blocks_with_retries(self.session, self.endpoint, block_nums))
+        logging.warning("Reorg detected at block %s, replacing %d blocks", int(block["number"], 16), len(replacements))
+        # Orphans that were never produced need no retraction
+        orphaned = {retraction["block_hash"] for retraction in retractions}
+        waiting = {block_msg["block_hash"] for _, block_msg in self.unconfirmed}
+        self.unconfirmed = deque(entry for entry in self.unconfirmed if entry[1]["block_hash"] not in orphaned)
+        retractions = [retraction for retraction in retractions if retraction["block_hash"] not in waiting]
+        if retractions:
+            await self.retract(retractions)
+        for replacement in replacements:
+            await self.produce_block(replacement)
+
+    async def monitor_timings(self):
+        while True:
+            await asyncio.sleep(self.timing_log_interval)
+            logging.info("Queued headers: %d, queued blocks: %d, blocks awaiting earlier blocks: %d",
+                         self.header_queue.qsize(), self.block_queue.qsize(), len(self.sequencer.pending))
+            for timer in self.timers.values():
+                logging.info(timer.summary())
+                timer.reset()
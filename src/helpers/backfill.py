@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+import aiohttp
+from helpers.reconnect import Backoff, CatchUpError, get_logs
+
+class RateLimiter:
+    """
+    Token bucket shared by every worker, letting through rate requests a second with
+    bursts of up to burst. Waiters are let through in the order they arrived.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class LogBackfill:
+    """
+    Scans eth_getLogs for addresses and topics from one block to another, with
+    num_workers ranges in flight at once.
+
+    Workers take the next range_size blocks each. A range the node refuses, usually for
+    returning too many logs, is split in half until it goes through, and the range size
+    shrinks with it; after grow_after ranges in a row go through it doubles again, up to
+    max_range. Ranges are handed to emit with their logs in block order however they
+    complete, with at most window of them fetched ahead waiting on an earlier one.
+    """
+    def __init__(self, session, endpoint, addresses, topics, emit, limiter, num_workers=4,
+                 range_size=2000, min_range=1, max_range=100000, window=16, max_retries=5, grow_after=8):
+        self.session = session
+        self.endpoint = endpoint
+        self.addresses = addresses
+        self.topics = topics
+        self.emit = emit
+        self.limiter = limiter
+        self.num_workers = num_workers
+        self.range_size = range_size
+        self.min_range = min_range
+        self.max_range = max_range
+        self.window = asyncio.Semaphore(window)
+        self.max_retries = max_retries
+        self.grow_after = grow_after
+        self.successes = 0
+        self.cursor = None
+        self.to_block = None
+        self.next_block = None
+        # Start block of each fetched range to its end block and logs, until it is emitted
+        self.fetched = {}
+        self.num_requests = 0
+        self.num_splits = 0
+        self.num_logs = 0
+
+    async def run(self, from_block, to_block):
+        self.cursor = self.next_block = from_block
+        self.to_block = to_block
+        workers = [asyncio.create_task(self.work()) for _ in range(self.num_workers)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def work(self):
+        while True:
+            await self.window.acquire()
+            if self.cursor > self.to_block:
+                self.window.release()
+                return
+            start = self.cursor
+            end = min(start + self.range_size - 1, self.to_block)
+            self.cursor = end + 1
+            self.fetched[start] = (end, await self.fetch(start, end))
+            await self.emit_fetched()
+
+    async def emit_fetched(self):
+        # The next block only moves on once a range is emitted, so no later range can overtake it
+        while self.next_block in self.fetched:
+            end, logs = self.fetched.pop(self.next_block)
+            await self.emit(self.next_block, end, logs)
+            self.num_logs += len(logs)
+            self.next_block = end + 1
+            self.window.release()
+
+    def shrink(self, size):
+        self.range_size = max(self.min_range, min(self.range_size, size // 2))
+        self.successes = 0
+        self.num_splits += 1
+
+    def grow(self):
+        self.successes += 1
+        if self.successes >= self.grow_after:
+            self.range_size = min(self.max_range, self.range_size * 2)
+            self.successes = 0
+
+    async def fetch(self, start, end):
+        """
+        Returns the logs of blocks start to end, splitting the range for as long as the node refuses it
+        """
+        backoff = Backoff()
+        error = None
+        for attempt in range(self.max_retries):
+            await self.limiter.acquire()
+            self.num_requests += 1
+            try:
+                logs = await get_logs(self.session, self.endpoint, self.addresses, self.topics, start, end)
+            except CatchUpError as e:
+                if start < end:
+                    self.shrink(end - start + 1)
+                    middle = (start + end) // 2
+                    return await self.fetch(start, middle) + await self.fetch(middle + 1, end)
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            else:
+                self.grow()
+                return [log for log in logs if not log.get("removed")]
+            logging.warning("Fetching logs of blocks %d to %d failed, attempt %d: %s", start, end, attempt + 1, error)
+            await asyncio.sleep(backoff.next_delay())
+        raise CatchUpError(f"giving up on blocks {start} to {end}: {error}")
+
+    async def log_progress(self, interval):
+        started = time.monotonic()
+        first_block = self.next_block
+        while True:
+            await asyncio.sleep(interval)
+            done = self.next_block - first_block
+            total = self.to_block - first_block + 1
+            rate = done / (time.monotonic() - started)
+            logging.info("Backfilled to block %d, %d of %d blocks, %d logs, %d requests, %d splits, range %d, %.0f blocks/s",
+                         self.next_block - 1, done, total, self.num_logs, self.num_requests, self.num_splits, self.range_size, rate)
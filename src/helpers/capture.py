@@ -0,0 +1,270 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import struct
+import time
+from collections import deque
+from contextlib import contextmanager
+import websockets
+from helpers.read_config import get_capture_config
+
+MAGIC = b"OMWSCAP1\n"
+SUFFIX = ".wscap"
+# Each frame is its arrival time, flags and length, then the frame itself
+FRAME_HEADER = struct.Struct("<dBI")
+SENT = 1
+BINARY = 2
+# Numbers the connections of this process, as shards of one label connect within the same millisecond
+connection_numbers = itertools.count()
+
+class CaptureWriter:
+    """
+    Appends every frame of one websocket connection, with when it arrived, to files under
+    directory named after label, when the connection started, the process and connection
+    numbers, and a part number. Files are never opened over an existing one. A file
+    is rolled over to the next part at max_file_bytes, and flushed at most flush_interval
+    seconds after a frame, so a crash loses no more than that.
+    """
+    def __init__(self, directory, label, max_file_bytes=2 ** 30, flush_interval=1.0):
+        self.directory = directory
+        self.prefix = f"{re.sub(r'[^A-Za-z0-9_.]', '_', label)}-{int(time.time() * 1000)}.{os.getpid()}.{next(connection_numbers)}"
+        self.max_file_bytes = max_file_bytes
+        self.flush_interval = flush_interval
+        self.part = -1
+        self.file = None
+        self.size = 0
+        self.last_flushed = time.monotonic()
+        self.closed = False
+        self.num_frames = 0
+
+    def open_part(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.part += 1
+        self.file = open(os.path.join(self.directory, f"{self.prefix}-{self.part:04d}{SUFFIX}"), "xb", buffering=2 ** 20)
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+
+    def write(self, frame, sent=False, timestamp=None):
+        if self.closed:
+            return
+        flags = SENT if sent else 0
+        if isinstance(frame, str):
+            frame = frame.encode()
+        else:
+            flags |= BINARY
+        if self.file is None or self.size >= self.max_file_bytes:
+            if self.file is not None:
+                self.file.close()
+            self.open_part()
+        self.file.write(FRAME_HEADER.pack(time.time() if timestamp is None else timestamp, flags, len(frame)))
+        self.file.write(frame)
+        self.size += FRAME_HEADER.size + len(frame)
+        self.num_frames += 1
+        now = time.monotonic()
+        if now - self.last_flushed >= self.flush_interval:
+            self.file.flush()
+            self.last_flushed = now
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.closed = True
+
+
+class CapturingWebsocket:
+    """
+    Wraps a websocket connection, writing every frame received and sent to a CaptureWriter.
+    Used as a context manager, the capture is closed on leaving it, however the
+    connection ends, handshake failures included.
+    """
+    def __init__(self, ws, writer):
+        self.ws = ws
+        self.writer = writer
+
+    async def recv(self):
+        frame = await self.ws.recv()
+        self.writer.write(frame)
+        return frame
+
+    async def send(self, message):
+        self.writer.write(message, sent=True)
+        await self.ws.send(message)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.writer.close()
+
+    def __aiter__(self):
+        return self.receive()
+
+    async def receive(self):
+        async for frame in self.ws:
+            self.writer.write(frame)
+            yield frame
+
+    def __getattr__(self, name):
+        return getattr(self.ws, name)
+
+@contextmanager
+def capture_connection(ws, label):
+    """
+    Gives ws wrapped to be captured under label when [CAPTURE] is enabled, or ws itself,
+    closing the capture on the way out. Labels end up in file names, so they should name
+    the provider or stream rather than the endpoint, which can carry an API key.
+    """
+    conf = get_capture_config()
+    if conf["enabled"].lower() not in ("true", "yes", "1"):
+        yield ws
+        return
+    writer = CaptureWriter(conf["directory"], label, int(conf["max_file_bytes"]), float(conf["flush_interval"]))
+    logging.info("Capturing websocket frames of %s to %s", label, writer.directory)
+    with CapturingWebsocket(ws, writer) as captured:
+        yield captured
+
+def read_capture(paths):
+    """
+    Yields the (arrival time, sent, frame) of every frame in the parts of one connection,
+    in order. Text frames are strings and binary ones bytes.
+    """
+    for path in paths:
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a websocket capture")
+            while True:
+                header = f.read(FRAME_HEADER.size)
+                if not header:
+                    break
+                if len(header) < FRAME_HEADER.size:
+                    logging.warning("Skipping the torn end of capture %s", path)
+                    break
+                timestamp, flags, length = FRAME_HEADER.unpack(header)
+                frame = f.read(length)
+                if len(frame) < length:
+                    logging.warning("Skipping the torn end of capture %s", path)
+                    break
+                yield timestamp, bool(flags & SENT), frame if flags & BINARY else frame.decode()
+
+def find_connections(paths):
+    """
+    Groups capture files, and the files in any directories given, into the parts of
+    each connection, in the order the connections started
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in os.listdir(path) if name.endswith(SUFFIX))
+        else:
+            files.append(path)
+    connections = {}
+    for path in sorted(files):
+        connection = os.path.basename(path)[:-len(SUFFIX)].rsplit("-", 1)[0]
+        connections.setdefault(connection, []).append(path)
+    # Started at, then process and connection number, which captures from before those were added lack
+    return sorted(connections.values(), key=lambda parts: [int(n) for n in os.path.basename(parts[0]).rsplit("-", 2)[1].split(".")])
+
+
+class ReplayServer:
+    """
+    A local websocket stand-in that plays captured connections back, one capture per
+    client connection, in turn.
+
+    Frames go out with the gaps they arrived with divided by speed, or back to back when
+    speed is None. A frame captured after the client had sent some messages waits for
+    the client to have sent as many, so subscriptions are set up before anything is
+    played to them, and replies to requests get the id of the request they now answer.
+    """
+    def __init__(self, connections, speed=1.0):
+        self.connections = connections
+        self.speed = speed
+        self.num_connections = 0
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await websockets.serve(self.handle, host, port, max_size=None)
+        return f"ws://{host}:{port}"
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, ws, path=None):
+        parts = self.connections[self.num_connections % len(self.connections)]
+        self.num_connections += 1
+        await replay_connection(ws, parts, self.speed)
+
+def is_reply(frame):
+    return isinstance(frame, str) and '"id"' in frame and '"method"' not in frame
+
+async def replay_connection(ws, parts, speed=1.0):
+    """
+    Plays one captured connection to a client, returning once the client goes away
+    """
+    loop = asyncio.get_running_loop()
+    state = {"received": 0}
+    request_ids = deque()
+    arrived = asyncio.Event()
+
+    async def read_client():
+        try:
+            async for message in ws:
+                state["received"] += 1
+                if isinstance(message, str) and '"method"' in message:
+                    try:
+                        request = json.loads(message)
+                    except ValueError:
+                        request = None
+                    if isinstance(request, dict) and "id" in request:
+                        request_ids.append(request["id"])
+                arrived.set()
+        finally:
+            # Wakes up the player for good once the client is gone
+            arrived.set()
+
+    reader = asyncio.create_task(read_client())
+    num_sent = 0
+    first = None
+    base = loop.time()
+    try:
+        expected = 0
+        for timestamp, sent, frame in read_capture(parts):
+            if sent:
+                expected += 1
+                continue
+            waited = False
+            while state["received"] < expected and not reader.done():
+                arrived.clear()
+                await arrived.wait()
+                waited = True
+            if reader.done():
+                break
+            if first is None:
+                first = timestamp
+            if speed:
+                offset = (timestamp - first) / speed
+                # Time spent waiting on the client doesn't count against the frames after it
+                if waited:
+                    base = loop.time() - offset
+                delay = base + offset - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if is_reply(frame) and request_ids:
+                message = json.loads(frame)
+                if "result" in message or "error" in message:
+                    message["id"] = request_ids.popleft()
+                    frame = json.dumps(message)
+            try:
+                await ws.send(frame)
+            except websockets.ConnectionClosed:
+                break
+            num_sent += 1
+        elapsed = loop.time() - base
+        logging.info("Replayed %d frames of %s in %.2fs", num_sent, os.path.basename(parts[0]), elapsed)
+        await reader
+    finally:
+        reader.cancel()
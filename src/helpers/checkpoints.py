@@ -0,0 +1,56 @@
+import asyncio
+import json
+import logging
+import os
+
+class CheckpointStore:
+    """
+    The position each output stream has been produced up to, persisted to disk.
+
+    Updates only touch memory; they are written out every flush_interval seconds and on
+    flush, each stream to its own file, replaced atomically so a crash never leaves a
+    torn checkpoint behind.
+    """
+    def __init__(self, directory, flush_interval=1):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.positions = {}
+        self.dirty = set()
+
+    def path(self, stream):
+        return os.path.join(self.directory, f"{stream}.json")
+
+    def load(self, stream):
+        try:
+            with open(self.path(stream)) as f:
+                self.positions[stream] = json.load(f)
+        except (OSError, ValueError):
+            self.positions[stream] = None
+        return self.positions[stream]
+
+    def get(self, stream):
+        return self.positions.get(stream)
+
+    def update(self, stream, position):
+        self.positions[stream] = position
+        self.dirty.add(stream)
+
+    def flush(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for stream in self.dirty:
+            tmp_path = self.path(stream) + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.positions[stream], f)
+            os.replace(tmp_path, self.path(stream))
+        self.dirty.clear()
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except OSError as e:
+                    logging.error("Failed to write checkpoints: %s", e)
+        finally:
+            self.flush()
@@ -0,0 +1,154 @@
+import asyncio
+import heapq
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from helpers.log_subscription import parse_notification
+from helpers.metrics import block_latency_histogram, decode_latency_histogram, queue_depth_gauge
+
+# Set in every worker by the executor's initializer, so the decode function is shipped once per process
+worker_decode = None
+
+def init_worker(decode):
+    global worker_decode
+    worker_decode = decode
+
+def decode_batch(notifications):
+    """
+    Parses and decodes a batch of raw notifications, dropping those of stale subscriptions.
+    Each decoded log comes with when it was received and its block's timestamp, if the
+    provider includes one.
+    """
+    decoded = []
+    for frame, subscription_id, received in notifications:
+        try:
+            log = parse_notification(frame, subscription_id)
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning("Dropping malformed notification %s: %r", frame, e)
+            continue
+        if log is None:
+            continue
+        try:
+            decoded.append((received, log.get('blockTimestamp'), worker_decode(log)))
+        except (KeyError, ValueError) as e:
+            logging.warning("Failed to decode log %s: %s", log, e)
+    return decoded
+
+class DecodePool:
+    """
+    Decodes raw log notifications on a pool of workers, away from the websocket receive loops.
+
+    Notifications wait in a bounded ingest queue and are handed to workers in batches.
+    Decoded logs are emitted in (blockNumber, logIndex) order: logs of earlier blocks go
+    out as soon as a later block shows up, and the newest block's logs after hold_time
+    without anything newer.
+
+    A log that only turns up once a later one has been emitted, caught up on after a
+    reconnect say, would break that order, so it goes to emit_late instead, or is dropped
+    without one. Logs already emitted from the last late_window blocks are dropped as
+    duplicates, so a log raced in again by a slower provider never goes out twice.
+    """
+    def __init__(self, decode, emit, num_workers, executor="thread", batch_size=64, queue_size=10000, hold_time=0.1, name="logs",
+                 emit_late=None, late_window=128):
+        self.emit = emit
+        self.emit_late = emit_late
+        self.late_window = late_window
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.hold_time = hold_time
+        executor_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=num_workers, initializer=init_worker, initargs=(decode,))
+        self.ingest_queue = asyncio.Queue(queue_size)
+        # Batches in flight, oldest first, so results are collected in arrival order
+        self.in_flight = asyncio.Queue(num_workers)
+        self.held = []
+        self.newest_block = -1
+        # The furthest (blockNumber, logIndex) emitted, and block number to the log indexes emitted of it
+        self.emitted_up_to = (-1, -1)
+        self.emitted = {}
+        self.num_decoded = 0
+        self.num_late = 0
+        self.num_duplicates = 0
+        # Named in the metrics, for processes running more than one pool
+        self.block_latency = block_latency_histogram(name)
+        self.decode_latency = decode_latency_histogram(name)
+        queue_depth_gauge("decode-ingest", name, self.ingest_queue.qsize)
+        queue_depth_gauge("decode-held", name, lambda: len(self.held))
+
+    async def submit(self, frame, subscription_id):
+        await self.ingest_queue.put((frame, subscription_id, time.time()))
+
+    def metrics(self):
+        return {
+            "ingest_queue": self.ingest_queue.qsize(),
+            "batches_in_flight": self.in_flight.qsize(),
+            "held_logs": len(self.held),
+            "decoded_logs": self.num_decoded,
+            "late_logs": self.num_late,
+            "duplicate_logs": self.num_duplicates,
+        }
+
+    async def run(self, metrics_log_interval=60):
+        tasks = [asyncio.create_task(self.dispatch()), asyncio.create_task(self.collect()),
+                 asyncio.create_task(self.log_metrics(metrics_log_interval))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.executor.shutdown(wait=False)
+
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.ingest_queue.get()]
+            while len(batch) < self.batch_size and not self.ingest_queue.empty():
+                batch.append(self.ingest_queue.get_nowait())
+            await self.in_flight.put(loop.run_in_executor(self.executor, decode_batch, batch))
+
+    async def collect(self):
+        while True:
+            try:
+                future = await asyncio.wait_for(self.in_flight.get(), self.hold_time if self.held else None)
+            except asyncio.TimeoutError:
+                await self.release(None)
+                continue
+            decoded = await future
+            now = time.time()
+            for received, block_timestamp, processed_log in decoded:
+                self.decode_latency.observe(now - received)
+                if block_timestamp is not None:
+                    self.block_latency.observe(received - int(block_timestamp, 16))
+                self.num_decoded += 1
+                block_number = processed_log['blockNumber']
+                if block_number > self.newest_block:
+                    self.newest_block = block_number
+                heapq.heappush(self.held, (block_number, processed_log['logIndex'], self.num_decoded, processed_log))
+            await self.release(self.newest_block)
+
+    async def release(self, before_block):
+        """
+        Emits held logs of blocks before before_block, or all of them when it is None
+        """
+        while self.held and (before_block is None or self.held[0][0] < before_block):
+            block_number, log_index, _, processed_log = heapq.heappop(self.held)
+            emitted = self.emitted.setdefault(block_number, set())
+            if log_index in emitted:
+                self.num_duplicates += 1
+                continue
+            emitted.add(log_index)
+            if (block_number, log_index) < self.emitted_up_to:
+                self.num_late += 1
+                if self.emit_late is not None:
+                    await self.emit_late(processed_log)
+                continue
+            if block_number > self.emitted_up_to[0]:
+                for old_block in [old_block for old_block in self.emitted if old_block <= block_number - self.late_window]:
+                    del self.emitted[old_block]
+            self.emitted_up_to = (block_number, log_index)
+            await self.emit(processed_log)
+
+    async def log_metrics(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            logging.info("Decode pool: %s", self.metrics())
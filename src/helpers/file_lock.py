@@ -0,0 +1,23 @@
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+def lock_file(file, blocking=True):
+    """
+    Takes an exclusive lock on an open file, returning whether it was taken, which
+    without blocking it is not while someone else holds it. The lock is released when
+    the file is closed, or with the process holding it, so one left by a process that
+    died is free again.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        if blocking:
+            raise
+        return False
+    return True
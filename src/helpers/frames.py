@@ -0,0 +1,77 @@
+import json
+import zlib
+from helpers.json_backend import get_json_backend
+
+GZIP_MAGIC = b"\x1f\x8b"
+# zlib window bits for a gzip member and for raw deflate
+GZIP_WBITS = 31
+DEFLATE_WBITS = -15
+PING_PREFIX = b'{"ping"'
+
+class FrameDecoder:
+    """
+    Parses every frame of one exchange connection exactly once, as JSON.
+
+    Binary frames starting with the gzip magic are inflated first, each with a copy of
+    one decompressor set up when the decoder is, rather than going through the gzip
+    module. Pings in them, as Huobi sends, are answered with a pong on the side and
+    never reach the sinks.
+
+    Exchanges framing their messages differently subclass it, overriding inflate and control.
+    """
+    def __init__(self, loads=None):
+        self.loads = loads or get_json_backend()[0]
+        self.gzip = zlib.decompressobj(GZIP_WBITS)
+
+    def inflate(self, frame):
+        if isinstance(frame, bytes) and frame.startswith(GZIP_MAGIC):
+            return self.gzip.copy().decompress(frame)
+        return frame
+
+    def control(self, data):
+        """
+        The reply to data if it is a control frame, empty if it needs none, or None for a message
+        """
+        if isinstance(data, bytes) and data.startswith(PING_PREFIX):
+            return json.dumps({'pong': self.loads(data)['ping']})
+        return None
+
+    async def decode(self, frame, ws):
+        """
+        The message in a frame, or None for a control frame, answered on ws if it asks for an answer
+        """
+        data = self.inflate(frame)
+        reply = self.control(data)
+        if reply is None:
+            return self.loads(data)
+        if reply:
+            await ws.send(reply)
+        return None
+
+
+class OkexFrameDecoder(FrameDecoder):
+    """
+    OKEx deflates its binary frames without a header, and answers the pings sent to it
+    with a bare pong that isn't JSON
+    """
+    def __init__(self, loads=None):
+        super().__init__(loads)
+        self.deflate = zlib.decompressobj(DEFLATE_WBITS)
+
+    def inflate(self, frame):
+        if isinstance(frame, bytes):
+            return self.deflate.copy().decompress(frame)
+        return frame
+
+    def control(self, data):
+        if data == "pong" or data == b"pong":
+            return ""
+        return None
+
+# Exchange to the decoder of its frames, anything else gets a FrameDecoder
+DECODERS = {
+    "okex": OkexFrameDecoder,
+}
+
+def create_frame_decoder(exchange, loads=None):
+    return DECODERS.get(exchange, FrameDecoder)(loads)
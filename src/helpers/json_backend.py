@@ -0,0 +1,37 @@
+import json
+import logging
+from helpers.read_config import get_frames_config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_dumps(obj):
+    return json.dumps(obj).encode('utf-8')
+
+def orjson_dumps(obj):
+    try:
+        # orjson hands back its whole output buffer, a KiB at least, so what gets queued is copied down to size
+        return bytes(memoryview(orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)))
+    except TypeError:
+        # Such as integers beyond 64 bits, token amounts in wei among them
+        return json_dumps(obj)
+
+def get_json_backend(name=None):
+    """
+    The (loads, dumps) of the JSON library named, or by json_backend in [FRAMES]: json,
+    orjson, or auto for orjson whenever it is installed. loads takes str or bytes and
+    dumps returns bytes.
+
+    orjson reads integers beyond 64 bits as floats, so it is only for feeds, like the
+    exchanges', with none of those in them.
+    """
+    name = name or get_frames_config()['json_backend'].strip()
+    if name in ("orjson", "auto") and orjson is not None:
+        return orjson.loads, orjson_dumps
+    if name == "orjson":
+        logging.warning("orjson is not installed, parsing JSON with the json module")
+    elif name not in ("json", "auto"):
+        raise ValueError(f"json_backend is {name}, not one of json, orjson or auto")
+    return json.loads, json_dumps
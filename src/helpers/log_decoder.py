@@ -0,0 +1,114 @@
+import json
+from functools import lru_cache
+from eth_utils import keccak, to_checksum_address
+
+# Every static ABI value occupies one 32 byte word, i.e. 64 hex characters
+WORD_SIZE = 64
+INT256_SIGN = 2 ** 255
+INT256_MODULUS = 2 ** 256
+
+
+@lru_cache(maxsize=4096)
+def decode_address(word):
+    return to_checksum_address("0x" + word[24:])
+
+def decode_uint(word):
+    return int(word, 16)
+
+def decode_int(word):
+    # ABI sign extends every intN to 256 bits, so the 256 bit two's complement works for all of them
+    value = int(word, 16)
+    if value >= INT256_SIGN:
+        value -= INT256_MODULUS
+    return value
+
+def decode_bool(word):
+    return int(word, 16) != 0
+
+def get_word_decoder(abi_type):
+    if abi_type == "address":
+        return decode_address
+    if abi_type == "bool":
+        return decode_bool
+    if abi_type.startswith("uint"):
+        return decode_uint
+    if abi_type.startswith("int"):
+        return decode_int
+    raise ValueError(f"decoding event inputs of type {abi_type} not supported")
+
+def event_topic(event_abi):
+    signature = "%s(%s)" % (event_abi["name"], ",".join(i["type"] for i in event_abi["inputs"]))
+    return "0x" + keccak(text=signature).hex()
+
+def compile_event(event_abi):
+    """
+    Precompiles an event ABI into its name, the number of topics it carries and a
+    tuple of (name, is_topic, offset, decoder) fields, in the order web3 yields them
+    """
+    topic_fields = []
+    data_fields = []
+    for event_input in event_abi["inputs"]:
+        decoder = get_word_decoder(event_input["type"])
+        if event_input["indexed"]:
+            # Topic 0 is the event signature, so indexed inputs start at topic 1
+            topic_fields.append((event_input["name"], True, len(topic_fields) + 1, decoder))
+        else:
+            offset = 2 + len(data_fields) * WORD_SIZE
+            data_fields.append((event_input["name"], False, offset, decoder))
+    return event_abi["name"], len(topic_fields) + 1, tuple(topic_fields + data_fields)
+
+
+class LogDecoder:
+    """
+    Decodes raw JSON-RPC log objects straight from their hex strings.
+
+    Layouts are compiled once per event and looked up by topic 0, so decoding a log
+    never touches HexBytes, AttributeDict or the web3 contract machinery.
+    """
+    def __init__(self, abi, event_names):
+        self.layouts = {}
+        for entry in abi:
+            if entry.get("type") == "event" and entry["name"] in event_names:
+                self.layouts[event_topic(entry)] = compile_event(entry)
+        missing = set(event_names) - {layout[0] for layout in self.layouts.values()}
+        if missing:
+            raise ValueError(f"events {sorted(missing)} not found in ABI")
+
+    @classmethod
+    def from_abi_file(cls, abi_path, event_names):
+        with open(abi_path) as f:
+            return cls(json.load(f), event_names)
+
+    @classmethod
+    def combine(cls, decoders):
+        """
+        Merges decoders into one, as long as no topic is laid out differently by two of them
+        """
+        combined = cls.__new__(cls)
+        combined.layouts = {}
+        for decoder in decoders:
+            for topic, layout in decoder.layouts.items():
+                if combined.layouts.setdefault(topic, layout) != layout:
+                    raise ValueError(f"event {layout[0]} has conflicting layouts for topic {topic}")
+        return combined
+
+    @property
+    def topics(self):
+        return list(self.layouts.keys())
+
+    def decode(self, log):
+        """
+        Returns the event name and its decoded arguments for a raw log
+        """
+        topics = log["topics"]
+        name, num_topics, fields = self.layouts[topics[0]]
+        if len(topics) != num_topics:
+            raise ValueError(f"expected {num_topics} topics for {name}, got {len(topics)}")
+        data = log["data"]
+        args = {}
+        for field_name, is_topic, offset, decoder in fields:
+            if is_topic:
+                args[field_name] = decoder(topics[offset][2:])
+            else:
+                args[field_name] = decoder(data[offset:offset + WORD_SIZE])
+        return name, args
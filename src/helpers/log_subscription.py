@@ -0,0 +1,190 @@
+import aiohttp
+import asyncio
+import itertools
+import json
+import logging
+import websockets
+from urllib.parse import urlparse
+from helpers.capture import capture_connection
+from helpers.reconnect import Backoff, CatchUpError
+
+class SubscriptionError(Exception):
+    pass
+
+def parse_notification(frame, subscription_id):
+    """
+    Returns the log a notification carries, or None if it is from a stale subscription
+    """
+    params = json.loads(frame)["params"]
+    if params["subscription"] != subscription_id:
+        return None
+    return params["result"]
+
+def shard(items, num_shards):
+    """
+    Splits items round robin into at most num_shards non-empty lists
+    """
+    shards = [items[i::num_shards] for i in range(num_shards)]
+    return [items_shard for items_shard in shards if items_shard]
+
+class LogSubscription:
+    """
+    A websocket connection carrying a single logs subscription, filtering on a list of
+    addresses and any of a list of topics.
+
+    Each connection has its own receive task. Notifications are handed to
+    on_notification unparsed, along with the subscription id they are expected to
+    carry, so parsing them can happen elsewhere. Replies are parsed once and resolve
+    the request that sent them. The address list can be changed while running
+    without reconnecting.
+
+    A dropped connection is reconnected after a jittered backoff. With a catch_up, the
+    logs missed in the meantime are then fetched and handed on as notifications of the
+    new subscription, behind the live ones; telling the two apart is left to the receiver.
+    """
+    def __init__(self, ws_endpoint, addresses, topics, on_notification, catch_up=None, backoff=None):
+        self.ws_endpoint = ws_endpoint
+        self.addresses = addresses
+        self.topics = topics
+        self.on_notification = on_notification
+        self.catch_up = catch_up
+        self.backoff = backoff or Backoff()
+        self.catch_up_task = None
+        self.ws = None
+        self.subscription_id = None
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        # Captures are named after the host, as the rest of the endpoint may be an API key
+        self.capture_label = "logs-" + (urlparse(ws_endpoint).hostname or "unknown")
+
+    async def run(self):
+        # On the first connection, resume from wherever the receiver last got to, if anywhere
+        resume_block = self.catch_up.resume_block() if self.catch_up else None
+        try:
+            await self.run_connections(resume_block)
+        finally:
+            if self.catch_up_task is not None:
+                self.catch_up_task.cancel()
+
+    async def run_connections(self, resume_block):
+        while True:
+            try:
+                async with websockets.connect(self.ws_endpoint) as ws:
+                    with capture_connection(ws, self.capture_label) as self.ws:
+                        receiver = asyncio.create_task(self.receive())
+                        try:
+                            await self.subscribe()
+                            logging.info("Subscribed to logs of %d addresses", len(self.addresses))
+                            self.backoff.reset()
+                            if resume_block is not None and self.addresses:
+                                self.catch_up_task = asyncio.create_task(self.catch_up_from(resume_block))
+                            await receiver
+                        finally:
+                            receiver.cancel()
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException, SubscriptionError) as e:
+                logging.warning("Logs subscription of %d addresses dropped: %r", len(self.addresses), e)
+            else:
+                logging.warning("Logs subscription of %d addresses closed by the node", len(self.addresses))
+            finally:
+                self.ws = None
+            if self.catch_up:
+                # An unfinished catch up is redone from where it started, as it may have left gaps
+                if self.catch_up_task is None or self.catch_up_task.done():
+                    resume_block = self.catch_up.resume_block()
+                else:
+                    self.catch_up_task.cancel()
+            await asyncio.sleep(self.backoff.next_delay())
+
+    async def catch_up_from(self, from_block):
+        try:
+            async for log in self.catch_up.fetch(self.addresses, self.topics, from_block):
+                frame = json.dumps({"jsonrpc": "2.0", "method": "eth_subscription",
+                                    "params": {"subscription": self.subscription_id, "result": log}})
+                await self.on_notification(frame, self.subscription_id)
+        except (CatchUpError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error("Failed to catch up on logs from block %d: %s", from_block, e)
+
+    async def request(self, method, params):
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (method, future)
+        await self.ws.send(json.dumps({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}))
+        return await future
+
+    async def subscribe(self):
+        # An empty address list would match every contract on chain
+        if not self.addresses:
+            self.subscription_id = None
+            return
+        log_filter = {"address": self.addresses, "topics": [self.topics]}
+        await self.request("eth_subscribe", ["logs", log_filter])
+
+    async def resubscribe(self, addresses):
+        """
+        Swaps the subscription for one on addresses. Notifications from the old
+        subscription are dropped from the moment the new one is confirmed.
+        """
+        self.addresses = addresses
+        if self.ws is None:
+            return
+        old_subscription_id = self.subscription_id
+        await self.subscribe()
+        if old_subscription_id is not None:
+            await self.request("eth_unsubscribe", [old_subscription_id])
+        logging.info("Resubscribed to logs of %d addresses", len(self.addresses))
+
+    async def receive(self):
+        try:
+            await self.receive_frames()
+        finally:
+            # Nothing waiting on a reply would ever hear back once the connection is gone
+            for method, future in self.pending.values():
+                if not future.done():
+                    future.set_exception(SubscriptionError(f"connection closed before {method} was answered"))
+            self.pending.clear()
+
+    async def receive_frames(self):
+        async for frame in self.ws:
+            # Only notifications carry the method name, log data is all hex
+            if '"eth_subscription"' in frame:
+                await self.on_notification(frame, self.subscription_id)
+                continue
+            message = json.loads(frame)
+            method, future = self.pending.pop(message.get("id"), (None, None))
+            if future is None:
+                logging.warning("Unexpected message on logs subscription: %s", message)
+            elif "error" in message:
+                future.set_exception(SubscriptionError(message["error"]))
+            else:
+                # Switched here rather than in subscribe, so no notification can slip in between
+                if method == "eth_subscribe":
+                    self.subscription_id = message["result"]
+                future.set_result(message["result"])
+
+
+class ShardedLogSubscriptions:
+    """
+    Spreads addresses over num_connections LogSubscriptions and keeps them balanced
+    as addresses are added and removed
+    """
+    def __init__(self, ws_endpoint, addresses, topics, on_notification, num_connections, catch_up=None):
+        self.subscriptions = [LogSubscription(ws_endpoint, addresses_shard, topics, on_notification, catch_up)
+                              for addresses_shard in shard(list(addresses), num_connections)]
+        # Started even when there are fewer addresses than connections, so added pairs have somewhere to go
+        while len(self.subscriptions) < num_connections:
+            self.subscriptions.append(LogSubscription(ws_endpoint, [], topics, on_notification, catch_up))
+
+    async def run(self):
+        await asyncio.gather(*[subscription.run() for subscription in self.subscriptions])
+
+    async def update(self, added, removed):
+        removed = set(removed)
+        new_addresses = {}
+        for subscription in self.subscriptions:
+            kept = [address for address in subscription.addresses if address not in removed]
+            if len(kept) != len(subscription.addresses):
+                new_addresses[subscription] = kept
+        for address in added:
+            subscription = min(self.subscriptions, key=lambda s: len(new_addresses.get(s, s.addresses)))
+            new_addresses.setdefault(subscription, list(subscription.addresses)).append(address)
+        await asyncio.gather(*[subscription.resubscribe(addresses) for subscription, addresses in new_addresses.items()])
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from aiohttp import web
+from helpers.read_config import get_metrics_config
+
+# Upper bounds in seconds, from a millisecond up to a block falling minutes behind
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class Counter:
+    """
+    A count that only goes up. Only ever updated from the event loop, so a plain int does.
+    """
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """
+    Counts of observations per bucket, plus their sum. The buckets are fixed when it is
+    created, so observing is a bisect and two additions.
+    """
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        # The last count is for observations above every bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in pairs) + "}"
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """
+    Every counter, gauge and histogram of a process, by name and labels.
+
+    Counters and histograms are created once by whatever updates them and kept hold of,
+    so the hot path never looks anything up. Gauges are functions called when the
+    metrics are read, so queue depths and the like cost nothing in between.
+    """
+    def __init__(self):
+        # Name to its type, help text and the metrics of each set of labels
+        self.families = {}
+
+    def family(self, name, kind, help_text):
+        if name not in self.families:
+            self.families[name] = (kind, help_text, {})
+        elif self.families[name][0] != kind:
+            raise ValueError(f"metric {name} is already a {self.families[name][0]}")
+        return self.families[name][2]
+
+    def counter(self, name, help_text, **labels):
+        metrics = self.family(name, "counter", help_text)
+        key = tuple(sorted(labels.items()))
+        if key not in metrics:
+            metrics[key] = Counter()
+        return metrics[key]
+
+    def histogram(self, name, help_text, bounds=LATENCY_BUCKETS, **labels):
+        metrics = self.family(name, "histogram", help_text)
+        key = tuple(sorted(labels.items()))
+        if key not in metrics:
+            metrics[key] = Histogram(bounds)
+        return metrics[key]
+
+    def gauge(self, name, help_text, read, **labels):
+        """
+        Registers read, a function returning the current value, replacing any gauge with the same labels
+        """
+        self.family(name, "gauge", help_text)[tuple(sorted(labels.items()))] = read
+
+    def remove_gauge(self, name, **labels):
+        if name in self.families:
+            self.families[name][2].pop(tuple(sorted(labels.items())), None)
+
+    def render(self):
+        """
+        The metrics in the Prometheus text format
+        """
+        lines = []
+        for name, (kind, help_text, metrics) in sorted(self.families.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in list(metrics.items()):
+                if kind == "counter":
+                    lines.append(f"{name}{format_labels(labels)} {metric.value}")
+                elif kind == "gauge":
+                    try:
+                        value = metric()
+                    except Exception as e:
+                        logging.warning("Failed to read gauge %s%s: %r", name, format_labels(labels), e)
+                        continue
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                else:
+                    cumulative = 0
+                    for bound, count in zip(metric.bounds + (float("inf"),), metric.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels, [('le', format_value(bound))])} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {format_value(metric.sum)}")
+                    lines.append(f"{name}_count{format_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+# Shared by everything in the process, and served by serve_metrics
+REGISTRY = MetricsRegistry()
+
+def message_counters(sink, stream):
+    """
+    Counters of the messages, and their bytes, handed to a sink for a stream
+    """
+    return (REGISTRY.counter("collector_messages_total", "Messages handed to a sink", sink=sink, stream=stream),
+            REGISTRY.counter("collector_bytes_total", "Bytes of messages handed to a sink", sink=sink, stream=stream))
+
+def sink_ack_histogram(sink, stream):
+    return REGISTRY.histogram("collector_decode_to_ack_seconds",
+                              "From a message being decoded or created to the sink acknowledging it", sink=sink, stream=stream)
+
+def block_latency_histogram(source):
+    return REGISTRY.histogram("collector_block_to_receive_seconds",
+                              "From the timestamp of a message's block to it being received", source=source)
+
+def decode_latency_histogram(source):
+    return REGISTRY.histogram("collector_receive_to_decode_seconds",
+                              "From a message being received to it being decoded", source=source)
+
+def queue_depth_gauge(queue, source, read):
+    REGISTRY.gauge("collector_queue_depth", "Items waiting in a queue", read, queue=queue, source=source)
+
+async def serve_metrics(registry=REGISTRY):
+    """
+    Serves the registry's metrics on /metrics at the host and port in [METRICS], until
+    cancelled. A port already taken, by another collector on the same host, only costs
+    this process its endpoint.
+    """
+    conf = get_metrics_config()
+    if conf["enabled"].lower() not in ("true", "yes", "1"):
+        return
+
+    async def metrics(request):
+        return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, conf["host"], int(conf["port"])).start()
+    except OSError as e:
+        logging.warning("Not serving metrics, %s:%s is unavailable: %s", conf["host"], conf["port"], e)
+        await runner.cleanup()
+        return
+    logging.info("Serving metrics on http://%s:%s/metrics", conf["host"], conf["port"])
+    try:
+        await asyncio.Future()
+    finally:
+        await runner.cleanup()
@@ -20,4 +20,19 @@ def normalise_transaction(transaction, block_msg):
     res["gas"] = int(transaction["gas"], 16)
     res["gas_price"] = int(transaction["gasPrice"], 16)
     res["value"] = int(transaction["value"], 16)
-    return res
\ No newline at end of file
+    return res
+
+def normalise_block_transactions(transactions, block_msg):
+    """
+    Helper for normalising all of a block's transactions into a single record,
+    with the block data once and one column per transaction field
+    """
+    return {
+        "block_data": block_msg,
+        "tx_hash": [transaction["hash"] for transaction in transactions],
+        "from": [transaction["from"] for transaction in transactions],
+        "to": [transaction["to"] for transaction in transactions],
+        "gas": [int(transaction["gas"], 16) for transaction in transactions],
+        "gas_price": [int(transaction["gasPrice"], 16) for transaction in transactions],
+        "value": [int(transaction["value"], 16) for transaction in transactions],
+    }
\ No newline at end of file
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import os
+import aiohttp
+
+class PairRegistry:
+    """
+    The pairs a collector follows, keyed by lowercase address.
+
+    Pairs are loaded from an on-disk snapshot when there is one, so startup never waits
+    on the subgraph, and are then refreshed in the background. Every refresh is diffed
+    against the live set and listeners are told which pairs were added and removed.
+    The pairs dict is updated in place, so holders of it always see the live set.
+    """
+    def __init__(self, name, graph_endpoint, query, parse_pair, snapshot_dir, refresh_interval):
+        self.name = name
+        self.graph_endpoint = graph_endpoint
+        self.query = query
+        self.parse_pair = parse_pair
+        self.snapshot_path = os.path.join(snapshot_dir, f"{name}_pairs.json")
+        self.refresh_interval = refresh_interval
+        self.pairs = {}
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """
+        Registers a coroutine function called with the added and removed addresses after each refresh
+        """
+        self.listeners.append(listener)
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path) as f:
+                self.pairs.update(json.load(f))
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def save_snapshot(self):
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.pairs, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    async def fetch(self, session):
+        async with session.post(self.graph_endpoint, json={"query": self.query}) as res:
+            result = await res.json()
+        return dict(self.parse_pair(pair) for pair in result["data"]["pairs"])
+
+    async def load(self, session):
+        """
+        Fills the registry from the snapshot, only going to the subgraph if there is none.
+        Returns whether the snapshot was used, in which case it wants refreshing soon.
+        """
+        if self.load_snapshot():
+            logging.info("Loaded %d %s pairs from snapshot", len(self.pairs), self.name)
+            return True
+        self.pairs.update(await self.fetch(session))
+        self.save_snapshot()
+        logging.info("Loaded %d %s pairs from subgraph", len(self.pairs), self.name)
+        return False
+
+    async def refresh(self, session):
+        latest = await self.fetch(session)
+        added = [address for address in latest if address not in self.pairs]
+        removed = [address for address in self.pairs if address not in latest]
+        # New pairs are known before they are subscribed to, and removed ones are
+        # only forgotten once listeners have unsubscribed from them. Should a listener
+        # fail, the new pairs are forgotten again, so the next refresh retries both
+        self.pairs.update(latest)
+        if added or removed:
+            logging.info("%s pairs changed, %d added and %d removed", self.name, len(added), len(removed))
+            try:
+                for listener in self.listeners:
+                    await listener(added, removed)
+            except Exception:
+                for address in added:
+                    del self.pairs[address]
+                raise
+        for address in removed:
+            del self.pairs[address]
+        self.save_snapshot()
+
+    async def refresh_forever(self, session, initial_delay=0):
+        await asyncio.sleep(initial_delay)
+        while True:
+            try:
+                await self.refresh(session)
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+                logging.warning("Failed to refresh %s pairs: %s", self.name, e)
+            except Exception:
+                # Listeners fail too, such as when a connection drops while resubscribing
+                logging.exception("Failed to refresh %s pairs", self.name)
+            await asyncio.sleep(self.refresh_interval)
@@ -0,0 +1,298 @@
+import dotenv
+import asyncio
+import json
+import time
+import aiohttp
+import logging
+from functools import partial
+from helpers.checkpoints import CheckpointStore
+from helpers.decode_pool import DecodePool
+from helpers.log_decoder import LogDecoder
+from helpers.provider_race import RacingLogSubscriptions, get_providers
+from helpers.pair_registry import PairRegistry
+from helpers.reconnect import LogCatchUp
+from helpers.read_config import get_subscription_config, get_pairs_config, get_decode_config, get_indicators_config, get_protocols_config, get_race_config, get_reconnect_config, get_checkpoints_config, get_archived_streams
+from sink_connector.archive_producer import ArchiveProducer, TeeProducer
+from sink_connector.redis_producer import RedisProducer
+from uniswap_helpers.v2_block_indicators import BlockIndicators
+from uniswap_helpers.v3_pool_state import create_pool_state_engine
+
+PROTOCOLS_PATH = "helpers/protocols.json"
+
+# Consumers a protocol can name, made with (producer, pairs, session, rest_endpoint). Each has
+# add(processed_log) for the protocol's logs in block order, update(added, removed) for its
+# pair refreshes and run()
+CONSUMERS = {
+    "v3_pool_state": create_pool_state_engine,
+}
+
+
+def get_field(pair, path):
+    for key in path.split("."):
+        pair = pair[key]
+    return pair
+
+class Protocol:
+    """
+    A DEX as declared in protocols.json: its pair ABI and events, the stream its logs
+    go to, if any, and how to discover its pairs and which of their fields to attach to
+    each log. A consumer named in CONSUMERS gets its logs too, producing to consumer_stream.
+    """
+    def __init__(self, name, definition):
+        self.name = name
+        self.exchange = definition["exchange"]
+        self.abi_path = definition["abi"]
+        self.event_names = definition["events"]
+        self.stream = definition.get("stream")
+        self.indicators_stream = definition.get("indicators_stream")
+        self.consumer = definition.get("consumer")
+        self.consumer_stream = definition.get("consumer_stream")
+        if self.consumer is not None and self.consumer not in CONSUMERS:
+            raise ValueError(f"consumer {self.consumer} of {name} is not one of {', '.join(CONSUMERS)}")
+        self.graph_endpoint = definition["graph_endpoint"]
+        self.pairs_query = definition["pairs_query"]
+        self.pair_fields = definition["pair_fields"]
+
+    def parse_pair(self, pair):
+        return pair['id'], {field: get_field(pair, path) for field, path in self.pair_fields.items()}
+
+    def create_decoder(self):
+        return LogDecoder.from_abi_file(self.abi_path, self.event_names)
+
+    def create_registry(self):
+        conf = get_pairs_config()
+        return PairRegistry(self.name, self.graph_endpoint, self.pairs_query, self.parse_pair,
+                            conf['snapshot_dir'], float(conf['refresh_interval']))
+
+def load_protocols(names, path=PROTOCOLS_PATH):
+    with open(path) as f:
+        definitions = json.load(f)
+    unknown = set(names) - set(definitions)
+    if unknown:
+        raise ValueError(f"protocols {sorted(unknown)} not defined in {path}")
+    return [Protocol(name, definitions[name]) for name in names]
+
+def decode_log(decoder, log):
+    event_type, args = decoder.decode(log)
+    return {
+        'logIndex': int(log['logIndex'], 16),
+        'transactionIndex': int(log['transactionIndex'], 16),
+        'transactionHash': log['transactionHash'].lower(),
+        'address': log['address'].lower(),
+        'blockHash': log['blockHash'].lower(),
+        'blockNumber': int(log['blockNumber'], 16),
+        'type': event_type,
+        # Filled in once the log's pair, and so its protocol, is known
+        'exchange': None,
+        'data': args,
+        'processedTimestamp': int(time.time() * (10 ** 3))
+    }
+
+def add_pair_info(processed_log, protocol, pairs):
+    processed_log['exchange'] = protocol.exchange
+    args = processed_log['data']
+    event_pair_info = pairs[processed_log['address']]
+    for field in protocol.pair_fields:
+        args[field] = event_pair_info[field]
+    return processed_log
+
+def process_log(protocol, decoder, log, pairs):
+    return add_pair_info(decode_log(decoder, log), protocol, pairs)
+
+
+class ProtocolRuntime:
+    """
+    Runs any number of protocols in one event loop.
+
+    All protocols share one set of websocket subscriptions over the union of their
+    pairs and topics, raced across providers, one decode pool with a decoder combining
+    all of their events, and one writer per output stream. Decoded logs are routed back
+    to their protocol by pair address.
+
+    The position each stream has been produced up to is checkpointed. On startup, and
+    whenever a subscription reconnects, the logs missed since then are caught up on
+    through rest_endpoint, and logs a previous run already produced are dropped. Logs
+    caught up on after later ones went out are still produced to their stream, but not
+    added to indicators, whose blocks are already closed, or handed to consumers.
+    """
+    def __init__(self, protocols, providers, rest_endpoint=None):
+        self.protocols = protocols
+        self.providers = providers
+        self.rest_endpoint = rest_endpoint
+        self.registries = {protocol.name: protocol.create_registry() for protocol in protocols}
+        self.decoder = LogDecoder.combine([protocol.create_decoder() for protocol in protocols])
+        self.producers = {}
+        self.indicators = {}
+        # Protocol name to the consumer its logs are handed to
+        self.consumers = {}
+        # Pair address to the protocol and registry pairs it belongs to
+        self.routes = {}
+        checkpoints_conf = get_checkpoints_config()
+        self.checkpoints = CheckpointStore(checkpoints_conf['directory'], float(checkpoints_conf['flush_interval']))
+        # Stream to the (blockNumber, logIndex) it had been produced up to at startup
+        self.resumed_from = {}
+        self.last_block = None
+
+    def get_producer(self, stream):
+        if stream not in self.producers:
+            producer = RedisProducer(stream)
+            if stream in get_archived_streams():
+                producer = TeeProducer([producer, ArchiveProducer(stream)])
+            producer.start_writer()
+            self.producers[stream] = producer
+        return self.producers[stream]
+
+    def add_routes(self, protocol, addresses):
+        pairs = self.registries[protocol.name].pairs
+        for address in addresses:
+            if address in self.routes and self.routes[address][0] is not protocol:
+                logging.warning("Pair %s is in both %s and %s, keeping %s", address, self.routes[address][0].name, protocol.name, protocol.name)
+            self.routes[address] = (protocol, pairs)
+
+    def route(self, processed_log):
+        """
+        Returns the protocol a decoded log belongs to with its pair's fields added, or None
+        """
+        route = self.routes.get(processed_log['address'])
+        if route is None:
+            return None
+        protocol, pairs = route
+        # The pair may have been dropped by a refresh while its log was being decoded,
+        # and a pair can emit another protocol's event with the same signature
+        if processed_log['address'] not in pairs or processed_log['type'] not in protocol.event_names:
+            return None
+        add_pair_info(processed_log, protocol, pairs)
+        return protocol
+
+    async def emit(self, processed_log, late=False):
+        protocol = self.route(processed_log)
+        if protocol is None:
+            return
+        position = (processed_log['blockNumber'], processed_log['logIndex'])
+        if protocol.stream is not None:
+            resumed_from = self.resumed_from.get(protocol.stream)
+            if resumed_from is not None and position <= resumed_from:
+                return
+            await self.get_producer(protocol.stream).produce(processed_log['processedTimestamp'], json.dumps(processed_log),
+                                                             processed_log['processedTimestamp'] / 10 ** 3)
+        self.advance(protocol.stream, position)
+        if late:
+            return
+        if protocol.name in self.indicators:
+            await self.indicators[protocol.name].add(processed_log)
+        if protocol.name in self.consumers:
+            await self.consumers[protocol.name].add(processed_log)
+
+    def advance(self, stream, position):
+        if stream is not None:
+            checkpoint = self.checkpoints.get(stream)
+            if checkpoint is None or position > tuple(checkpoint):
+                self.checkpoints.update(stream, list(position))
+        if self.last_block is None or position[0] > self.last_block:
+            self.last_block = position[0]
+
+    def load_checkpoints(self):
+        for protocol in self.protocols:
+            if protocol.stream is None:
+                continue
+            checkpoint = self.checkpoints.load(protocol.stream)
+            if checkpoint is not None:
+                self.resumed_from[protocol.stream] = tuple(checkpoint)
+        # Catching up from the stream furthest behind covers all of them
+        if self.resumed_from:
+            self.last_block = min(block_number for block_number, _ in self.resumed_from.values())
+            logging.info("Resuming protocols from block %d", self.last_block)
+
+    def route_listener(self, protocol):
+        async def listener(added, removed):
+            # Only addresses no other protocol was already following change the subscriptions
+            subscribe = [address for address in added if address not in self.routes]
+            previous = {address: self.routes[address] for address in added + removed if address in self.routes}
+            for address in removed:
+                if self.routes.get(address, (None,))[0] is protocol:
+                    del self.routes[address]
+            unsubscribe = [address for address in removed if address not in self.routes]
+            self.add_routes(protocol, added)
+            try:
+                await self.subscriptions.update(subscribe, unsubscribe)
+            except Exception:
+                # Routes go back to how they were, for the next refresh to retry the same changes
+                for address in added + removed:
+                    self.routes.pop(address, None)
+                self.routes.update(previous)
+                raise
+        return listener
+
+    async def run(self):
+        self.load_checkpoints()
+        for protocol in self.protocols:
+            if protocol.stream is not None:
+                self.get_producer(protocol.stream)
+            if protocol.indicators_stream:
+                # Per-block indicators are aggregated from the same logs, publishing as each block closes
+                self.indicators[protocol.name] = BlockIndicators(self.get_producer(protocol.indicators_stream),
+                    self.registries[protocol.name].pairs, float(get_indicators_config()['close_timeout']), protocol.exchange)
+
+        # Notifications are parsed and decoded off the receive loops, then emitted in block order
+        decode_conf = get_decode_config()
+        pool = DecodePool(partial(decode_log, self.decoder), self.emit, int(decode_conf['num_workers']), decode_conf['executor'],
+                          int(decode_conf['batch_size']), int(decode_conf['queue_size']), float(decode_conf['hold_time']),
+                          emit_late=partial(self.emit, late=True))
+
+        async with aiohttp.ClientSession() as session:
+            refresh_delays = {}
+            for protocol in self.protocols:
+                registry = self.registries[protocol.name]
+                from_snapshot = await registry.load(session)
+                refresh_delays[protocol.name] = 0 if from_snapshot else registry.refresh_interval
+                self.add_routes(protocol, registry.pairs.keys())
+                if protocol.consumer is not None:
+                    self.consumers[protocol.name] = CONSUMERS[protocol.consumer](
+                        self.get_producer(protocol.consumer_stream), registry.pairs, session, self.rest_endpoint)
+
+            # Pairs of every protocol are spread over the same few connections per provider
+            num_connections = int(get_subscription_config()['num_connections'])
+            race_conf = get_race_config()
+            catch_up = None
+            if self.rest_endpoint:
+                reconnect_conf = get_reconnect_config()
+                catch_up = LogCatchUp(session, self.rest_endpoint, lambda: self.last_block,
+                                      int(reconnect_conf['catch_up_chunk_size']), int(reconnect_conf['max_catch_up_blocks']))
+            self.subscriptions = RacingLogSubscriptions(self.providers, list(self.routes), self.decoder.topics, pool.submit, num_connections,
+                                                        int(race_conf['max_log_keys']), float(race_conf['stats_log_interval']), catch_up)
+            tasks = [asyncio.create_task(self.subscriptions.run()),
+                     asyncio.create_task(pool.run(float(decode_conf['metrics_log_interval']))),
+                     asyncio.create_task(self.checkpoints.run())]
+            tasks.extend(asyncio.create_task(indicators.run()) for indicators in self.indicators.values())
+            tasks.extend(asyncio.create_task(consumer.run()) for consumer in self.consumers.values())
+            refreshers = []
+            for protocol in self.protocols:
+                registry = self.registries[protocol.name]
+                registry.add_listener(self.route_listener(protocol))
+                if protocol.name in self.consumers:
+                    # Pairs a refresh adds are subscribed to before the consumer hears of them
+                    registry.add_listener(self.consumers[protocol.name].update)
+                refreshers.append(asyncio.create_task(registry.refresh_forever(session, refresh_delays[protocol.name])))
+            try:
+                await asyncio.gather(*tasks, *refreshers)
+            finally:
+                for task in tasks + refreshers:
+                    task.cancel()
+                await asyncio.gather(*tasks, *refreshers, return_exceptions=True)
+                await self.close_producers()
+
+    async def close_producers(self):
+        """
+        Writes out what each stream's writer still has queued and finalizes any archive segment
+        """
+        for stream, producer in self.producers.items():
+            try:
+                await producer.close()
+            except Exception:
+                logging.exception("Failed to close the producer of %s", stream)
+
+async def run_protocols(names):
+    conf = dotenv.dotenv_values("./keys/.env")
+    logging.info("Starting event listeners for %s", ", ".join(names))
+    providers = get_providers(get_protocols_config()['ws_endpoints'], conf)
+    await ProtocolRuntime(load_protocols(names), providers, conf.get("INFURA_REST_ENDPOINT")).run()
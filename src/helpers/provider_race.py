@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+import websockets
+from helpers.capture import capture_connection
+from helpers.log_subscription import ShardedLogSubscriptions, SubscriptionError
+from helpers.reconnect import Backoff
+
+# Keys are pulled straight out of the raw frames, so the race never parses a notification
+SUBSCRIPTION_PATTERN = re.compile(r'"subscription"\s*:\s*"(0x[0-9a-fA-F]+)"')
+BLOCK_HASH_PATTERN = re.compile(r'"blockHash"\s*:\s*"(0x[0-9a-fA-F]+)"')
+LOG_INDEX_PATTERN = re.compile(r'"logIndex"\s*:\s*"(0x[0-9a-fA-F]+)"')
+HASH_PATTERN = re.compile(r'"hash"\s*:\s*"(0x[0-9a-fA-F]+)"')
+
+
+def get_providers(names, env):
+    """
+    Maps each of a comma separated list of .env entry names to its endpoint, skipping unset ones
+    """
+    providers = {}
+    for name in names.split(","):
+        name = name.strip()
+        if env.get(name):
+            providers[name] = env[name]
+        elif name:
+            logging.warning("Provider %s has no endpoint set, leaving it out", name)
+    if not providers:
+        raise ValueError(f"none of the providers {names} have an endpoint set")
+    return providers
+
+async def run_providers(runs):
+    """
+    Runs one coroutine per provider, carrying on for as long as any of them is still running
+    """
+    tasks = {asyncio.create_task(run): provider for provider, run in runs.items()}
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                logging.error("Provider %s stopped: %r", tasks[task], task.exception())
+        raise SubscriptionError("every provider has stopped")
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def run_with_stats(race, interval, runs):
+    stats_logger = asyncio.create_task(race.log_stats(interval))
+    try:
+        await run_providers(runs)
+    finally:
+        stats_logger.cancel()
+
+
+class ProviderStats:
+    def __init__(self):
+        self.wins = 0
+        self.late = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    def summary(self, total):
+        avg_lag_ms = self.total_lag / self.late * 10**3 if self.late else 0.0
+        return {
+            "wins": self.wins,
+            "late": self.late,
+            "win_rate": self.wins / total if total else 0.0,
+            "avg_lag_ms": round(avg_lag_ms, 2),
+            "max_lag_ms": round(self.max_lag * 10**3, 2),
+        }
+
+
+class ProviderRace:
+    """
+    Forwards whichever copy of a header or log arrives first, across several providers.
+
+    The keys already forwarded are remembered in a set bounded to max_keys, oldest out
+    first, along with when they arrived, so each later copy counts towards how far its
+    provider lags behind the winner.
+    """
+    def __init__(self, providers, forward, max_keys=100000):
+        self.forward = forward
+        self.max_keys = max_keys
+        self.seen = OrderedDict()
+        self.stats = {provider: ProviderStats() for provider in providers}
+        self.num_forwarded = 0
+
+    async def arrive(self, provider, key, *payload):
+        now = time.monotonic()
+        first_seen = self.seen.get(key)
+        stats = self.stats[provider]
+        if first_seen is not None:
+            lag = now - first_seen
+            stats.late += 1
+            stats.total_lag += lag
+            if lag > stats.max_lag:
+                stats.max_lag = lag
+            return
+        self.seen[key] = now
+        if len(self.seen) > self.max_keys:
+            self.seen.popitem(last=False)
+        stats.wins += 1
+        self.num_forwarded += 1
+        await self.forward(*payload)
+
+    def metrics(self):
+        return {provider: stats.summary(self.num_forwarded) for provider, stats in self.stats.items()}
+
+    async def log_stats(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            logging.info("Provider race: %s", self.metrics())
+
+
+class RacingLogSubscriptions:
+    """
+    The same sharded logs subscriptions on every provider, with notifications raced
+    on (blockHash, logIndex). Stands in for a ShardedLogSubscriptions. Logs caught up
+    on after a reconnect go through the race too, so ones already seen are dropped.
+    """
+    def __init__(self, providers, addresses, topics, on_notification, num_connections, max_keys=100000, stats_log_interval=60, catch_up=None):
+        self.race = ProviderRace(providers, on_notification, max_keys)
+        self.stats_log_interval = stats_log_interval
+        addresses = list(addresses)
+        self.subscriptions = {provider: ShardedLogSubscriptions(ws_endpoint, addresses, topics, self.notification_handler(provider), num_connections, catch_up)
+                              for provider, ws_endpoint in providers.items()}
+
+    def notification_handler(self, provider):
+        async def on_notification(frame, subscription_id):
+            # Stale copies are dropped before they can win, as the decode step would drop them anyway
+            match = SUBSCRIPTION_PATTERN.search(frame)
+            if match is None or match.group(1) != subscription_id:
+                return
+            block_hash = BLOCK_HASH_PATTERN.search(frame)
+            log_index = LOG_INDEX_PATTERN.search(frame)
+            if block_hash is None or log_index is None:
+                logging.warning("Notification from %s without blockHash or logIndex: %s", provider, frame)
+                return
+            key = (block_hash.group(1).lower(), int(log_index.group(1), 16))
+            await self.race.arrive(provider, key, frame, subscription_id)
+        return on_notification
+
+    async def run(self):
+        await run_with_stats(self.race, self.stats_log_interval,
+                             {provider: subscriptions.run() for provider, subscriptions in self.subscriptions.items()})
+
+    async def update(self, added, removed):
+        await asyncio.gather(*[subscriptions.update(added, removed) for subscriptions in self.subscriptions.values()])
+
+
+class RacingHeads:
+    """
+    newHeads subscriptions on every provider, merged into one stream of headers deduplicated
+    by block hash. Has the recv of a websocket, so BlockPipeline can read from it.
+    """
+    def __init__(self, providers, max_keys=10000, queue_size=64):
+        self.providers = providers
+        self.headers = asyncio.Queue(queue_size)
+        self.race = ProviderRace(providers, self.headers.put, max_keys)
+
+    async def recv(self):
+        return await self.headers.get()
+
+    async def follow(self, provider, ws_endpoint):
+        """
+        Keeps a newHeads subscription up on one provider, reconnecting after a jittered backoff.
+        Headers missed while down are left for the pipeline to fill in as a gap.
+        """
+        backoff = Backoff()
+        while True:
+            try:
+                async with websockets.connect(ws_endpoint) as ws:
+                    with capture_connection(ws, f"heads-{provider}") as ws:
+                        await ws.send(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["newHeads"]}))
+                        await ws.recv()
+                        logging.info("Subscribed to newHeads on %s", provider)
+                        backoff.reset()
+                        async for frame in ws:
+                            block_hash = HASH_PATTERN.search(frame)
+                            if block_hash is None:
+                                logging.warning("Header from %s without a hash: %s", provider, frame)
+                                continue
+                            await self.race.arrive(provider, block_hash.group(1).lower(), frame)
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                logging.warning("newHeads subscription on %s dropped: %r", provider, e)
+            await asyncio.sleep(backoff.next_delay())
+
+    async def run(self, stats_log_interval=60):
+        await run_with_stats(self.race, stats_log_interval,
+                             {provider: self.follow(provider, ws_endpoint) for provider, ws_endpoint in self.providers.items()})
@@ -15,6 +15,128 @@ def get_kafka_config():
     config.read(config_path)
     return dict(config['PRODUCER'])
 
+def get_kafka_settings():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['KAFKA'])
+
+def get_ethereum_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['ETHEREUM'])
+
+def get_enabled_chains():
+    config = ConfigParser()
+    config.read(config_path)
+    return [name.strip() for name in config['CHAINS']['enabled'].split(',') if name.strip()]
+
+def get_chain_config(chain):
+    """
+    Settings of a chain's section, falling back to [ETHEREUM] for anything it leaves out
+    """
+    config = ConfigParser()
+    config.read(config_path)
+    return {
+            **config['ETHEREUM'],
+            **config[chain.upper()]
+        }
+
+def get_protocols_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['PROTOCOLS'])
+
+def get_enabled_protocols():
+    return [name.strip() for name in get_protocols_config()['enabled'].split(',') if name.strip()]
+
+def get_race_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['RACE'])
+
+def get_reconnect_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['RECONNECT'])
+
+def get_checkpoints_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['CHECKPOINTS'])
+
+def get_backfill_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['BACKFILL'])
+
+def get_archive_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['ARCHIVE'])
+
+def get_archived_streams():
+    return [stream.strip() for stream in get_archive_config()['streams'].split(',') if stream.strip()]
+
+def get_metrics_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['METRICS'])
+
+def get_capture_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['CAPTURE'])
+
+def get_spool_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['SPOOL'])
+
+def get_fanout_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['FANOUT'])
+
+def get_frames_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['FRAMES'])
+
+def get_subscription_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['SUBSCRIPTIONS'])
+
+def get_decode_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['DECODE'])
+
+def get_indicators_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['INDICATORS'])
+
+def get_v3_indicators_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['V3_INDICATORS'])
+
+def get_v3_pool_state_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['V3_POOL_STATE'])
+
+def get_pairs_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['PAIRS'])
+
+def get_redis_consumer_config():
+    config = ConfigParser()
+    config.read(config_path)
+    return dict(config['REDIS_CONSUMER'])
+
 def get_redis_config():
     config = ConfigParser()
     config.read(config_path)
@@ -0,0 +1,79 @@
+import asyncio
+import aiohttp
+import logging
+import random
+
+class Backoff:
+    """
+    Exponential backoff with full jitter, so reconnecting collectors don't all retry in step
+    """
+    def __init__(self, initial=1, maximum=60):
+        self.initial = initial
+        self.maximum = maximum
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = random.uniform(0, min(self.maximum, self.initial * 2 ** self.attempt))
+        self.attempt += 1
+        return delay
+
+    def reset(self):
+        self.attempt = 0
+
+
+class CatchUpError(Exception):
+    pass
+
+async def rpc_request(session, endpoint, method, params):
+    async with session.post(endpoint, json={"jsonrpc": "2.0", "id": 1, "method": method, "params": params}) as res:
+        response = await res.json()
+    if "error" in response:
+        raise CatchUpError(f"{method} failed: {response['error']}")
+    return response["result"]
+
+async def get_logs(session, endpoint, addresses, topics, from_block, to_block):
+    log_filter = {"address": addresses, "topics": [topics], "fromBlock": hex(from_block), "toBlock": hex(to_block)}
+    return await rpc_request(session, endpoint, "eth_getLogs", [log_filter])
+
+
+class LogCatchUp:
+    """
+    Fetches the logs a subscription missed while it was down, through eth_getLogs.
+
+    Ranges are walked from the resume block up to the head in chunks of chunk_size
+    blocks, and a chunk the node refuses, usually for returning too many logs, is
+    split in half until it goes through. At most max_blocks behind the head are
+    fetched. resume_block is called for the block to resume from when a connection
+    drops.
+    """
+    def __init__(self, session, endpoint, resume_block, chunk_size=500, max_blocks=10000):
+        self.session = session
+        self.endpoint = endpoint
+        self.resume_block = resume_block
+        self.chunk_size = chunk_size
+        self.max_blocks = max_blocks
+
+    async def fetch_range(self, addresses, topics, from_block, to_block):
+        try:
+            return await get_logs(self.session, self.endpoint, addresses, topics, from_block, to_block)
+        except CatchUpError:
+            if from_block == to_block:
+                raise
+            middle = (from_block + to_block) // 2
+            return (await self.fetch_range(addresses, topics, from_block, middle) +
+                    await self.fetch_range(addresses, topics, middle + 1, to_block))
+
+    async def fetch(self, addresses, topics, from_block):
+        """
+        Yields the logs of addresses from from_block up to the current head, oldest first
+        """
+        head = int(await rpc_request(self.session, self.endpoint, "eth_blockNumber", []), 16)
+        if head - from_block > self.max_blocks:
+            logging.warning("Catching up from block %d is too far behind head %d, starting at %d instead",
+                            from_block, head, head - self.max_blocks)
+            from_block = head - self.max_blocks
+        logging.info("Catching up %d addresses from block %d to %d", len(addresses), from_block, head)
+        for start in range(from_block, head + 1, self.chunk_size):
+            for log in await self.fetch_range(addresses, topics, start, min(start + self.chunk_size - 1, head)):
+                if not log.get("removed"):
+                    yield log
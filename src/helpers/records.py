@@ -0,0 +1,151 @@
+from helpers.json_backend import get_json_backend
+
+class Record:
+    """
+    A slotted record with the fields of its schema in a fixed order, readable and
+    writable like the dict it stands in for, as record["price"].
+
+    Encoded positionally, a record is a JSON array of its schema's tag then its values
+    in field order, so the tag's version has to go up whenever the fields do change.
+    """
+    __slots__ = ()
+    SCHEMA = None
+    FIELDS = ()
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def __setitem__(self, name, value):
+        if name not in self.FIELDS:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return name in self.FIELDS
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_list() == other.to_list()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.FIELDS)})"
+
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_list(self):
+        return [getattr(self, name) for name in self.FIELDS]
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def to_positional(self):
+        return [self.SCHEMA] + self.to_list()
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**values)
+
+
+class LobEvent(Record):
+    """
+    An order book event, as made by create_lob_event
+    """
+    SCHEMA = "lob_event.v1"
+    FIELDS = ("quote_no", "event_no", "order_id", "original_order_id", "side", "price", "size", "lob_action",
+              "event_timestamp", "send_timestamp", "receive_timestamp", "order_type", "is_implied", "order_executed",
+              "execution_price", "executed_size", "aggressor_side", "matching_order_id", "old_order_id", "trade_id",
+              "size_ahead", "orders_ahead")
+    __slots__ = FIELDS
+
+    def __init__(self, quote_no=-1, event_no=-1, order_id=-1, original_order_id=-1, side=-1, price=-1, size=-1,
+                 lob_action=0, event_timestamp=-1, send_timestamp=-1, receive_timestamp=-1, order_type=0,
+                 is_implied=-1, order_executed=0, execution_price=-1, executed_size=-1, aggressor_side=-1,
+                 matching_order_id=-1, old_order_id=-1, trade_id=-1, size_ahead=-1, orders_ahead=-1):
+        self.quote_no = quote_no
+        self.event_no = event_no
+        self.order_id = order_id
+        self.original_order_id = original_order_id
+        self.side = side
+        self.price = price
+        self.size = size
+        self.lob_action = lob_action
+        self.event_timestamp = event_timestamp
+        self.send_timestamp = send_timestamp
+        self.receive_timestamp = receive_timestamp
+        self.order_type = order_type
+        self.is_implied = is_implied
+        self.order_executed = order_executed
+        self.execution_price = execution_price
+        self.executed_size = executed_size
+        self.aggressor_side = aggressor_side
+        self.matching_order_id = matching_order_id
+        self.old_order_id = old_order_id
+        self.trade_id = trade_id
+        self.size_ahead = size_ahead
+        self.orders_ahead = orders_ahead
+
+
+class MarketOrder(Record):
+    """
+    A trade, as made by create_market_order
+    """
+    SCHEMA = "market_order.v1"
+    FIELDS = ("order_id", "price", "trade_id", "timestamp", "side", "size", "msg_original_type")
+    __slots__ = FIELDS
+
+    def __init__(self, order_id=-1, price=-1, trade_id="", timestamp=-1, side=-1, size=-1, msg_original_type=""):
+        self.order_id = order_id
+        self.price = price
+        self.trade_id = trade_id
+        self.timestamp = timestamp
+        self.side = side
+        self.size = size
+        self.msg_original_type = msg_original_type
+
+# Schema tag to its record type
+SCHEMAS = {record_type.SCHEMA: record_type for record_type in (LobEvent, MarketOrder)}
+
+def plain(msg):
+    """
+    msg, or the dict a record stands in for
+    """
+    return msg.to_dict() if isinstance(msg, Record) else msg
+
+def decode_positional(values):
+    """
+    The record a positionally encoded array holds
+    """
+    record_type = SCHEMAS.get(values[0]) if values and isinstance(values[0], str) else None
+    if record_type is None:
+        raise ValueError(f"not a positionally encoded record of a known schema: {values[:1]}")
+    if len(values) != len(record_type.FIELDS) + 1:
+        raise ValueError(f"{values[0]} has {len(record_type.FIELDS)} fields, not {len(values) - 1}")
+    return record_type(*values[1:])
+
+def decode_message(value):
+    """
+    A decoded message, with any positionally encoded record turned back into its record
+    """
+    if isinstance(value, list) and value and isinstance(value[0], str) and value[0] in SCHEMAS:
+        return decode_positional(value)
+    return value
+
+def create_encoder(positional=False, dumps=None):
+    """
+    A function encoding messages to JSON bytes, records positionally when positional is
+    set and with their field names, as the dicts they replace, otherwise
+    """
+    dumps = dumps or get_json_backend()[1]
+
+    def encode(msg):
+        if isinstance(msg, Record):
+            msg = msg.to_positional() if positional else msg.to_dict()
+        return dumps(msg)
+
+    return encode
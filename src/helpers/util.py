@@ -1,17 +1,4 @@
-from gzip import decompress
-import json
-
-
-async def preprocess(msg, *args):
-    try:
-        json.loads(msg)
-    except (TypeError, UnicodeDecodeError) as e:
-        # Huobi is annoying with the way they pingpong
-        msg = decompress(msg)
-        msg_dict = json.loads(msg)
-        if 'ping' in msg_dict:
-            await args[0].send(json.dumps({'pong': msg_dict['ping']}))
-    return json.loads(msg)
+from helpers.records import LobEvent, MarketOrder
 
 def create_lob_event(quote_no=-1,
                     event_no=-1,
@@ -35,30 +22,12 @@ def create_lob_event(quote_no=-1,
                     trade_id=-1,
                     size_ahead=-1,
                     orders_ahead=-1):
-    return {
-        "quote_no": quote_no,
-        "event_no": event_no,
-        "order_id": order_id,
-        "original_order_id": original_order_id,
-        "side": side,
-        "price": price,
-        "size": size,
-        "lob_action": lob_action,
-        "event_timestamp": event_timestamp,
-        "send_timestamp": send_timestamp,
-        "receive_timestamp": receive_timestamp,
-        "order_type": order_type,
-        "is_implied": is_implied,
-        "order_executed": order_executed,
-        "execution_price": execution_price,
-        "executed_size": executed_size,
-        "aggressor_side": aggressor_side,
-        "matching_order_id": matching_order_id,
-        "old_order_id": old_order_id,
-        "trade_id": trade_id,
-        "size_ahead": size_ahead,
-        "orders_ahead": orders_ahead
-    }
+    """
+    An order book event, as a slotted LobEvent rather than a dict of 22 keys
+    """
+    return LobEvent(quote_no, event_no, order_id, original_order_id, side, price, size, lob_action, event_timestamp,
+                    send_timestamp, receive_timestamp, order_type, is_implied, order_executed, execution_price,
+                    executed_size, aggressor_side, matching_order_id, old_order_id, trade_id, size_ahead, orders_ahead)
 
 def create_market_order(order_id=-1,
                         price=-1,
@@ -67,12 +36,7 @@ def create_market_order(order_id=-1,
                         side=-1,
                         size=-1,
                         msg_original_type=""):
-    return {
-        "order_id": order_id,
-        "price": price,
-        "trade_id": trade_id,
-        "timestamp": timestamp,
-        "side": side,
-        "size": size,
-        "msg_original_type": msg_original_type
-    }
\ No newline at end of file
+    """
+    A trade, as a slotted MarketOrder
+    """
+    return MarketOrder(order_id, price, trade_id, timestamp, side, size, msg_original_type)
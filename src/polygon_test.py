@@ -1,6 +1,12 @@
+import asyncio
 import dotenv
+from ethereum import collect_chains
+from sink_connector.redis_producer import RedisProducer
 
+# Follows Polygon alone, as configured in its [POLYGON] section
 async def main():
     conf = dotenv.dotenv_values("./keys/.env")
-    rest_endpont = conf["INFURA_POLYGON_REST_ENDPOINT"]
-    
\ No newline at end of file
+    await collect_chains(["polygon"], conf, RedisProducer("polygon-raw"))
+
+if __name__ == "__main__":
+    asyncio.run(main())
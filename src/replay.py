@@ -0,0 +1,48 @@
+"""
+Serves websocket sessions captured with [CAPTURE] enabled from a local stand-in, so
+the unchanged collectors can be run against real traffic shapes, as fast as they came
+in or faster.
+
+Run from src/ with, for example:
+    python replay.py captures/ --speed 10 --port 8765
+
+then point the collector at it, with REPLAY_WS_ENDPOINT=ws://127.0.0.1:8765 in
+keys/.env and ws_endpoints = REPLAY_WS_ENDPOINT in its config.ini section. Each
+connection the collector opens is served the next captured connection in turn.
+"""
+import argparse
+import asyncio
+import logging
+from helpers.capture import ReplayServer, find_connections
+
+logging.basicConfig(level=logging.INFO)
+
+def parse_speed(value):
+    return None if value == "max" else float(value)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plays captured websocket sessions back from a local stand-in")
+    parser.add_argument("captures", nargs="+", help="capture files, or directories of them")
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help="1 for as captured, N for N times faster, or max")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    return parser.parse_args()
+
+async def serve(args):
+    connections = find_connections(args.captures)
+    if not connections:
+        raise SystemExit(f"No captures found in {', '.join(args.captures)}")
+    server = ReplayServer(connections, args.speed)
+    endpoint = await server.start(args.host, args.port)
+    logging.info("Replaying %d captured connections at %s speed on %s", len(connections),
+                 f"{args.speed:g}x" if args.speed else "max", endpoint)
+    try:
+        await asyncio.Future()
+    finally:
+        await server.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        print("\nExiting by user request.\n")
@@ -0,0 +1,309 @@
+from helpers.file_lock import lock_file
+from helpers.metrics import message_counters, queue_depth_gauge
+from helpers.read_config import get_archive_config
+from helpers.records import decode_message, plain
+from sink_connector.columnar import MAGIC, encode_chunk, flatten, load_index, stream_directory
+import asyncio
+import json
+import logging
+import os
+import time
+
+# Where a record's block number is, for decoded logs and for transaction and block records
+BLOCK_FIELDS = ("blockNumber", "block_data.block_num", "block_num")
+
+def block_number(row):
+    for field in BLOCK_FIELDS:
+        value = row.get(field)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+class Segment:
+    """
+    A segment file being written. It is only given its final name, after the blocks it
+    holds, once closed, so anything still being written is never picked up by readers.
+    """
+    def __init__(self, base, partition_directory, compression, level):
+        self.base = base
+        self.directory = os.path.join(base, partition_directory)
+        self.compression = compression
+        self.level = level
+        os.makedirs(self.directory, exist_ok=True)
+        self.created = time.time()
+        self.tmp_path = os.path.join(self.directory, f"{int(self.created * 1000)}.seg.tmp")
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(MAGIC)
+        self.first_block = None
+        self.last_block = None
+        self.rows = 0
+        self.chunks = 0
+
+    def write_chunk(self, rows, first_block, last_block):
+        self.file.write(encode_chunk(rows, first_block, last_block, self.compression, self.level))
+        if first_block is not None:
+            self.first_block = first_block if self.first_block is None else min(self.first_block, first_block)
+            self.last_block = last_block if self.last_block is None else max(self.last_block, last_block)
+        self.rows += len(rows)
+        self.chunks += 1
+
+    def close(self):
+        """
+        Syncs the file, moves it to its final name and returns its index entry
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        size = self.file.tell()
+        self.file.close()
+        name = f"{self.first_block}-{self.last_block}-{int(self.created * 1000)}.seg"
+        path = os.path.join(self.directory, name)
+        os.replace(self.tmp_path, path)
+        return {
+            "path": os.path.relpath(path, self.base),
+            "first_block": self.first_block,
+            "last_block": self.last_block,
+            "rows": self.rows,
+            "chunks": self.chunks,
+            "bytes": size
+        }
+
+
+class StreamArchive:
+    """
+    The rows of one chain and stream waiting to be written, and the segment they go to
+    """
+    def __init__(self, directory, chain, stream, conf):
+        self.base = stream_directory(directory, chain, stream)
+        self.index_path = os.path.join(self.base, "index.json")
+        self.chunk_rows = int(conf["chunk_rows"])
+        self.segment_rows = int(conf["segment_rows"])
+        self.segment_max_age = float(conf["segment_max_age"])
+        self.blocks_per_partition = int(conf["blocks_per_partition"])
+        self.compression = conf["compression"]
+        self.level = int(conf["compression_level"])
+        self.rows = []
+        self.first_block = None
+        self.last_block = None
+        # Block range of the buffered rows, and of the open segment
+        self.rows_partition = None
+        self.partition = None
+        self.segment = None
+
+    def partition_directory(self, partition):
+        if partition is None:
+            return "blocks=unknown"
+        start = partition * self.blocks_per_partition
+        return f"blocks={start}-{start + self.blocks_per_partition - 1}"
+
+    def partition_of(self, block):
+        return None if block is None else block // self.blocks_per_partition
+
+    def starts_partition(self, block):
+        """
+        Whether a row of block belongs to another block range than the rows before it,
+        in which case those have to be written out before it is appended
+        """
+        partition = self.partition_of(block)
+        current = self.rows_partition if self.rows_partition is not None else self.partition
+        return partition is not None and current is not None and partition != current
+
+    def append(self, row, block):
+        """
+        Buffers a row, returning whether a chunk's worth of rows is now buffered
+        """
+        if block is not None:
+            if self.rows_partition is None:
+                self.rows_partition = self.partition_of(block)
+            self.first_block = block if self.first_block is None else min(self.first_block, block)
+            self.last_block = block if self.last_block is None else max(self.last_block, block)
+        self.rows.append(row)
+        return len(self.rows) >= self.chunk_rows
+
+    def write(self):
+        """
+        Writes the buffered rows as a chunk, rolling over to a new segment first when the
+        block range changes or the segment is full or too old. Runs off the event loop.
+        """
+        rows, first_block, last_block = self.rows, self.first_block, self.last_block
+        # Rows without a block number stay with the block range of the rows around them
+        partition = self.rows_partition if self.rows_partition is not None else self.partition
+        self.rows, self.first_block, self.last_block, self.rows_partition = [], None, None, None
+        if self.segment is not None and (partition != self.partition or self.segment.rows >= self.segment_rows or self.is_stale()):
+            self.add_to_index(self.segment.close())
+            self.segment = None
+        if rows:
+            if self.segment is None:
+                self.partition = partition
+                self.segment = Segment(self.base, self.partition_directory(partition), self.compression, self.level)
+            self.segment.write_chunk(rows, first_block, last_block)
+
+    def close(self):
+        if self.rows:
+            self.write()
+        if self.segment is not None:
+            self.add_to_index(self.segment.close())
+            self.segment = None
+
+    def is_stale(self):
+        """
+        Whether the open segment has outlived segment_max_age, so a quiet stream still gets its data closed
+        """
+        return self.segment is not None and time.time() - self.segment.created >= self.segment_max_age
+
+    def add_to_index(self, entry):
+        # A backfill and the live archiver can both be adding to one stream's index
+        os.makedirs(self.base, exist_ok=True)
+        with open(self.index_path + ".lock", "a+b") as lock:
+            lock_file(lock)
+            index = load_index(self.index_path)
+            index["segments"].append(entry)
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+
+class ArchiveProducer:
+    """
+    Archives records to rolling columnar segment files on local disk.
+
+    Records are buffered per stream and written chunk_rows at a time as one compressed,
+    typed chunk per column. Segments are partitioned by chain, stream and block range:
+
+        directory/chain/stream/blocks=15000000-15099999/15000000-15000420-<created>.seg
+
+    and a segment is closed once it holds segment_rows rows, is segment_max_age
+    seconds old or the records move on to the next block range. Every closed segment
+    is added to the stream's index.json with the blocks it holds. A segment open when
+    the process dies is left behind as a .tmp file and never indexed.
+
+    Has produce, produce_to, produce_batch, start_writer and close like RedisProducer, so it can take
+    its place or run next to it in a TeeProducer. Nothing acknowledges a write, so the
+    created time messages come with goes unused.
+    """
+    def __init__(self, topic, chain=None):
+        self.topic = topic
+        self.conf = get_archive_config()
+        self.chain = chain or self.conf["chain"]
+        self.directory = self.conf["directory"]
+        self.queue_size = int(self.conf["queue_size"])
+        # Often enough to close a quiet stream's segment within a tenth of its max age
+        self.age_check_interval = max(1.0, float(self.conf["segment_max_age"]) / 10)
+        self.archives = {}
+        self.queue = None
+        self.writer_task = None
+        self.stream_metrics = {}
+
+    def get_archive(self, stream):
+        if stream not in self.archives:
+            self.archives[stream] = StreamArchive(self.directory, self.chain, stream, self.conf)
+        return self.archives[stream]
+
+    def start_writer(self):
+        """
+        Starts a background task that buffers rows and leaves encoding, compressing and
+        writing chunks to the default executor, off the event loop
+        """
+        if self.writer_task is None:
+            self.queue = asyncio.Queue(self.queue_size)
+            queue_depth_gauge("archive-writer", f"{self.chain}/{self.topic}", self.queue.qsize)
+            self.writer_task = asyncio.create_task(self.write_rows())
+
+    async def write_rows(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                entry = await asyncio.wait_for(self.queue.get(), self.age_check_interval)
+            except asyncio.TimeoutError:
+                entry = ()
+            # None is only ever queued by close
+            if entry is None:
+                break
+            if entry:
+                stream, row = entry
+                archive = self.get_archive(stream)
+                block = block_number(row)
+                if archive.starts_partition(block):
+                    await loop.run_in_executor(None, archive.write)
+                if archive.append(row, block):
+                    await loop.run_in_executor(None, archive.write)
+            for archive in self.archives.values():
+                if archive.is_stale():
+                    await loop.run_in_executor(None, archive.write)
+        for archive in self.archives.values():
+            await loop.run_in_executor(None, archive.close)
+
+    async def produce(self, key, msg, created=None):
+        return await self.produce_to(self.topic, key, msg, created)
+
+    async def produce_to(self, stream, key, msg, created=None):
+        if stream not in self.stream_metrics:
+            self.stream_metrics[stream] = message_counters("archive", stream)
+        messages, num_bytes = self.stream_metrics[stream]
+        messages.inc()
+        if isinstance(msg, (str, bytes)):
+            num_bytes.inc(len(msg))
+            # Records encoded positionally are archived under their field names all the same
+            msg = decode_message(json.loads(msg))
+        row = flatten(plain(msg))
+        if self.writer_task is not None:
+            await self.queue.put((stream, row))
+            return 1
+        archive = self.get_archive(stream)
+        block = block_number(row)
+        if archive.starts_partition(block):
+            archive.write()
+        if archive.append(row, block):
+            archive.write()
+        return 1
+
+    async def produce_batch(self, stream, entries):
+        for key, msg, created in entries:
+            await self.produce_to(stream, key, msg, created)
+        return len(entries)
+
+    async def close(self):
+        """
+        Writes out everything buffered, closes every open segment and stops the writer
+        """
+        if self.writer_task is not None:
+            await self.queue.put(None)
+            await self.writer_task
+            self.writer_task = None
+            self.queue = None
+        else:
+            for archive in self.archives.values():
+                archive.close()
+        logging.info("Closed archive segments of %s", ", ".join(self.archives) or "no streams")
+
+
+class TeeProducer:
+    """
+    Produces every message to each of several producers, in turn
+    """
+    def __init__(self, producers):
+        self.producers = producers
+
+    def start_writer(self):
+        for producer in self.producers:
+            producer.start_writer()
+
+    async def produce(self, key, msg, created=None):
+        for producer in self.producers:
+            await producer.produce(key, msg, created)
+        return 1
+
+    async def produce_to(self, stream, key, msg, created=None):
+        for producer in self.producers:
+            await producer.produce_to(stream, key, msg, created)
+        return 1
+
+    async def produce_batch(self, stream, entries):
+        for producer in self.producers:
+            await producer.produce_batch(stream, entries)
+        return len(entries)
+
+    async def close(self):
+        for producer in self.producers:
+            await producer.close()
@@ -0,0 +1,248 @@
+"""
+The columnar segment format archived records are written in, and how to read it back.
+
+A segment file is MAGIC followed by chunks. Each chunk is CHUNK_MAGIC, the length of
+its header, a JSON header, then one compressed blob per column in header order, so a
+reader can skip the columns it doesn't want. Records are flattened into columns by
+dotted path, and every column of a chunk is typed:
+
+    int64    little endian signed 64 bit integers
+    bigint   integers that don't fit in 64 bits, as decimal strings
+    float64  little endian doubles
+    bool     one byte per value
+    hex      0x prefixed lowercase hex strings, as raw bytes
+    str      utf-8 strings
+    json     anything else, lists or mixed types, as JSON strings
+
+Strings, hex and json columns are lengths as uint32 followed by the bytes. Where a
+column isn't set in every record, the blob starts with one state byte per record,
+MISSING, PRESENT or NULL, and only present values follow.
+"""
+import json
+import lzma
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"OMSEG1\n"
+CHUNK_MAGIC = b"CHNK"
+HEADER_LENGTH = struct.Struct("<I")
+
+MISSING, PRESENT, NULL = 0, 1, 2
+
+# Stands in for a column a row doesn't have, as None is a value of its own
+ABSENT = object()
+
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+HEX_PATTERN = re.compile(r"0x(?:[0-9a-f]{2})*\Z")
+
+CODECS = {
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+    "none": (lambda data, level: data, lambda data: data),
+}
+
+
+def flatten(record, prefix="", columns=None):
+    """
+    Flattens nested dicts into a dict keyed by dotted path, leaving lists as values
+    """
+    if columns is None:
+        columns = {}
+    for key, value in record.items():
+        if isinstance(value, dict) and value:
+            flatten(value, prefix + key + ".", columns)
+        else:
+            columns[prefix + key] = value
+    return columns
+
+def unflatten(columns):
+    record = {}
+    for path, value in columns.items():
+        *parents, key = path.split(".")
+        node = record
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    return record
+
+def column_type(values):
+    types = {type(value) for value in values}
+    if types == {bool}:
+        return "bool"
+    if types == {int}:
+        return "int64" if INT64_MIN <= min(values) and max(values) <= INT64_MAX else "bigint"
+    if types == {float}:
+        return "float64"
+    if types == {str}:
+        return "hex" if all(HEX_PATTERN.match(value) for value in values) else "str"
+    return "json"
+
+def little_endian(values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+def encode_strings(strings):
+    lengths = array("I", [len(string) for string in strings])
+    return little_endian(lengths) + b"".join(strings)
+
+def encode_values(kind, values):
+    if kind == "int64":
+        return little_endian(array("q", values))
+    if kind == "float64":
+        return little_endian(array("d", values))
+    if kind == "bool":
+        return bytes(values)
+    if kind == "hex":
+        return encode_strings([bytes.fromhex(value[2:]) for value in values])
+    if kind == "bigint":
+        return encode_strings([str(value).encode() for value in values])
+    if kind == "str":
+        return encode_strings([value.encode() for value in values])
+    return encode_strings([json.dumps(value).encode() for value in values])
+
+def decode_strings(data, count):
+    lengths = array("I")
+    lengths.frombytes(data[:4 * count])
+    if sys.byteorder != "little":
+        lengths.byteswap()
+    strings = []
+    offset = 4 * count
+    for length in lengths:
+        strings.append(data[offset:offset + length])
+        offset += length
+    return strings
+
+def decode_values(kind, data, count):
+    if kind in ("int64", "float64"):
+        values = array("q" if kind == "int64" else "d")
+        values.frombytes(data)
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values.tolist()
+    if kind == "bool":
+        return [bool(value) for value in data]
+    strings = decode_strings(data, count)
+    if kind == "hex":
+        return ["0x" + value.hex() for value in strings]
+    if kind == "bigint":
+        return [int(value) for value in strings]
+    if kind == "str":
+        return [value.decode() for value in strings]
+    return [json.loads(value) for value in strings]
+
+def encode_chunk(rows, first_block, last_block, compression="zlib", level=6):
+    """
+    Encodes flattened rows into one chunk, each column typed by the values it holds
+    """
+    compress = CODECS[compression][0]
+    names = {}
+    for row in rows:
+        for name in row:
+            names.setdefault(name, None)
+    columns = []
+    blobs = []
+    for name in names:
+        states = bytearray(len(rows))
+        values = []
+        for i, row in enumerate(rows):
+            value = row.get(name, ABSENT)
+            if value is ABSENT:
+                continue
+            if value is None:
+                states[i] = NULL
+            else:
+                states[i] = PRESENT
+                values.append(value)
+        kind = column_type(values) if values else "json"
+        dense = states.count(PRESENT) == len(rows)
+        blob = compress((b"" if dense else bytes(states)) + encode_values(kind, values), level)
+        columns.append({"name": name, "type": kind, "dense": dense, "length": len(blob)})
+        blobs.append(blob)
+    header = json.dumps({"rows": len(rows), "first_block": first_block, "last_block": last_block,
+                         "compression": compression, "columns": columns}).encode()
+    return CHUNK_MAGIC + HEADER_LENGTH.pack(len(header)) + header + b"".join(blobs)
+
+def read_chunks(f):
+    """
+    Yields the header of each chunk of an open segment file, leaving the file at its first column
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{f.name} is not a segment file")
+    while True:
+        magic = f.read(len(CHUNK_MAGIC))
+        if not magic:
+            return
+        if magic != CHUNK_MAGIC:
+            raise ValueError(f"{f.name} has a corrupt chunk at offset {f.tell() - len(magic)}")
+        header_length, = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))
+        header = json.loads(f.read(header_length))
+        start = f.tell()
+        yield header
+        f.seek(start + sum(column["length"] for column in header["columns"]))
+
+def wanted(name, columns):
+    return columns is None or any(name == column or name.startswith(column + ".") for column in columns)
+
+def read_segment(path, columns=None):
+    """
+    Yields the records of a segment file in the order they were written. With columns,
+    only those dotted paths, and anything nested under them, are read.
+    """
+    with open(path, "rb") as f:
+        for header in read_chunks(f):
+            decompress = CODECS[header["compression"]][1]
+            count = header["rows"]
+            rows = [{} for _ in range(count)]
+            for column in header["columns"]:
+                if not wanted(column["name"], columns):
+                    f.seek(column["length"], os.SEEK_CUR)
+                    continue
+                data = decompress(f.read(column["length"]))
+                if column["dense"]:
+                    states = None
+                    num_values = count
+                else:
+                    states, data = data[:count], data[count:]
+                    num_values = states.count(PRESENT)
+                values = iter(decode_values(column["type"], data, num_values))
+                name = column["name"]
+                for i, row in enumerate(rows):
+                    state = PRESENT if states is None else states[i]
+                    if state == PRESENT:
+                        row[name] = next(values)
+                    elif state == NULL:
+                        row[name] = None
+            for row in rows:
+                yield unflatten(row)
+
+def stream_directory(directory, chain, stream):
+    return os.path.join(directory, chain, stream)
+
+def load_index(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"segments": []}
+
+def find_segments(directory, chain, stream, from_block=None, to_block=None):
+    """
+    Returns the paths of a stream's segments holding blocks from from_block to to_block, oldest first
+    """
+    base = stream_directory(directory, chain, stream)
+    segments = load_index(os.path.join(base, "index.json"))["segments"]
+    paths = []
+    for segment in sorted(segments, key=lambda segment: segment["first_block"] or 0):
+        # Segments of records without block numbers are never left out
+        if segment["first_block"] is not None:
+            if to_block is not None and segment["first_block"] > to_block:
+                continue
+            if from_block is not None and segment["last_block"] < from_block:
+                continue
+        paths.append(os.path.join(base, segment["path"]))
+    return paths
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from helpers.capture import capture_connection
+from helpers.enrich_data import enrich_lob_events, enrich_market_orders, enrich_raw
+from helpers.frames import create_frame_decoder
+from helpers.metrics import REGISTRY, decode_latency_histogram, queue_depth_gauge
+from helpers.read_config import get_archived_streams, get_fanout_config
+from helpers.records import create_encoder
+from sink_connector.archive_producer import ArchiveProducer
+from sink_connector.spool import create_spool
+
+KINDS = ("raw", "normalised", "trades")
+OVERFLOW_POLICIES = ("block", "drop-oldest", "spill")
+
+class SinkQueue:
+    """
+    A bounded queue of (key, msg, created) entries for one sink, and the task handing
+    them to its producer's produce_batch, batch_size at a time, waiting up to
+    flush_interval for a batch to fill.
+
+    When queue_size entries are already waiting, overflow decides what gives: block
+    holds up whoever is putting until there is room, drop-oldest drops the oldest entry
+    and spill appends the new one to a spool on disk. Spilled entries are replayed once
+    the queue is down to half full, after whatever was queued meanwhile, so spilling
+    keeps everything but not the order.
+    """
+    def __init__(self, name, producer, stream, queue_size=10000, batch_size=500, flush_interval=0.005, overflow="block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow of {name} is {overflow}, not one of {', '.join(OVERFLOW_POLICIES)}")
+        self.name = name
+        self.producer = producer
+        self.stream = stream
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.entries = deque()
+        # Made once the loop is running
+        self.has_entries = None
+        self.has_room = None
+        self.task = None
+        self.closing = False
+        self.spool = create_spool(f"fanout-{name}") if overflow == "spill" else None
+        self.replay_task = None
+        self.num_dropped = REGISTRY.counter("collector_fanout_dropped_total", "Messages dropped by a full sink queue", sink=name)
+        self.num_spilled = REGISTRY.counter("collector_fanout_spilled_total", "Messages spilled to disk by a full sink queue", sink=name)
+        queue_depth_gauge("fanout", name, lambda: len(self.entries))
+
+    def start(self):
+        if self.task is None:
+            self.has_entries = asyncio.Event()
+            self.has_room = asyncio.Event()
+            self.closing = False
+            self.producer.start_writer()
+            self.task = asyncio.create_task(self.write_batches())
+            if self.spool is not None:
+                self.replay_task = asyncio.create_task(self.spool.run(self.replay))
+
+    def offer(self, key, msg, created):
+        """
+        Queues an entry, returning False only if the queue is full and its overflow is block
+        """
+        if len(self.entries) >= self.queue_size:
+            if self.overflow == "block":
+                return False
+            if self.overflow == "spill":
+                self.spool.append([(self.stream, key, msg)])
+                self.num_spilled.inc()
+                return True
+            self.entries.popleft()
+            self.num_dropped.inc()
+        self.entries.append((key, msg, created))
+        self.has_entries.set()
+        return True
+
+    async def put(self, key, msg, created):
+        while not self.offer(key, msg, created):
+            self.has_room.clear()
+            await self.has_room.wait()
+
+    async def write_batches(self):
+        while True:
+            if not self.entries:
+                if self.closing:
+                    break
+                self.has_entries.clear()
+                await self.has_entries.wait()
+                continue
+            if len(self.entries) < self.batch_size and not self.closing:
+                await asyncio.sleep(self.flush_interval)
+            batch = [self.entries.popleft() for _ in range(min(self.batch_size, len(self.entries)))]
+            self.has_room.set()
+            try:
+                await self.producer.produce_batch(self.stream, batch)
+            except Exception:
+                # The producers spool what their sink fails to take, so this is a bug rather than an outage
+                logging.exception("Failed to hand %d messages to %s, dropping them", len(batch), self.name)
+                self.num_dropped.inc(len(batch))
+
+    async def replay(self, batch):
+        # Live traffic goes first
+        while len(self.entries) > self.queue_size // 2:
+            self.has_room.clear()
+            await self.has_room.wait()
+        await self.producer.produce_batch(self.stream, [(key, msg, None) for _, key, msg in batch])
+        return True
+
+    async def close(self):
+        """
+        Waits until every queued entry has been handed to the producer, leaving anything spilled on disk for the next run
+        """
+        if self.task is not None:
+            self.closing = True
+            self.has_entries.set()
+            await self.task
+            self.task = None
+            if self.replay_task is not None:
+                self.replay_task.cancel()
+                await asyncio.gather(self.replay_task, return_exceptions=True)
+                self.replay_task = None
+
+
+class FanOut:
+    """
+    Hands every message of a kind, raw, normalised or trades, to each of that kind's sink
+    queues, so that a slow sink only ever holds up its own queue rather than the
+    websocket it is fed from.
+    """
+    def __init__(self, sinks, owned=(), encoders=None):
+        # Kind to its SinkQueues
+        self.sinks = sinks
+        # Producers made for the fan out, closed along with it
+        self.owned = list(owned)
+        # Kind to the function serialising its messages, by default to JSON with records' field names
+        default = create_encoder()
+        self.encoders = {kind: (encoders or {}).get(kind, default) for kind in sinks}
+        self.counts = dict.fromkeys(sinks, 0)
+
+    def start(self):
+        for queues in self.sinks.values():
+            for queue in queues:
+                queue.start()
+
+    async def put(self, kind, key, msg, created=None):
+        """
+        Serialises msg once for every sink of kind, created being when it was received or decoded
+        """
+        if not isinstance(msg, (str, bytes)):
+            msg = self.encoders[kind](msg)
+        if created is None:
+            created = time.time()
+        self.counts[kind] += 1
+        for queue in self.sinks[kind]:
+            if not queue.offer(key, msg, created):
+                await queue.put(key, msg, created)
+
+    async def close(self):
+        for queues in self.sinks.values():
+            for queue in queues:
+                await queue.close()
+        for producer in self.owned:
+            await producer.close()
+
+def create_sink_queue(kind, backend, producer, conf):
+    """
+    A SinkQueue set up as in [FANOUT], where any setting suffixed with _kind, such as
+    overflow_trades, overrides it for that kind
+    """
+    def setting(name):
+        return conf.get(f"{name}_{kind}", conf[name])
+
+    return SinkQueue(f"{backend}-{producer.topic}", producer, producer.topic, int(setting("queue_size")),
+                     int(setting("batch_size")), float(setting("flush_interval")), setting("overflow").strip())
+
+def create_fanout(producers, backend):
+    """
+    A FanOut to each of the raw, normalised and trades producers, named after backend, and
+    to an archive of any of their topics in [ARCHIVE] streams
+    """
+    conf = get_fanout_config()
+    archived = get_archived_streams()
+    sinks = {}
+    owned = []
+    encoders = {}
+    for kind, producer in zip(KINDS, producers):
+        sinks[kind] = [create_sink_queue(kind, backend, producer, conf)]
+        if producer.topic in archived:
+            archive = ArchiveProducer(producer.topic)
+            owned.append(archive)
+            sinks[kind].append(create_sink_queue(kind, "archive", archive, conf))
+        encoding = conf.get(f"record_encoding_{kind}", conf["record_encoding"]).strip()
+        if encoding not in ("json", "positional"):
+            raise ValueError(f"record_encoding of {kind} is {encoding}, not json or positional")
+        encoders[kind] = create_encoder(encoding == "positional")
+    return FanOut(sinks, owned, encoders)
+
+async def fan_out_messages(ws, fanout, normalise, source, decoder=None):
+    """
+    Reads, normalises and fans out every message of an exchange websocket, waiting on the
+    sinks only when one set to block is full. The sinks are drained once the websocket closes.
+    Frames are parsed by decoder, by default the one for the exchange of source, a raw
+    stream named exchange-raw.
+    """
+    decoder = decoder or create_frame_decoder(source.rsplit("-", 1)[0])
+    decode_latency = decode_latency_histogram(source)
+    fanout.start()
+    try:
+        with capture_connection(ws, source) as ws:
+            await read_messages(ws, fanout, normalise, decoder, decode_latency)
+    finally:
+        await fanout.close()
+
+async def read_messages(ws, fanout, normalise, decoder, decode_latency):
+    async for msg in ws:
+        received = time.time()
+        msg_dict = await decoder.decode(msg, ws)
+        if msg_dict is None:
+            continue
+        enriched = enrich_raw(msg_dict)
+        await fanout.put("raw", str(received), enriched, received)
+
+        normalised_data = normalise(enriched)
+        lob_events = normalised_data['lob_events']
+        market_orders = normalised_data['market_orders']
+
+        enrich_lob_events(lob_events)
+        enrich_market_orders(market_orders)
+        decoded = time.time()
+        decode_latency.observe(decoded - received)
+
+        for event in lob_events:
+            await fanout.put("normalised", str(event['quote_no']), event, decoded)
+        for trade in market_orders:
+            await fanout.put("trades", str(trade['order_id']), trade, decoded)
+
+async def monitor_fanout(fanout, interval=600):
+    while True:
+        counts = fanout.counts
+        print(f"Produced (Raw) (Normalised) (Trades): {counts['raw']} {counts['normalised']} {counts['trades']}", flush=True)
+        await asyncio.sleep(interval)
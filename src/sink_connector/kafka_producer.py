@@ -1,32 +1,188 @@
 from confluent_kafka import Producer, KafkaError, KafkaException
-from helpers.read_config import get_kafka_config
+from helpers.metrics import message_counters, queue_depth_gauge, sink_ack_histogram
+from helpers.read_config import get_kafka_config, get_kafka_settings
+from helpers.records import plain
+from sink_connector.spool import create_spool
 import asyncio
+import logging
+import threading
+import time
 import sys
 import json
+from collections import deque
+
+# librdkafka settings per profile, trading latency against batching and compression
+PROFILES = {
+    "latency": {
+        "linger.ms": 0,
+        "batch.size": 16384,
+        "compression.type": "none",
+    },
+    "balanced": {
+        "linger.ms": 5,
+        "batch.size": 262144,
+        "compression.type": "lz4",
+    },
+    "throughput": {
+        "linger.ms": 50,
+        "batch.size": 1048576,
+        "compression.type": "zstd",
+    },
+}
 
 class KafkaProducer():
-    def __init__(self, topic):
+    """
+    Produces to Kafka without ever blocking the event loop.
+
+    Delivery callbacks are served by a dedicated poll thread and resolve the future
+    returned by produce. Messages are partitioned by a murmur2 hash of their key.
+
+    Messages that fail delivery, or that find max_backlog messages already waiting for
+    room in librdkafka's queue, are spooled to disk instead of being lost or held in
+    memory, and replayed alongside live traffic.
+    """
+    def __init__(self, topic, profile=None, producer_class=Producer):
         self.topic = topic
+        settings = get_kafka_settings()
+        self.profile = profile or settings['profile']
+        self.poll_timeout = float(settings['poll_timeout'])
+        self.retry_interval = float(settings['retry_interval'])
+        self.max_backlog = int(settings['max_backlog'])
         self.conf = get_kafka_config()
+        self.conf.update(PROFILES[self.profile])
         self.conf['client.id'] = topic + '-producer'
         self.conf['queue.buffering.max.messages'] = 1000000
-        self.producer = Producer(self.conf)
+        self.conf['partitioner'] = 'murmur2_random'
+        self.producer = producer_class(self.conf)
+        self.loop = None
+        self.delivered = deque()
+        # Messages librdkafka had no room for, retried from the loop rather than blocking on a flush
+        self.backlog = deque()
+        self.retry_handle = None
+        self.spool = create_spool(f"kafka-{topic}")
+        self.replay_task = None
+        self.num_messages, self.num_bytes = message_counters("kafka", topic)
+        self.ack_latency = sink_ack_histogram("kafka", topic)
+        queue_depth_gauge("kafka-backlog", topic, lambda: len(self.backlog))
+        queue_depth_gauge("kafka-in-flight", topic, lambda: len(self.producer))
+        self.polling = True
+        self.poll_thread = threading.Thread(target=self._poll, name=topic + '-poll', daemon=True)
+        self.poll_thread.start()
 
-    def _ack(self, err, msg):
+    def _poll(self):
+        while self.polling:
+            self.producer.poll(self.poll_timeout)
+            # One wakeup of the loop resolves everything this poll delivered
+            if self.delivered:
+                self.loop.call_soon_threadsafe(self._resolve_delivered)
+
+    def _ack(self, future, err, msg, spool_on_failure, created):
+        # Runs on the poll thread, so futures are only collected here and resolved on the loop
         if err is not None:
             print("Failed to deliver message: %s: %s" % (msg.topic(), msg.partition()))
+        self.delivered.append((future, err, msg, spool_on_failure, created))
+
+    def _resolve_delivered(self):
+        acked = time.time()
+        while self.delivered:
+            future, err, msg, spool_on_failure, created = self.delivered.popleft()
+            if err is None and created is not None:
+                self.ack_latency.observe(acked - created)
+            if err is not None and spool_on_failure:
+                self.spool.append([(msg.topic(), msg.key(), msg.value())])
+            if future.done():
+                continue
+            if err is not None and not spool_on_failure:
+                future.set_exception(KafkaException(err))
+            else:
+                future.set_result(None if err is not None else msg)
+
+    def start_writer(self):
+        """
+        Starts replaying the spool. Messages are handed to librdkafka as they are produced,
+        so unlike RedisProducer there is no writer as such.
+        """
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.replay_task = self.loop.create_task(self.spool.run(self.replay))
 
-    def produce(self, key, msg):
+    def produce(self, key, msg, created=None):
+        """
+        Queues a message and returns a future that resolves to it once the broker has it,
+        or to None if it was spooled to disk instead. created is when the message was
+        decoded or made, defaulting to now.
+        """
+        self.start_writer()
+        msg = plain(msg)
         if isinstance(msg, dict) or isinstance(msg, list):
             msg = json.dumps(msg).encode('utf-8')
-        produced = False
-        while not produced:
-            try:
-                produced = True
-                self.producer.produce(self.topic, key=key, value=msg, on_delivery=self._ack, partition=0)
-                self.producer.poll(0)
-            except BufferError as e:
-                print(e)
-                self.producer.flush()
-                print("Queue flushed")
-                produced = False
\ No newline at end of file
+        self.num_messages.inc()
+        self.num_bytes.inc(len(msg))
+        if created is None:
+            created = time.time()
+        future = self.loop.create_future()
+        # Failures are already reported by _ack, so callers that never await the future are not warned again
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if len(self.backlog) >= self.max_backlog:
+            self.spool.append([(self.topic, key, msg)])
+            future.set_result(None)
+        elif self.backlog or not self._try_produce(key, msg, future, created=created):
+            self.backlog.append((key, msg, future, None, True, created))
+            self._schedule_retry()
+        return future
+
+    async def produce_batch(self, stream, entries):
+        """
+        Produces (key, msg, created) entries without waiting for their delivery. stream can only be the producer's topic.
+        """
+        for key, msg, created in entries:
+            self.produce(key, msg, created)
+        return len(entries)
+
+    def _try_produce(self, key, msg, future, topic=None, spool_on_failure=True, created=None):
+        try:
+            self.producer.produce(topic or self.topic, key=key, value=msg,
+                                  on_delivery=lambda err, delivered: self._ack(future, err, delivered, spool_on_failure, created))
+            return True
+        except BufferError:
+            return False
+
+    async def replay(self, batch):
+        """
+        Produces a batch of spooled messages, returning whether the broker took all of them
+        """
+        futures = []
+        for topic, key, msg in batch:
+            future = self.loop.create_future()
+            if not self._try_produce(key, msg, future, topic, spool_on_failure=False):
+                break
+            futures.append(future)
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        return len(futures) == len(batch) and not any(isinstance(result, Exception) for result in results)
+
+    def _schedule_retry(self):
+        if self.retry_handle is None:
+            self.retry_handle = self.loop.call_later(self.retry_interval, self._retry_backlog)
+
+    def _retry_backlog(self):
+        self.retry_handle = None
+        while self.backlog:
+            if not self._try_produce(*self.backlog[0]):
+                break
+            self.backlog.popleft()
+        if self.backlog:
+            self._schedule_retry()
+
+    async def close(self):
+        """
+        Waits for the backlog and every in flight message to be delivered, then stops polling
+        """
+        while self.backlog:
+            await asyncio.sleep(self.retry_interval)
+        await asyncio.get_running_loop().run_in_executor(None, self.producer.flush)
+        self.polling = False
+        self.poll_thread.join()
+        # Anything still spooled is left on disk for the next run
+        if self.replay_task is not None:
+            self.replay_task.cancel()
+            await asyncio.gather(self.replay_task, return_exceptions=True)
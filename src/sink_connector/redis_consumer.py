@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import aioredis
+from helpers.metrics import REGISTRY, queue_depth_gauge
+from helpers.read_config import get_redis_config, get_redis_consumer_config
+from helpers.records import decode_message
+from helpers.reconnect import Backoff
+
+def next_id(message_id):
+    """
+    The smallest stream id after message_id
+    """
+    ms, seq = message_id.split("-")
+    return f"{ms}-{int(seq) + 1}"
+
+def pairs_to_dict(fields):
+    # Raw replies list fields and values in turn
+    return dict(zip(fields[::2], fields[1::2])) if fields else None
+
+class RedisConsumer:
+    """
+    Reads streams as a member of a Redis consumer group, so consumers in any number of
+    processes share out the streams' messages between them.
+
+    Each of num_consumers readers asks for up to batch_size messages from every stream
+    at once, and hands each message to handler(stream, message_id, key, message) as its
+    own task, with at most max_in_flight being handled at a time, so messages are not
+    handled in order unless max_in_flight is 1. message is the field's value decoded from
+    JSON by loads, json.loads by default, with positionally encoded records turned back
+    into records. Unlike orjson, json.loads keeps integers beyond 64 bits, token amounts
+    and sqrtPriceX96 among them, exact.
+
+    Messages are acknowledged once handled, ack_batch_size or ack_interval seconds worth
+    in one pipeline. A message whose handler raises is left pending. Messages pending
+    min_idle_ms or longer with any consumer in the group, such as one that crashed or a
+    handler that failed, are claimed every claim_interval seconds and handled again, so
+    every message is handled at least once.
+
+    Readers start with whatever was left pending under their own name, which only
+    carries over between runs when consumer is given rather than made from the host
+    name and process id.
+    """
+    def __init__(self, streams, group, handler, consumer=None, pool=None, num_consumers=None, max_in_flight=None,
+                 loads=None):
+        conf = get_redis_consumer_config()
+        self.streams = list(streams)
+        self.group = group
+        self.handler = handler
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.num_consumers = num_consumers or int(conf['num_consumers'])
+        self.max_in_flight = max_in_flight or int(conf['max_in_flight'])
+        self.batch_size = int(conf['batch_size'])
+        self.block_ms = int(conf['block_ms'])
+        self.ack_batch_size = int(conf['ack_batch_size'])
+        self.ack_interval = float(conf['ack_interval'])
+        self.min_idle_ms = int(conf['min_idle_ms'])
+        self.claim_interval = float(conf['claim_interval'])
+        self.claim_batch_size = int(conf['claim_batch_size'])
+        self.start_id = conf['start_id'].strip()
+        self.shutdown_timeout = float(conf['shutdown_timeout'])
+        self.pool = pool or self.get_redis_pool()
+        self.loads = loads or json.loads
+        # Made once the loop is running
+        self.in_flight = None
+        self.ack_due = None
+        self.handling = set()
+        self.acks = {stream: [] for stream in self.streams}
+        self.num_unacked = 0
+        # Redis older than 6.2 has no XAUTOCLAIM, found out on the first claim
+        self.autoclaim = True
+        self.num_read = REGISTRY.counter("collector_consumer_read_total", "Messages read by a consumer group", group=group)
+        self.num_acked = REGISTRY.counter("collector_consumer_acked_total", "Messages handled and acknowledged", group=group)
+        self.num_claimed = REGISTRY.counter("collector_consumer_claimed_total", "Idle messages claimed from other consumers", group=group)
+        self.num_failed = REGISTRY.counter("collector_consumer_failed_total", "Messages a handler raised on", group=group)
+        queue_depth_gauge("consumer-in-flight", group, lambda: len(self.handling))
+
+    def get_redis_pool(self):
+        conf = get_redis_config()
+        return aioredis.from_url(f"redis://{conf['REDIS_HOST']}", encoding='utf-8', decode_responses=True)
+
+    async def create_groups(self):
+        for stream in self.streams:
+            try:
+                await self.pool.xgroup_create(stream, self.group, self.start_id, mkstream=True)
+            except aioredis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def run(self):
+        """
+        Consumes until cancelled, then waits up to shutdown_timeout for the messages being
+        handled and acknowledges them. Anything still unhandled is left pending, to be claimed.
+        """
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.ack_due = asyncio.Event()
+        await self.create_groups()
+        tasks = [asyncio.create_task(self.read(f"{self.consumer}-{i}")) for i in range(self.num_consumers)]
+        tasks.append(asyncio.create_task(self.acknowledge()))
+        tasks.append(asyncio.create_task(self.claim_idle(f"{self.consumer}-0")))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.handling:
+                await asyncio.wait(self.handling, timeout=self.shutdown_timeout)
+            await self.flush_acks()
+
+    async def read(self, name):
+        # Starting from 0 rereads what is pending under this name, then > reads new messages
+        ids = {stream: "0" for stream in self.streams}
+        backoff = Backoff()
+        while True:
+            pending = ids[self.streams[0]] != ">"
+            try:
+                response = await self.pool.xreadgroup(self.group, name, ids, count=self.batch_size,
+                                                      block=None if pending else self.block_ms)
+            except (aioredis.RedisError, OSError) as e:
+                logging.warning("Failed to read %s as %s of %s: %s", ", ".join(self.streams), name, self.group, e)
+                await asyncio.sleep(backoff.next_delay())
+                if "NOGROUP" in str(e):
+                    await self.create_groups()
+                continue
+            backoff.reset()
+            if pending and not any(entries for _, entries in response or []):
+                ids = dict.fromkeys(self.streams, ">")
+                continue
+            for stream, entries in response or []:
+                if pending and entries:
+                    ids[stream] = entries[-1][0]
+                self.num_read.inc(len(entries))
+                await self.dispatch(stream, entries)
+
+    async def dispatch(self, stream, entries):
+        for message_id, fields in entries:
+            if not fields:
+                # Trimmed from the stream while it was pending, so there is nothing left to handle
+                self.add_ack(stream, message_id)
+                continue
+            await self.in_flight.acquire()
+            task = asyncio.create_task(self.handle(stream, message_id, fields))
+            self.handling.add(task)
+            task.add_done_callback(self.handling.discard)
+
+    def decode(self, value):
+        try:
+            return decode_message(self.loads(value))
+        except ValueError:
+            return value
+
+    async def handle(self, stream, message_id, fields):
+        try:
+            for key, value in fields.items():
+                await self.handler(stream, message_id, key, self.decode(value))
+        except Exception:
+            # Left pending, to be claimed and handled again once idle for min_idle_ms
+            logging.exception("Failed to handle %s %s", stream, message_id)
+            self.num_failed.inc()
+        else:
+            self.add_ack(stream, message_id)
+        finally:
+            self.in_flight.release()
+
+    def add_ack(self, stream, message_id):
+        self.acks[stream].append(message_id)
+        self.num_unacked += 1
+        if self.num_unacked >= self.ack_batch_size:
+            self.ack_due.set()
+
+    async def acknowledge(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.ack_due.wait(), self.ack_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.ack_due.clear()
+            await self.flush_acks()
+
+    async def flush_acks(self):
+        if not self.num_unacked:
+            return
+        acks = self.acks
+        self.acks = {stream: [] for stream in self.streams}
+        num_acks = self.num_unacked
+        self.num_unacked = 0
+        try:
+            async with self.pool.pipeline(transaction=False) as pipe:
+                for stream, ids in acks.items():
+                    if ids:
+                        pipe.xack(stream, self.group, *ids)
+                await pipe.execute()
+        except (aioredis.RedisError, OSError) as e:
+            logging.error("Failed to acknowledge %d messages of %s, retrying: %s", num_acks, self.group, e)
+            for stream, ids in acks.items():
+                self.acks[stream][:0] = ids
+            self.num_unacked += num_acks
+        else:
+            self.num_acked.inc(num_acks)
+
+    async def claim_idle(self, name):
+        while True:
+            await asyncio.sleep(self.claim_interval)
+            for stream in self.streams:
+                start = "0-0"
+                try:
+                    while True:
+                        start, entries = await self.claim(stream, name, start)
+                        if entries:
+                            self.num_claimed.inc(len(entries))
+                            await self.dispatch(stream, entries)
+                        if start == "0-0":
+                            break
+                except (aioredis.RedisError, OSError) as e:
+                    logging.warning("Failed to claim idle messages of %s in %s: %s", self.group, stream, e)
+
+    async def claim(self, stream, name, start):
+        """
+        Claims up to claim_batch_size messages idle for min_idle_ms from start on, returning
+        where the next claim starts, 0-0 once the pending entries are all gone through, and
+        the (message_id, fields) claimed
+        """
+        if self.autoclaim:
+            try:
+                reply = await self.pool.execute_command("XAUTOCLAIM", stream, self.group, name, self.min_idle_ms, start,
+                                                        "COUNT", self.claim_batch_size)
+                return reply[0], [(message_id, pairs_to_dict(fields)) for message_id, fields in reply[1]]
+            except aioredis.ResponseError as e:
+                if "unknown command" not in str(e).lower():
+                    raise
+                logging.info("Redis has no XAUTOCLAIM, claiming with XPENDING and XCLAIM")
+                self.autoclaim = False
+        pending = await self.pool.xpending_range(stream, self.group, "-" if start == "0-0" else start, "+", self.claim_batch_size)
+        if not pending:
+            return "0-0", []
+        idle = [entry["message_id"] for entry in pending if entry["time_since_delivered"] >= self.min_idle_ms]
+        claimed = await self.pool.xclaim(stream, self.group, name, self.min_idle_ms, idle) if idle else []
+        start = next_id(pending[-1]["message_id"]) if len(pending) == self.claim_batch_size else "0-0"
+        return start, claimed
+
+async def print_message(stream, message_id, key, message):
+    print(stream, message_id, key, message, flush=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Prints the messages of streams as a member of a consumer group")
+    parser.add_argument("streams", nargs="+")
+    parser.add_argument("--group", default="printer")
+    parser.add_argument("--consumer", help="name to carry pending messages over between runs under")
+    parser.add_argument("--consumers", type=int, help="readers in this process, num_consumers in [REDIS_CONSUMER] by default")
+    return parser.parse_args()
+
+async def main(args):
+    await RedisConsumer(args.streams, args.group, print_message, args.consumer, num_consumers=args.consumers).run()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        print("\nExiting by user request.\n")
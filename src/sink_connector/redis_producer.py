@@ -1,8 +1,12 @@
+from helpers.metrics import message_counters, queue_depth_gauge, sink_ack_histogram
 from helpers.read_config import get_redis_config
-import sys
+from helpers.records import plain
+from sink_connector.spool import create_spool
 import aioredis
 import asyncio
 import json
+import logging
+import time
 
 class RedisProducer:
     def __init__(self, topic):
@@ -11,8 +15,18 @@ class RedisProducer:
         self.redis_host = conf['REDIS_HOST']
         self.redis_port = conf['REDIS_PORT']
         self.stream_max_len = int(conf['stream_max_len'])
+        self.writer_batch_size = int(conf['writer_batch_size'])
+        self.writer_flush_interval = float(conf['writer_flush_interval'])
+        self.writer_queue_size = int(conf['writer_queue_size'])
         self.pool = self.get_redis_pool()
-        
+        self.queue = None
+        self.writer_task = None
+        # Whatever Redis fails to take is kept on disk and replayed once it is back
+        self.spool = create_spool(f"redis-{topic}")
+        self.replay_task = None
+        # Stream to its message and byte counters and its acknowledgement latencies
+        self.stream_metrics = {}
+
     def get_redis_pool(self):
         try:
             pool = aioredis.from_url(
@@ -22,34 +36,156 @@ class RedisProducer:
             print('cannot connect to redis on:', self.redis_host, self.redis_port)
             return None
 
-    async def produce(self, key, msg):
-        if self.pool is None:
-            print('cannot connect to redis on:', self.redis_host, self.redis_port)
-            return
-        if isinstance(msg, dict) or isinstance(msg, list):
-            msg = json.dumps(msg).encode('utf-8')
-        await self.pool.xadd(self.topic, fields={key: msg}, maxlen=self.stream_max_len, approximate=True)
-        return 1
+    def start_writer(self):
+        """
+        Starts a background task that coalesces produced messages into pipelined XADDs.
 
-    async def pipeline_produce(self, key_field, events):
-        async with self.pool.pipeline() as pipe:
-            for event in events:
-                key = event[key_field]
-                event = json.dumps(event).encode('utf-8')
-                pipe.xadd(self.topic, fields={key: event}, maxlen=self.stream_max_len, approximate=True)
+        Once started, produce only waits on Redis when writer_queue_size messages are
+        already waiting to be written. Batches that fail to be written are spooled, and
+        replayed alongside live traffic once Redis takes writes again.
+        """
+        if self.writer_task is None:
+            self.queue = asyncio.Queue(self.writer_queue_size)
+            queue_depth_gauge("redis-writer", self.topic, self.queue.qsize)
+            self.writer_task = asyncio.create_task(self.write_batches())
+            self.replay_task = asyncio.create_task(self.spool.run(self.replay))
+
+    async def write_batches(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            batch = []
+            entry = await self.queue.get()
+            deadline = loop.time() + self.writer_flush_interval
+            # Keep collecting until the batch is full or the flush interval is up
+            while entry is not None:
+                batch.append(entry)
+                if len(batch) >= self.writer_batch_size:
+                    break
+                try:
+                    entry = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+            # None is only ever queued by close, once everything before it is in the batch
+            closing = entry is None
+            if batch:
+                try:
+                    await self.write_batch([entry[:3] for entry in batch], [entry[3] for entry in batch])
+                except Exception:
+                    # Anything but an outage is a bug, but the writer has to outlive it or produce blocks for good
+                    logging.exception("Failed to write %d messages to Redis, spooling them", len(batch))
+                    try:
+                        self.spool.append([entry[:3] for entry in batch])
+                    except Exception:
+                        logging.exception("Failed to spool %d messages, dropping them", len(batch))
+
+    async def xadd_batch(self, batch):
+        async with self.pool.pipeline(transaction=False) as pipe:
+            for stream, key, msg in batch:
+                pipe.xadd(stream, fields={key: msg}, maxlen=self.stream_max_len, approximate=True)
             await pipe.execute()
 
+    def get_stream_metrics(self, stream):
+        if stream not in self.stream_metrics:
+            self.stream_metrics[stream] = message_counters("redis", stream) + (sink_ack_histogram("redis", stream),)
+        return self.stream_metrics[stream]
+
+    async def write_batch(self, batch, created=None):
+        """
+        Writes (stream, key, msg) entries, created being when each was decoded or made, for the latency histograms
+        """
+        if self.pool is not None:
+            try:
+                await self.xadd_batch(batch)
+            except (aioredis.RedisError, OSError) as e:
+                logging.error("Failed to write %d messages to %s, spooling them: %s", len(batch), ", ".join(sorted({entry[0] for entry in batch})), e)
+            else:
+                if created is not None:
+                    acked = time.time()
+                    for (stream, _, _), entry_created in zip(batch, created):
+                        self.get_stream_metrics(stream)[2].observe(acked - entry_created)
+                return
+        self.spool.append(batch)
 
-    async def consume(self):
+    async def replay(self, batch):
         if self.pool is None:
-            print('cannot connect to redis on:', self.redis_host, self.redis_port)
-            return
-        return await self.pool.xreadgroup('group', 'consumer', streams={self.topic: ">", "coinbase-normalised": ">"}, count=self.stream_max_len, block=0)
+            return False
+        try:
+            await self.xadd_batch(batch)
+            return True
+        except (aioredis.RedisError, OSError):
+            return False
 
-async def main():
-    producer = RedisProducer(sys.argv[1])
-    while True:
-        print(await producer.consume())
+    async def close(self):
+        """
+        Waits until every queued message has been written and stops the writer
+        """
+        if self.writer_task is not None:
+            await self.queue.put(None)
+            await self.writer_task
+            self.writer_task = None
+            self.queue = None
+            # Anything still spooled is left on disk for the next run
+            self.replay_task.cancel()
+            await asyncio.gather(self.replay_task, return_exceptions=True)
+            self.replay_task = None
 
-if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    async def produce(self, key, msg, created=None):
+        return await self.produce_to(self.topic, key, msg, created)
+
+    async def produce_to(self, stream, key, msg, created=None):
+        """
+        Produces to any stream, so one producer and its writer can serve several streams.
+        created is when the message was decoded or made, defaulting to now.
+        """
+        msg = plain(msg)
+        if isinstance(msg, dict) or isinstance(msg, list):
+            msg = json.dumps(msg).encode('utf-8')
+        messages, num_bytes, _ = self.get_stream_metrics(stream)
+        messages.inc()
+        num_bytes.inc(len(msg))
+        if created is None:
+            created = time.time()
+        if self.writer_task is not None:
+            await self.queue.put((stream, key, msg, created))
+            return 1
+        await self.write_batch([(stream, key, msg)], [created])
+        return 1
+
+    async def produce_batch(self, stream, entries):
+        """
+        Writes (key, msg, created) entries to stream in one pipeline, bypassing the writer for callers that batch already
+        """
+        messages, num_bytes, _ = self.get_stream_metrics(stream)
+        now = time.time()
+        batch = []
+        created = []
+        for key, msg, entry_created in entries:
+            msg = plain(msg)
+            if isinstance(msg, dict) or isinstance(msg, list):
+                msg = json.dumps(msg).encode('utf-8')
+            num_bytes.inc(len(msg))
+            batch.append((stream, key, msg))
+            created.append(now if entry_created is None else entry_created)
+        messages.inc(len(batch))
+        await self.write_batch(batch, created)
+        return len(batch)
+
+    async def pipeline_produce(self, key_field, events, created=None):
+        if self.writer_task is not None:
+            for event in events:
+                await self.produce(event[key_field], json.dumps(plain(event)).encode('utf-8'), created)
+            return
+        batch = [(self.topic, event[key_field], json.dumps(plain(event)).encode('utf-8')) for event in events]
+        messages, num_bytes, _ = self.get_stream_metrics(self.topic)
+        messages.inc(len(batch))
+        num_bytes.inc(sum(len(msg) for _, _, msg in batch))
+        if created is None:
+            created = time.time()
+        await self.write_batch(batch, [created] * len(batch))
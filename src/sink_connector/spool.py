@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from helpers.file_lock import lock_file
+from helpers.metrics import REGISTRY
+from helpers.read_config import get_spool_config
+from helpers.reconnect import Backoff
+
+# Each entry is its length and crc32, then the JSON of [stream, key, msg]
+ENTRY_HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".spool"
+LOCK_NAME = "lock"
+
+def lock_directory(directory):
+    """
+    Takes the lock file of directory, returning it while held or None if another spool,
+    in this process or another, holds it
+    """
+    os.makedirs(directory, exist_ok=True)
+    lock = open(os.path.join(directory, LOCK_NAME), "a+b")
+    if not lock_file(lock, blocking=False):
+        lock.close()
+        return None
+    return lock
+
+def remove_segment(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        logging.warning("Spool segment %s was already gone", path)
+
+def encode_entry(stream, key, msg):
+    if isinstance(key, bytes):
+        key = key.decode()
+    if isinstance(msg, bytes):
+        msg = msg.decode()
+    payload = json.dumps([stream, key, msg]).encode()
+    return ENTRY_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class SpoolSegment:
+    def __init__(self, path, sequence, created, size=0, entries=None):
+        self.path = path
+        self.sequence = sequence
+        self.created = created
+        self.size = size
+        # Only known for segments written by this process
+        self.entries = entries
+
+
+class Spool:
+    """
+    Disk backed, append only spool of the (stream, key, msg) entries a sink failed to take.
+
+    Entries are appended to segment files of up to segment_bytes, written straight
+    away but only fsynced every fsync_interval, so a burst of failures costs one fsync.
+    run replays the oldest entries through replay, at most replay_rate entries a second
+    so the sink isn't swamped while live traffic keeps flowing to it, and deletes each
+    segment once all of it has been replayed. Entries are replayed at least once, and a
+    crash mid segment replays that segment again. The spool is bounded to max_bytes
+    and max_age seconds, dropping the oldest segments beyond either.
+
+    Each spool locks the directory it is given, or, while another spool holds that, the
+    first free one of directory.1, directory.2 and so on, so two producers of one topic
+    never replay or delete each other's segments. Segments left behind in any of those
+    directories by an earlier run are picked up and replayed too.
+    """
+    def __init__(self, directory, segment_bytes=64 * 2 ** 20, fsync_interval=0.05, max_bytes=2 ** 31, max_age=86400,
+                 replay_rate=5000, replay_batch_size=500, metrics_log_interval=60):
+        self.base_directory = directory
+        self.directory, self.lock = self.claim_directory(directory)
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.replay_rate = replay_rate
+        self.replay_batch_size = replay_batch_size
+        self.metrics_log_interval = metrics_log_interval
+        self.segments = []
+        self.file = None
+        self.dirty = False
+        # Replay position in the oldest segment, and where the last replayed batch started
+        self.read_file = None
+        self.read_offset = 0
+        self.committed_offset = 0
+        self.num_spooled = 0
+        self.num_replayed = 0
+        self.dropped_bytes = 0
+        self.load()
+
+    @staticmethod
+    def claim_directory(directory):
+        slot = 0
+        while True:
+            path = f"{directory}.{slot}" if slot else directory
+            lock = lock_directory(path)
+            if lock is not None:
+                return path, lock
+            slot += 1
+
+    def sibling_directories(self):
+        """
+        The other directories spools of the same name lock when theirs is taken
+        """
+        parent, name = os.path.split(self.base_directory)
+        parent = parent or "."
+        siblings = [self.base_directory] + [os.path.join(parent, entry) for entry in os.listdir(parent)
+                                            if entry.startswith(name + ".") and entry[len(name) + 1:].isdigit()]
+        return [sibling for sibling in siblings if os.path.normpath(sibling) != os.path.normpath(self.directory)]
+
+    def list_segments(self, directory):
+        segments = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(directory, name)
+            sequence, created = name[:-len(SEGMENT_SUFFIX)].split("-")
+            segments.append(SpoolSegment(path, int(sequence), int(created) / 1000, os.path.getsize(path)))
+        return segments
+
+    def adopt(self, directory):
+        """
+        Moves the segments of a directory no spool holds any more into this one, after its own
+        """
+        lock = lock_directory(directory)
+        if lock is None:
+            return
+        try:
+            for segment in self.list_segments(directory):
+                sequence = self.segments[-1].sequence + 1 if self.segments else 0
+                path = os.path.join(self.directory, f"{sequence:012d}-{int(segment.created * 1000)}{SEGMENT_SUFFIX}")
+                os.replace(segment.path, path)
+                self.segments.append(SpoolSegment(path, sequence, segment.created, segment.size))
+        finally:
+            lock.close()
+
+    def load(self):
+        self.segments = self.list_segments(self.directory)
+        for directory in self.sibling_directories():
+            self.adopt(directory)
+        if self.segments:
+            logging.warning("Found %d bytes spooled in %s by an earlier run, replaying", self.size(), self.directory)
+
+    def size(self):
+        return sum(segment.size for segment in self.segments)
+
+    def open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        sequence = self.segments[-1].sequence + 1 if self.segments else 0
+        created = time.time()
+        path = os.path.join(self.directory, f"{sequence:012d}-{int(created * 1000)}{SEGMENT_SUFFIX}")
+        self.file = open(path, "ab")
+        self.segments.append(SpoolSegment(path, sequence, created, entries=0))
+
+    def close_segment(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def append(self, entries):
+        """
+        Appends (stream, key, msg) entries, rolling over to a new segment when the current one is full
+        """
+        if self.file is None or self.segments[-1].size >= self.segment_bytes:
+            self.close_segment()
+            self.open_segment()
+        data = b"".join(encode_entry(*entry) for entry in entries)
+        self.file.write(data)
+        self.file.flush()
+        segment = self.segments[-1]
+        segment.size += len(data)
+        segment.entries += len(entries)
+        self.num_spooled += len(entries)
+        self.dirty = True
+
+    def sync(self):
+        if self.dirty and self.file is not None:
+            os.fsync(self.file.fileno())
+        self.dirty = False
+
+    def read_batch(self, max_entries):
+        """
+        Returns up to max_entries of the oldest entries not yet replayed, from one segment
+        """
+        if not self.segments:
+            return []
+        # The segment being appended to is closed off before it is read from
+        if len(self.segments) == 1 and self.file is not None:
+            self.close_segment()
+        if self.read_file is None:
+            try:
+                self.read_file = open(self.segments[0].path, "rb")
+            except FileNotFoundError:
+                logging.warning("Spool segment %s was already gone, skipping it", self.segments[0].path)
+                self.segments.pop(0)
+                return []
+            self.read_offset = self.committed_offset = 0
+        self.read_file.seek(self.read_offset)
+        entries = []
+        while len(entries) < max_entries:
+            header = self.read_file.read(ENTRY_HEADER.size)
+            if not header:
+                break
+            length, crc, payload = 0, 0, None
+            if len(header) == ENTRY_HEADER.size:
+                length, crc = ENTRY_HEADER.unpack(header)
+                payload = self.read_file.read(length)
+            # A torn entry can only be the last one written before a crash
+            if payload is None or len(payload) < length or zlib.crc32(payload) != crc:
+                logging.warning("Skipping the torn end of spool segment %s", self.segments[0].path)
+                self.read_file.seek(0, os.SEEK_END)
+                break
+            entries.append(tuple(json.loads(payload)))
+        self.read_offset = self.read_file.tell()
+        return entries
+
+    def commit(self, num_entries):
+        """
+        Marks the batch last read as replayed, deleting its segment once all of it is
+        """
+        self.num_replayed += num_entries
+        self.committed_offset = self.read_offset
+        if self.read_offset >= self.segments[0].size:
+            self.read_file.close()
+            self.read_file = None
+            remove_segment(self.segments.pop(0).path)
+
+    def rewind(self):
+        """
+        Puts the batch last read back, to be read again
+        """
+        self.read_offset = self.committed_offset
+
+    def enforce_limits(self):
+        now = time.time()
+        while self.segments and (self.size() > self.max_bytes or now - self.segments[0].created > self.max_age):
+            if len(self.segments) == 1:
+                self.close_segment()
+            segment = self.segments.pop(0)
+            if self.read_file is not None:
+                self.read_file.close()
+                self.read_file = None
+            dropped = segment.size - self.committed_offset
+            self.committed_offset = self.read_offset = 0
+            self.dropped_bytes += dropped
+            logging.error("Spool %s over its bounds, dropped %d bytes%s", self.directory, dropped,
+                          f" of {segment.entries} entries" if segment.entries is not None else "")
+            remove_segment(segment.path)
+
+    def metrics(self):
+        oldest = self.segments[0].created if self.segments else None
+        return {
+            "bytes": self.size(),
+            "segments": len(self.segments),
+            "oldest_age": round(time.time() - oldest, 1) if oldest is not None else 0.0,
+            "spooled": self.num_spooled,
+            "replayed": self.num_replayed,
+            "dropped_bytes": self.dropped_bytes,
+        }
+
+    async def run(self, replay):
+        """
+        Syncs, bounds and replays the spool for as long as the sink is up. replay is a
+        coroutine function taking a batch of entries, returning whether the sink took them.
+        """
+        backoff = Backoff()
+        last_logged = time.monotonic()
+        try:
+            while True:
+                self.sync()
+                self.enforce_limits()
+                if time.monotonic() - last_logged >= self.metrics_log_interval:
+                    last_logged = time.monotonic()
+                    if self.segments or self.dropped_bytes:
+                        logging.info("Spool %s: %s", self.directory, self.metrics())
+                batch = self.read_batch(self.replay_batch_size) if self.segments else []
+                if not batch:
+                    if self.read_file is not None:
+                        # Only the torn end of a segment was left
+                        self.commit(0)
+                    await asyncio.sleep(self.fsync_interval)
+                    continue
+                if await replay(batch):
+                    self.commit(len(batch))
+                    backoff.reset()
+                    await asyncio.sleep(len(batch) / self.replay_rate)
+                else:
+                    self.rewind()
+                    await asyncio.sleep(backoff.next_delay())
+        finally:
+            self.close_segment()
+
+def create_spool(name):
+    """
+    A spool under the configured spool directory, set up as in [SPOOL]
+    """
+    conf = get_spool_config()
+    spool = Spool(os.path.join(conf['directory'], name), int(conf['segment_bytes']), float(conf['fsync_interval']),
+                  int(conf['max_bytes']), float(conf['max_age']), float(conf['replay_rate']),
+                  int(conf['replay_batch_size']), float(conf['metrics_log_interval']))
+    REGISTRY.gauge("collector_spool_bytes", "Bytes spooled to disk waiting to be replayed", spool.size, spool=name)
+    return spool
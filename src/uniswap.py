@@ -1,5 +1,6 @@
 import asyncio
-from uniswap_helpers.v2_event_subscriber import handle_events
+from helpers.metrics import serve_metrics
+from helpers.protocols import run_protocols
 from uniswap_helpers.v3_indicators_collector import collect_indicators
 import logging
 
@@ -7,10 +8,11 @@ logging.basicConfig(level=logging.INFO)
 
 # Main function creates event listeners for all the different smart contracts and desired event, and sets up the async loop
 async def main():
-    tasks = []
+    tasks = [serve_metrics()]
     logging.info("Starting collectors")
     logging.info("Starting event listeners")
-    tasks.append(handle_events())
+    # V3 pool state is kept from the same subscriptions and decode pool as the V2 logs
+    tasks.append(run_protocols(['uniswap_v2', 'uniswap_v3']))
     logging.info("Starting indicators collector")
     tasks.append(collect_indicators())
     await asyncio.gather(*tasks)
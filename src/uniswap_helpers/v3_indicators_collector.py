@@ -1,78 +1,199 @@
 import asyncio
 import json
-import requests
+import logging
 from sink_connector.redis_producer import RedisProducer
+from helpers.read_config import get_v3_indicators_config
 import aiohttp
 import time
 
-#response = json.load(open("./schemas/indicator_response_template.json"))
 v2_graph_endpoint="https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v2"
 v3_graph_endpoint="https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3"
 
-QUERY_INTERVAL = 30
-
-async def get_global_stats(session):
-    request = \
-    """{
-            factory(id:"0x1F98431c8aD98523631AE4a59f267346ea31F984") {
-                poolCount
-                txCount
-                totalVolumeUSD
-                totalVolumeETH
-                totalFeesUSD
-                totalFeesETH
-                totalValueLockedUSD
-                totalValueLockedETH
+META_QUERY = """
+    {
+        factory(id:"0x1F98431c8aD98523631AE4a59f267346ea31F984") {
+            poolCount
+            txCount
+            totalVolumeUSD
+            totalVolumeETH
+            totalFeesUSD
+            totalFeesETH
+            totalValueLockedUSD
+            totalValueLockedETH
+        }
+    }
+"""
+
+# Pages are walked by id, each partition of the id space with its own cursor
+POOLS_QUERY = """
+    query pools($first: Int!, $cursor: String!, $last: String!, $minTvl: BigDecimal!) {
+        pools(first: $first, orderBy: id, orderDirection: asc,
+              where: {id_gt: $cursor, id_lte: $last, totalValueLockedUSD_gt: $minTvl}) {
+            token0 {
+                symbol
+                name
             }
-            
-            pools(orderBy:totalValueLockedUSD, orderDirection: desc, first: 10) {
-                token0 {
-                    symbol
-                    name
-                }
-                token1 {
-                    symbol
-                    name
-                }
-                id
-                liquidity
-                totalValueLockedToken0
-                totalValueLockedToken1
-                volumeToken0
-                volumeToken1
-                feesUSD
-                volumeUSD
-                totalValueLockedUSD
-                token0Price
-                token1Price
-                txCount
+            token1 {
+                symbol
+                name
             }
-        }"""
-    async with session.post(v3_graph_endpoint, json={"query": request}) as res:
-            
-        #res = requests.post(url=v3_graph_endpoint, json={"query": request})
+            id
+            liquidity
+            totalValueLockedToken0
+            totalValueLockedToken1
+            volumeToken0
+            volumeToken1
+            feesUSD
+            volumeUSD
+            totalValueLockedUSD
+            token0Price
+            token1Price
+            txCount
+        }
+    }
+"""
+
+ADDRESS_SPACE = 2 ** 160
+
+
+class SubgraphError(Exception):
+    pass
+
+
+def partition_bounds(num_partitions):
+    """
+    Splits the pool address space into (cursor, last) ranges, the cursor being exclusive
+    """
+    bounds = []
+    for i in range(num_partitions):
+        lower = i * ADDRESS_SPACE // num_partitions
+        upper = (i + 1) * ADDRESS_SPACE // num_partitions - 1
+        cursor = "0x" + format(lower - 1, "040x") if lower else "0x"
+        bounds.append((cursor, "0x" + format(upper, "040x")))
+    return bounds
+
+def reshape_pool(pool):
+    return {
+        'token0': {
+            'symbol': pool['token0']['symbol'],
+            'name': pool['token0']['name'],
+            'volume': pool['volumeToken0'],
+            'totalValueLocked': pool['totalValueLockedToken0'],
+            'price': pool['token0Price']
+        },
+        'token1': {
+            'symbol': pool['token1']['symbol'],
+            'name': pool['token1']['name'],
+            'volume': pool['volumeToken1'],
+            'totalValueLocked': pool['totalValueLockedToken1'],
+            'price': pool['token1Price']
+        },
+        'contractHash': pool['id'],
+        'liquidity': pool['liquidity'],
+        'feesUSD': pool['feesUSD'],
+        'volumeUSD': pool['volumeUSD'],
+        'totalValueLockedUSD': pool['totalValueLockedUSD'],
+        'txCount': pool['txCount']
+    }
+
+async def query_subgraph(session, endpoint, query, variables=None):
+    async with session.post(endpoint, json={"query": query, "variables": variables or {}}) as res:
+        if res.status != 200:
+            raise SubgraphError(f"subgraph returned HTTP {res.status}")
         query_res = await res.json()
-        #print(json.dumps(query_res, indent=4))
-        result = query_res['data']
-        result['timestamp'] = int(time.time() * 1000)
-        result['meta'] = result.pop('factory')
-        for pool in result['pools']:
-            pool['token0']['volume'] = pool.pop('volumeToken0')
-            pool['token1']['volume'] = pool.pop('volumeToken1')
-            pool['token0']['totalValueLocked'] = pool.pop('totalValueLockedToken0')
-            pool['token1']['totalValueLocked'] = pool.pop('totalValueLockedToken1')
-            pool['token0']['price'] = pool.pop('token0Price')
-            pool['token1']['price'] = pool.pop('token1Price')
-            pool['contractHash'] = pool.pop('id')
-        return result
-
-async def collect_indicators():
+    if 'errors' in query_res:
+        raise SubgraphError(f"subgraph returned errors: {query_res['errors']}")
+    return query_res['data']
+
+async def fetch_partition(session, endpoint, cursor, last, min_tvl, page_size):
+    pools = []
+    while True:
+        variables = {"first": page_size, "cursor": cursor, "last": last, "minTvl": str(min_tvl)}
+        page = (await query_subgraph(session, endpoint, POOLS_QUERY, variables))['pools']
+        pools.extend(page)
+        if len(page) < page_size:
+            return pools
+        cursor = page[-1]['id']
+
+async def fetch_snapshot(session, endpoint, min_tvl, page_size, num_partitions):
+    """
+    Returns the factory stats and every pool above min_tvl, keyed by pool id
+    """
+    partitions = [fetch_partition(session, endpoint, cursor, last, min_tvl, page_size)
+                  for cursor, last in partition_bounds(num_partitions)]
+    meta, *pages = await asyncio.gather(query_subgraph(session, endpoint, META_QUERY), *partitions)
+    pools = {}
+    for page in pages:
+        for pool in page:
+            pools[pool['id']] = reshape_pool(pool)
+    return meta['factory'], pools
+
+def diff_snapshots(previous, current):
+    """
+    Returns the pools that are new or changed in current, and the ids of those no longer in it
+    """
+    changed = [pool for pool_id, pool in current.items() if previous.get(pool_id) != pool]
+    removed = [pool_id for pool_id in previous if pool_id not in current]
+    return changed, removed
+
+class DeltaCollector:
+    """
+    Polls the V3 subgraph for every pool above a TVL threshold and publishes only what changed.
+
+    The previous snapshot is kept in memory. Each poll publishes a delta record with the
+    pools whose fields changed and the ids of pools that fell out, and every
+    keyframe_interval polls a keyframe with all pools, so consumers can start from
+    any keyframe. A failed poll publishes nothing and keeps the previous snapshot.
+    """
+    def __init__(self, producer, endpoint, min_tvl, page_size, num_partitions, keyframe_interval):
+        self.producer = producer
+        self.endpoint = endpoint
+        self.min_tvl = min_tvl
+        self.page_size = page_size
+        self.num_partitions = num_partitions
+        self.keyframe_interval = keyframe_interval
+        self.snapshot = {}
+        self.num_polls = 0
+
+    def make_record(self, meta, pools):
+        keyframe = self.num_polls % self.keyframe_interval == 0
+        record = {
+            'type': 'keyframe' if keyframe else 'delta',
+            'timestamp': int(time.time() * 1000),
+            'meta': meta
+        }
+        if keyframe:
+            record['pools'] = list(pools.values())
+        else:
+            record['pools'], record['removed'] = diff_snapshots(self.snapshot, pools)
+        return record
+
+    async def poll(self, session):
+        try:
+            meta, pools = await fetch_snapshot(session, self.endpoint, self.min_tvl, self.page_size, self.num_partitions)
+        except (SubgraphError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning("V3 indicators poll failed, keeping previous snapshot: %s", e)
+            return None
+        record = self.make_record(meta, pools)
+        self.snapshot = pools
+        self.num_polls += 1
+        await self.producer.produce(record['timestamp'], json.dumps(record))
+        return record
+
+    async def run(self, session, query_interval):
+        while True:
+            start = time.monotonic()
+            await self.poll(session)
+            await asyncio.sleep(max(0, query_interval - (time.monotonic() - start)))
+
+async def collect_indicators(endpoint=v3_graph_endpoint):
+    conf = get_v3_indicators_config()
     producer = RedisProducer('uniswap-indicators')
+    producer.start_writer()
+    collector = DeltaCollector(producer, endpoint, float(conf['min_tvl_usd']), int(conf['page_size']),
+                               int(conf['num_partitions']), int(conf['keyframe_interval']))
     async with aiohttp.ClientSession() as session:
-        while True:
-            res = await get_global_stats(session)
-            await producer.produce(time.time(), json.dumps(res))
-            await asyncio.sleep(QUERY_INTERVAL)
+        await collector.run(session, float(conf['query_interval']))
 
 if __name__ == '__main__':
-    asyncio.run(collect_indicators())
\ No newline at end of file
+    asyncio.run(collect_indicators())
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import time
+import aiohttp
+import logging
+from collections import deque
+from helpers.log_decoder import WORD_SIZE, decode_int, decode_uint
+from helpers.read_config import get_v3_pool_state_config
+
+# Function selectors of the pool's slot0() and liquidity() views
+SLOT0_SELECTOR = "0x3850c7bd"
+LIQUIDITY_SELECTOR = "0x1a686502"
+
+Q96 = 2 ** 96
+
+def call_request(request_id, address, selector, block_tag):
+    return {"jsonrpc": "2.0", "id": request_id, "method": "eth_call", "params": [{"to": address, "data": selector}, block_tag]}
+
+
+class PoolState:
+    """
+    Current state of one pool, along with the position in the chain it is as of
+    """
+    __slots__ = ('price_scale', 'sqrt_price_x96', 'tick', 'liquidity', 'block_number', 'log_index')
+
+    def __init__(self, price_scale, sqrt_price_x96, tick, liquidity, block_number, log_index):
+        self.price_scale = price_scale
+        self.sqrt_price_x96 = sqrt_price_x96
+        self.tick = tick
+        self.liquidity = liquidity
+        self.block_number = block_number
+        self.log_index = log_index
+
+    def token0_price(self):
+        """
+        Price of token0 in units of token1, adjusted for the tokens' decimals
+        """
+        return (self.sqrt_price_x96 / Q96) ** 2 * self.price_scale
+
+
+class PoolStateEngine:
+    """
+    Keeps sqrtPriceX96, tick and liquidity of every tracked V3 pool up to date from its logs.
+
+    Pools are seeded from slot0() and liquidity() read at a single block in one batched
+    JSON-RPC request, and logs at or before the seed block are skipped. Logs of pools
+    still being seeded are held back, the latest max_pending of each, and applied once
+    the seed is in. Pools that could not be seeded are tried again after reseed_interval
+    seconds, their logs dropped meanwhile. Swaps carry the pool's full state, and every
+    one of them publishes a price update.
+
+    Run as a consumer of ProtocolRuntime, which subscribes to the pools' logs, decodes
+    them and hands them to add in block order.
+    """
+    def __init__(self, producer, pools, session, endpoint, seed_batch_size=100, max_retries=5, max_pending=1000, reseed_interval=300):
+        self.producer = producer
+        self.pools = pools
+        self.session = session
+        self.endpoint = endpoint
+        self.seed_batch_size = seed_batch_size
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.reseed_interval = reseed_interval
+        self.table = {}
+        self.pending = {}
+        # Pools seeding gave up on, waiting for reseed_task
+        self.unseeded = set()
+        self.reseed_task = None
+
+    async def run(self):
+        """
+        Seeds every pool, then keeps reseeding those that failed until cancelled
+        """
+        try:
+            await self.seed(list(self.pools.keys()))
+            await asyncio.Future()
+        finally:
+            self.cancel()
+
+    async def add(self, processed_log):
+        address = processed_log['address']
+        state = self.table.get(address)
+        if state is None:
+            if address in self.pools and address not in self.unseeded:
+                # The seed is read at the latest block, so the oldest held logs are the ones it is bound to cover
+                if address not in self.pending:
+                    self.pending[address] = deque(maxlen=self.max_pending)
+                self.pending[address].append(processed_log)
+            return
+        position = (processed_log['blockNumber'], processed_log['logIndex'])
+        if position <= (state.block_number, state.log_index):
+            return
+        state.block_number, state.log_index = position
+
+        args = processed_log['data']
+        if processed_log['type'] == 'Swap':
+            state.sqrt_price_x96 = args['sqrtPriceX96']
+            state.tick = args['tick']
+            state.liquidity = args['liquidity']
+            await self.publish_price(address, state, processed_log)
+        elif args['tickLower'] <= state.tick < args['tickUpper']:
+            # Only positions around the current tick count towards active liquidity
+            if processed_log['type'] == 'Mint':
+                state.liquidity += args['amount']
+            else:
+                state.liquidity -= args['amount']
+
+    async def publish_price(self, address, state, processed_log):
+        pool_info = self.pools[address]
+        token0_price = state.token0_price()
+        record = {
+            'address': address,
+            'blockNumber': processed_log['blockNumber'],
+            'logIndex': processed_log['logIndex'],
+            'transactionHash': processed_log['transactionHash'],
+            'token0Symbol': pool_info['token0Symbol'],
+            'token1Symbol': pool_info['token1Symbol'],
+            'sqrtPriceX96': state.sqrt_price_x96,
+            'tick': state.tick,
+            'liquidity': state.liquidity,
+            'token0Price': token0_price,
+            'token1Price': 1 / token0_price if token0_price else None,
+            'exchange': 'UniswapV3',
+            'processedTimestamp': int(time.time() * (10 ** 3))
+        }
+        await self.producer.produce(record['processedTimestamp'], json.dumps(record))
+
+    async def fetch_seed(self, addresses):
+        """
+        Reads slot0() and liquidity() of all addresses at the latest block, in one batch
+        """
+        async with self.session.post(self.endpoint, json={"jsonrpc": "2.0", "id": 0, "method": "eth_blockNumber", "params": []}) as res:
+            block_number = int((await res.json())['result'], 16)
+        block_tag = hex(block_number)
+        request = []
+        for i, address in enumerate(addresses):
+            request.append(call_request(2 * i, address, SLOT0_SELECTOR, block_tag))
+            request.append(call_request(2 * i + 1, address, LIQUIDITY_SELECTOR, block_tag))
+        async with self.session.post(self.endpoint, json=request) as res:
+            responses = await res.json()
+        if not isinstance(responses, list):
+            raise ValueError(f"batch request failed: {responses}")
+        results = {response['id']: response.get('result') for response in responses}
+        seeds = {}
+        for i, address in enumerate(addresses):
+            slot0, liquidity = results.get(2 * i), results.get(2 * i + 1)
+            if not slot0 or not liquidity or slot0 == "0x" or liquidity == "0x":
+                continue
+            seeds[address] = (decode_uint(slot0[2:2 + WORD_SIZE]), decode_int(slot0[2 + WORD_SIZE:2 + 2 * WORD_SIZE]),
+                              decode_uint(liquidity[2:2 + WORD_SIZE]), block_number)
+        return seeds
+
+    async def seed(self, addresses):
+        remaining = list(addresses)
+        for attempt in range(self.max_retries):
+            for start in range(0, len(remaining), self.seed_batch_size):
+                batch = remaining[start:start + self.seed_batch_size]
+                try:
+                    seeds = await self.fetch_seed(batch)
+                except (ValueError, KeyError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning("Failed to seed %d V3 pools: %s", len(batch), e)
+                    continue
+                for address, (sqrt_price_x96, tick, liquidity, block_number) in seeds.items():
+                    await self.add_pool(address, sqrt_price_x96, tick, liquidity, block_number)
+            remaining = [address for address in remaining if address not in self.table and address in self.pools]
+            if not remaining:
+                return
+            await asyncio.sleep(2 ** attempt)
+        logging.warning("Giving up on seeding V3 pools %s for %ds", remaining, self.reseed_interval)
+        for address in remaining:
+            self.pending.pop(address, None)
+            self.unseeded.add(address)
+        if self.reseed_task is None or self.reseed_task.done():
+            self.reseed_task = asyncio.create_task(self.reseed_later())
+
+    async def reseed_later(self):
+        await asyncio.sleep(self.reseed_interval)
+        addresses = [address for address in self.unseeded if address in self.pools]
+        self.unseeded.clear()
+        await self.seed(addresses)
+
+    def cancel(self):
+        if self.reseed_task is not None:
+            self.reseed_task.cancel()
+
+    async def add_pool(self, address, sqrt_price_x96, tick, liquidity, block_number):
+        pool_info = self.pools[address]
+        # The subgraph gives decimals as strings
+        price_scale = 10 ** (int(pool_info['token0Decimals']) - int(pool_info['token1Decimals']))
+        # The seed reflects the end of its block, so any log of that block is already in it
+        self.table[address] = PoolState(price_scale, sqrt_price_x96, tick, liquidity, block_number, float('inf'))
+        for processed_log in self.pending.pop(address, []):
+            await self.add(processed_log)
+
+    async def update(self, added, removed):
+        for address in removed:
+            self.table.pop(address, None)
+            self.pending.pop(address, None)
+            self.unseeded.discard(address)
+        if added:
+            await self.seed(added)
+
+def create_pool_state_engine(producer, pools, session, endpoint):
+    """
+    A PoolStateEngine set up as in [V3_POOL_STATE], for ProtocolRuntime to hand the logs of its pools to
+    """
+    if not endpoint:
+        raise ValueError("V3 pool state needs a REST endpoint to seed pools from")
+    conf = get_v3_pool_state_config()
+    return PoolStateEngine(producer, pools, session, endpoint, int(conf['seed_batch_size']),
+                           max_pending=int(conf['max_pending_logs']), reseed_interval=float(conf['reseed_interval']))